@@ -0,0 +1,302 @@
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from results import RESULTS_FILE, QUESTION_START
+
+# --- CONFIGURATION ---
+ANSWER_BANK_PATH = "answer_bank.txt"   # `export` default; a .json path writes JSON instead
+SHINGLE_SIZE = 5          # characters per shingle of the normalised question
+NUM_PERM = 128            # MinHash permutations per question
+BANDS = 16                # LSH bands of NUM_PERM // BANDS rows: pairs above ~0.7 similarity share a bucket
+SIMILARITY = 0.7          # estimated Jaccard similarity for two questions to count as the same
+MAX_CANDIDATES = 200      # bucket neighbours compared per new question
+COMMIT_EVERY = 1000       # questions per transaction while the bank is being built
+SEED = 20240517
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Stored signatures are only comparable with ones made with the same settings; the bank is
+# rebuilt when these change.
+PARAMS = f"v1/{SHINGLE_SIZE}/{NUM_PERM}/{BANDS}/{SIMILARITY}/{SEED}"
+_PERMUTATIONS = np.random.RandomState(SEED).randint(1, 1 << 32, size=(2, NUM_PERM), dtype=np.uint64)
+
+# A choice answer ("B", "**B.** Paris", "(c)", "A, C", "Option D - ...") is compared by its letters only.
+CHOICE = re.compile(r"^(?:option|choice|phương án)?\s*\(?([a-h](?:\s*[,&]\s*[a-h]|\s+and\s+[a-h])*)\)?(?:$|[.):;,]|\s+[-–—])")
+MARKDOWN = re.compile(r"[*_`#>]+")
+NON_WORD = re.compile(r"[\W_]+")
+
+def normalise_question(question):
+    """Lower-case words of a question without its "Question 3:" heading, markdown or punctuation."""
+    text = QUESTION_START.sub("", question, count=1)
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return NON_WORD.sub(" ", text).strip()
+
+def display_question(question):
+    """A question as shown in the bank: its text without the "Question 3:" heading of its source."""
+    return QUESTION_START.sub("", question, count=1).lstrip(" \t:.)*_").strip() or question.strip()
+
+def answer_key(answer):
+    """What two answers must share to agree: the chosen letters, or else the first line of the text."""
+    text = MARKDOWN.sub("", unicodedata.normalize("NFKC", answer or "").casefold()).strip()
+    match = CHOICE.match(text)
+    if match:
+        return ",".join(re.findall(r"[a-h]", match.group(1)))
+    lines = text.splitlines()
+    return NON_WORD.sub(" ", lines[0]).strip() if lines else ""
+
+def minhash(text):
+    """MinHash signature (NUM_PERM uint32 values) of the character shingles of a normalised question."""
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    a, b = _PERMUTATIONS
+    return (((hashes[:, None] * a + b) % MERSENNE_PRIME) & MAX_HASH).min(axis=0).astype(np.uint32)
+
+def lsh_buckets(signature):
+    """One bucket key per band; questions sharing any bucket are compared."""
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(bytes([band]) + signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8)
+        keys.append(int.from_bytes(digest.digest(), "big", signed=True))
+    return keys
+
+class AnswerBank:
+    """
+    Consolidated answer bank over the questions in the results store: near-identical questions
+    from different images are clustered into one entry with its source images, the answer most
+    of them give and any disagreement. Questions are matched by MinHash signatures through LSH
+    buckets, so adding a question costs a few index lookups instead of a comparison with every
+    stored question. The bank lives in the results database; `update` folds in the questions
+    stored since the last update, and questions of re-processed images drop out with them.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bank_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bank_clusters ("
+            " id INTEGER PRIMARY KEY, question TEXT NOT NULL, answer TEXT NOT NULL,"
+            " size INTEGER NOT NULL, variants INTEGER NOT NULL, updated REAL NOT NULL)")
+        # cluster_id is NULL for pairs without question text, which are only marked as seen.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bank_members ("
+            " question_id INTEGER PRIMARY KEY REFERENCES questions(id) ON DELETE CASCADE,"
+            " cluster_id INTEGER, text_hash TEXT NOT NULL, answer_key TEXT NOT NULL, signature BLOB)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bank_members_cluster ON bank_members(cluster_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bank_members_text ON bank_members(text_hash)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bank_buckets ("
+            " bucket INTEGER NOT NULL,"
+            " question_id INTEGER NOT NULL REFERENCES bank_members(question_id) ON DELETE CASCADE)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bank_buckets_bucket ON bank_buckets(bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bank_buckets_member ON bank_buckets(question_id)")
+        row = self._conn.execute("SELECT value FROM bank_meta WHERE key = 'params'").fetchone()
+        if row is None or row[0] != PARAMS:
+            self._clear()
+        self._conn.commit()
+
+    def _clear(self):
+        self._conn.execute("DELETE FROM bank_buckets")
+        self._conn.execute("DELETE FROM bank_members")
+        self._conn.execute("DELETE FROM bank_clusters")
+        self._conn.execute("INSERT OR REPLACE INTO bank_meta (key, value) VALUES ('params', ?)", (PARAMS,))
+
+    def rebuild(self):
+        """Drops every entry; the next `update` clusters all stored questions again."""
+        with self._lock:
+            self._clear()
+            self._conn.commit()
+
+    def _match(self, text_hash, signature):
+        """The cluster of the most similar stored question, or None when nothing is similar enough."""
+        row = self._conn.execute(
+            "SELECT cluster_id FROM bank_members WHERE text_hash = ? AND cluster_id IS NOT NULL LIMIT 1",
+            (text_hash,)).fetchone()
+        if row is not None:
+            return row[0]
+        buckets = lsh_buckets(signature)
+        candidates = self._conn.execute(
+            f"SELECT DISTINCT m.question_id, m.cluster_id, m.signature FROM bank_buckets b"
+            f" JOIN bank_members m ON m.question_id = b.question_id"
+            f" WHERE b.bucket IN ({','.join('?' * len(buckets))}) LIMIT ?",
+            (*buckets, MAX_CANDIDATES)).fetchall()
+        if not candidates:
+            return None
+        others = np.frombuffer(b"".join(candidate[2] for candidate in candidates), dtype=np.uint32)
+        similarity = (others.reshape(len(candidates), NUM_PERM) == signature).mean(axis=1)
+        best = int(similarity.argmax())
+        return candidates[best][1] if similarity[best] >= SIMILARITY else None
+
+    def _add(self, question_id, question, answer, touched):
+        text = normalise_question(question)
+        key = answer_key(answer)
+        if not text:
+            self._conn.execute("INSERT INTO bank_members (question_id, text_hash, answer_key) VALUES (?, '', ?)",
+                               (question_id, key))
+            return
+        text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        signature = minhash(text)
+        cluster_id = self._match(text_hash, signature)
+        if cluster_id is None:
+            cluster_id = self._conn.execute(
+                "INSERT INTO bank_clusters (question, answer, size, variants, updated) VALUES (?, '', 0, 0, ?)",
+                (question, time.time())).lastrowid
+        touched.add(cluster_id)
+        self._conn.execute(
+            "INSERT INTO bank_members (question_id, cluster_id, text_hash, answer_key, signature) VALUES (?, ?, ?, ?, ?)",
+            (question_id, cluster_id, text_hash, key, signature.tobytes()))
+        self._conn.executemany("INSERT INTO bank_buckets (bucket, question_id) VALUES (?, ?)",
+                               [(bucket, question_id) for bucket in lsh_buckets(signature)])
+
+    def _refresh(self, cluster_id):
+        """Recomputes one entry's representative question, majority answer and counts."""
+        rows = self._conn.execute(
+            "SELECT m.answer_key, q.question, q.answer FROM bank_members m JOIN questions q ON q.id = m.question_id"
+            " WHERE m.cluster_id = ? ORDER BY q.id", (cluster_id,)).fetchall()
+        if not rows:
+            self._conn.execute("DELETE FROM bank_clusters WHERE id = ?", (cluster_id,))
+            return
+        votes = Counter(key for key, _, _ in rows if key)
+        majority = votes.most_common(1)[0][0] if votes else ""
+        answer = next((text for key, _, text in rows if key == majority), "")
+        self._conn.execute(
+            "UPDATE bank_clusters SET question = ?, answer = ?, size = ?, variants = ?, updated = ? WHERE id = ?",
+            (display_question(rows[0][1]), answer, len(rows), len(votes), time.time(), cluster_id))
+
+    def update(self):
+        """Clusters the questions stored since the last update. Returns how many were added."""
+        with self._lock:
+            # Entries whose questions were removed with a re-processed image are recounted.
+            touched = {row[0] for row in self._conn.execute(
+                "SELECT id FROM bank_clusters c"
+                " WHERE size != (SELECT COUNT(*) FROM bank_members m WHERE m.cluster_id = c.id)")}
+            rows = self._conn.execute(
+                "SELECT q.id, q.question, q.answer FROM questions q"
+                " LEFT JOIN bank_members m ON m.question_id = q.id WHERE m.question_id IS NULL ORDER BY q.id").fetchall()
+            added = 0
+            for question_id, question, answer in rows:
+                try:
+                    self._add(question_id, question, answer, touched)
+                except sqlite3.IntegrityError:
+                    continue    # the image was re-processed while the bank was being updated
+                added += 1
+                if added % COMMIT_EVERY == 0:
+                    for cluster_id in touched:
+                        self._refresh(cluster_id)
+                    touched.clear()
+                    self._conn.commit()
+            for cluster_id in touched:
+                self._refresh(cluster_id)
+            self._conn.commit()
+        return added
+
+    def entries(self, conflicts_only=False):
+        """
+        Returns the bank as [(question, answer, votes, sources)] in the order questions were first
+        seen: `votes` maps each distinct answer to how many sources give it, and `sources` lists
+        (filename, number, answer) for every image the question was extracted from.
+        """
+        with self._lock:
+            clusters = self._conn.execute(
+                "SELECT id, question, answer FROM bank_clusters" + (" WHERE variants > 1" if conflicts_only else "")
+                + " ORDER BY id").fetchall()
+            members = {}
+            for cluster_id, filename, number, answer, key in self._conn.execute(
+                    "SELECT m.cluster_id, r.filename, q.number, q.answer, m.answer_key FROM bank_members m"
+                    " JOIN questions q ON q.id = m.question_id JOIN results r ON r.id = q.result_id"
+                    " WHERE m.cluster_id IS NOT NULL ORDER BY r.attachment_id, r.filename, q.number"):
+                members.setdefault(cluster_id, []).append((filename, number, answer, key))
+        bank = []
+        for cluster_id, question, answer in clusters:
+            sources = members.get(cluster_id, [])
+            labels = {}
+            for _, _, text, key in sources:
+                if key:
+                    labels.setdefault(key, text.strip().splitlines()[0] if text.strip() else key)
+            votes = Counter(labels[key] for _, _, _, key in sources if key)
+            bank.append((question, answer, dict(votes.most_common()),
+                         [(filename, number, text) for filename, number, text, _ in sources]))
+        return bank
+
+    def export(self, path=ANSWER_BANK_PATH):
+        """Writes the bank as text, or as JSON when `path` ends in .json. Returns the number of entries."""
+        bank = self.entries()
+        with open(path, "w", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                json.dump([{'question': question, 'answer': answer, 'votes': votes,
+                            'sources': [{'file': filename, 'number': number, 'answer': text}
+                                        for filename, number, text in sources]}
+                           for question, answer, votes, sources in bank], f, ensure_ascii=False, indent=1)
+            else:
+                for entry in bank:
+                    f.write(format_entry(*entry) + "\n")
+        return len(bank)
+
+    def stats(self):
+        with self._lock:
+            questions = self._conn.execute("SELECT COUNT(*) FROM bank_members WHERE cluster_id IS NOT NULL").fetchone()[0]
+            entries, conflicts = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(variants > 1), 0) FROM bank_clusters").fetchone()
+        return {'questions': questions, 'entries': entries, 'conflicts': conflicts}
+
+    def summary(self):
+        """One-line report for the logs."""
+        stats = self.stats()
+        return (f"Answer bank: {stats['questions']} questions in {stats['entries']} entries, "
+                f"{stats['conflicts']} with conflicting answers.")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def format_entry(question, answer, votes, sources):
+    """Formats one bank entry for the text export or the console."""
+    lines = [f"--- {len(sources)} source{'s' if len(sources) != 1 else ''} ---", question,
+             f"**Answer:** {answer or '(no separate answer found)'}"]
+    if len(votes) > 1:
+        lines.append("[DISAGREEMENT] " + "; ".join(f"{label}: {count}" for label, count in votes.items()))
+    lines.append("Sources: " + ", ".join(f"{filename} #{number}" for filename, number, _ in sources))
+    return "\n".join(lines) + "\n"
+
+# --- SCRIPT EXECUTION ---
+USAGE = """Usage:
+  python answerbank.py update          Cluster the questions stored since the last update
+  python answerbank.py export [file]   Write the answer bank (default: answer_bank.txt; a .json file writes JSON)
+  python answerbank.py conflicts       Show the questions whose sources disagree on the answer
+  python answerbank.py rebuild         Cluster every stored question again from scratch"""
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('update', 'export', 'conflicts', 'rebuild'):
+        print(USAGE)
+        sys.exit(1)
+    # Opening the store first creates the tables the bank refers to.
+    from results import ResultStore
+    ResultStore().close()
+    bank = AnswerBank()
+    if sys.argv[1] == 'rebuild':
+        bank.rebuild()
+    start = time.perf_counter()
+    added = bank.update()
+    print(f"{added} new questions clustered in {time.perf_counter() - start:.1f} s. {bank.summary()}")
+    if sys.argv[1] == 'export':
+        path = sys.argv[2] if len(sys.argv) > 2 else ANSWER_BANK_PATH
+        print(f"Exported {bank.export(path)} entries to '{path}'.")
+    elif sys.argv[1] == 'conflicts':
+        for entry in bank.entries(conflicts_only=True):
+            print(format_entry(*entry))
+    bank.close()
@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+import time
+
+from processor import (PROMPT, image_part, load_pil_image, generate_from_image, get_model, prepare_image,
+                       record_usage, resolve_target, error_message)
+from downloader import backoff_delay
+from parallel import MAX_RETRIES, BASE_BACKOFF, throttle_errors
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+DEFAULT_BATCH_SIZE = 4
+MAX_BATCH_SIZE = 16
+TARGET_LATENCY = 40.0         # seconds per batch request; the batch only grows while well below this
+MAX_BATCH_OUTPUT_TOKENS = 6000  # keep a batch's answers far from the model's output limit
+BATCH_INSTRUCTIONS = (
+    "Several images follow, each preceded by a line 'Source: <filename>'. Answer every image separately. "
+    "Reply with a JSON array holding one object per image: 'source' is the filename exactly as given "
+    "and 'answer' is the full answer for that image.")
+RESPONSE_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {'source': {'type': 'STRING'}, 'answer': {'type': 'STRING'}},
+        'required': ['source', 'answer'],
+    },
+}
+BATCH_CONFIG = {'response_mime_type': 'application/json', 'response_schema': RESPONSE_SCHEMA}
+
+class MalformedBatch(Exception):
+    """The model's answer to a batch could not be split back into per-image answers."""
+
+def parse_batch_response(text, sources):
+    """
+    Splits a batch response into {source: answer}. Entries for unknown sources are dropped;
+    raises MalformedBatch when the JSON is unusable or no requested source was answered.
+    """
+    try:
+        entries = json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise MalformedBatch(f"response is not valid JSON: {e}")
+    if not isinstance(entries, list):
+        raise MalformedBatch("response is not a JSON array")
+    answers = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        source, answer = entry.get('source'), entry.get('answer')
+        if source in sources and isinstance(answer, str) and answer.strip():
+            answers[source] = answer
+    if not answers:
+        raise MalformedBatch("no image of the batch was answered")
+    return answers
+
+class BatchSizer:
+    """
+    Adapts the number of images per request. The size grows by one while the last batch
+    stayed well below the latency target and output-token budget, shrinks by one when it
+    exceeded either, and is halved when a batch had to be split.
+    """
+
+    def __init__(self, size=DEFAULT_BATCH_SIZE, max_size=MAX_BATCH_SIZE,
+                 target_latency=TARGET_LATENCY, max_output_tokens=MAX_BATCH_OUTPUT_TOKENS):
+        self.size = max(1, min(size, max_size))
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_output_tokens = max_output_tokens
+
+    def observe(self, count, latency, output_tokens):
+        """Books one successful batch of `count` images."""
+        if count < self.size:
+            return   # a partial batch (the end of the run) says little about the next size
+        grown = (count + 1) / count
+        if latency > self.target_latency or output_tokens > self.max_output_tokens:
+            self.size = max(1, self.size - 1)
+        elif latency * grown < self.target_latency and output_tokens * grown < self.max_output_tokens:
+            self.size = min(self.max_size, self.size + 1)
+
+    def failed(self, count):
+        self.size = max(1, min(self.size, count // 2))
+
+class BatchProcessor:
+    """
+    Answers images K at a time: one generate_content call carries several images and a
+    schema-constrained JSON reply keyed by source filename, which is split back into
+    per-image answers. Malformed or oversized batches are retried as two halves, down to
+    single-image requests. Throttled requests (429/503) shrink the batch size and are retried
+    with backoff like in ParallelProcessor. Cache hits and near-duplicates never enter a batch.
+    """
+
+    def __init__(self, prompt=PROMPT, api_key=None, cache=None, index=None, preprocessor=None,
+                 batch_size=DEFAULT_BATCH_SIZE, log=print, cancel_event=None):
+        self.prompt = prompt
+        self.cache = cache
+        self.index = index
+        self.preprocessor = preprocessor
+        self.sizer = BatchSizer(batch_size)
+        self.log = log
+        self.cancel_event = cancel_event or threading.Event()
+        self.requests = 0
+        self.throttled = 0
+        self.latencies = {}
+        self.model = get_model(api_key)
+
+    def solve(self, image_paths):
+        """
+        Yields (image_path, answer, error, duplicate_of, latency) for every image, in input order.
+        Results are yielded as soon as every earlier image has been answered. `latency` is the
+        image's share of its request's time, None for cache hits and near-duplicates.
+        """
+        answers = {}
+        waiting = []     # (image_path, target, duplicate_of) not yet yielded
+        pending = []     # prepared requests for the next batch
+        queued = set()
+        for image_path in image_paths:
+            try:
+                target, duplicate_of = resolve_target(image_path, self.index)
+            except Exception as e:
+                target, duplicate_of = image_path, None
+                answers[target] = (None, error_message(image_path, e))
+            waiting.append((image_path, target, duplicate_of))
+            if target not in answers and target not in queued:
+                request = self._prepare(target, answers)
+                if request is not None:
+                    pending.append(request)
+                    queued.add(target)
+            if len(pending) >= self.sizer.size:
+                self._flush(pending, answers)
+                pending, queued = [], set()
+            yield from self._ready(waiting, answers)
+        if pending:
+            self._flush(pending, answers)
+        yield from self._ready(waiting, answers)
+
+    def summary(self):
+        return (f"Batching: {self.requests} requests sent, {self.throttled} throttled, "
+                f"final batch size {self.sizer.size}.")
+
+    def _call(self, count, call):
+        """
+        Runs one model request for `count` images and returns (response, latency). While the API
+        throttles it, the batch size is halved and the request retried with backoff; the last
+        throttle error (or any other error) is raised.
+        """
+        throttled_by = throttle_errors()
+        for attempt in range(MAX_RETRIES):
+            start = time.monotonic()
+            try:
+                self.requests += 1
+                return call(), time.monotonic() - start
+            except throttled_by as e:
+                self.throttled += 1
+                METRICS.count('gemini_throttled')
+                self.sizer.failed(count)
+                if attempt + 1 == MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, BASE_BACKOFF)
+                self.log(f"  -> Rate limited on a request for {count} images; batch size now {self.sizer.size}, "
+                         f"retrying in {delay:.1f} seconds...")
+                if self.cancel_event.wait(delay):
+                    raise
+
+    def _ready(self, waiting, answers):
+        while waiting and waiting[0][1] in answers:
+            image_path, target, duplicate_of = waiting.pop(0)
+            answer, error = answers[target]
+            yield image_path, answer, error, duplicate_of, None if duplicate_of else self.latencies.pop(target, None)
+
+    def _prepare(self, target, answers):
+        """Returns the request for an image, or None when it was answered from the cache (or failed)."""
+        try:
+            key, cached, data, mime_type, report = prepare_image(target, self.prompt, self.cache, self.preprocessor)
+        except Exception as e:
+            answers[target] = (None, error_message(target, e))
+            return None
+        if cached is not None:
+            METRICS.count('gemini_cache_hits')
+            answers[target] = (cached, None)
+            return None
+        return {'path': target, 'key': key, 'data': data, 'mime_type': mime_type, 'report': report}
+
+    def _flush(self, requests, answers):
+        for request, answer, error in self._send(requests):
+            answers[request['path']] = (answer, error)
+            if error:
+                continue
+            if self.preprocessor is not None:
+                self.preprocessor.record(request['report'], None)
+            if self.cache is not None:
+                self.cache.put(request['key'], answer)
+
+    def _part(self, request):
+        part = image_part(request['path'], request['data'], request['mime_type'])
+        return part if part is not None else load_pil_image(request['path'])
+
+    def _send(self, requests):
+        """Yields (request, answer, error) for a batch, splitting it whenever the reply is unusable."""
+        from google.api_core import exceptions as api_exceptions
+        if len(requests) == 1:
+            yield self._send_single(requests[0])
+            return
+        sources = {}
+        for request in requests:
+            source = os.path.basename(request['path'])
+            if source in sources:
+                # Representatives from an older run can share a filename with this folder's images.
+                source = f"{len(sources) + 1}-{source}"
+            sources[source] = request
+        contents = [f"{self.prompt}\n\n{BATCH_INSTRUCTIONS}"]
+        for source, request in sources.items():
+            contents.append(f"Source: {source}")
+            contents.append(self._part(request))
+        def call():
+            with METRICS.span('gemini_request', path='batch'):
+                return self.model.generate_content(contents, generation_config=BATCH_CONFIG)
+
+        try:
+            response, latency = self._call(len(requests), call)
+            record_usage(response, images=len(requests))
+            batch_answers = parse_batch_response(response.text, sources)
+        except (MalformedBatch, ValueError, api_exceptions.InvalidArgument) as e:
+            # ValueError: the SDK found no text (blocked or cut off); InvalidArgument: payload too large.
+            self.log(f"  -> Batch of {len(requests)} images failed ({e}); retrying as smaller batches.")
+            METRICS.count('gemini_batch_splits')
+            self.sizer.failed(len(requests))
+            half = len(requests) // 2
+            yield from self._send(requests[:half])
+            yield from self._send(requests[half:])
+            return
+        except Exception as e:
+            for request in requests:
+                yield request, None, error_message(request['path'], e)
+            return
+        usage = getattr(response, 'usage_metadata', None)
+        self.sizer.observe(len(requests), latency, getattr(usage, 'candidates_token_count', 0) or 0)
+        missing = [request for source, request in sources.items() if source not in batch_answers]
+        for source, answer in batch_answers.items():
+            self.latencies[sources[source]['path']] = latency / len(requests)
+            yield sources[source], answer, None
+        if missing:
+            self.log(f"  -> {len(missing)} images missing from the batch reply; asking again.")
+            yield from self._send(missing)
+
+    def _send_single(self, request):
+        try:
+            response, latency = self._call(1, lambda: generate_from_image(
+                self.model, self.prompt, request['path'], request['data'], request['mime_type']))
+            answer = response.text
+        except Exception as e:
+            return request, None, error_message(request['path'], e)
+        usage = getattr(response, 'usage_metadata', None)
+        self.latencies[request['path']] = latency
+        self.sizer.observe(1, latency, getattr(usage, 'candidates_token_count', 0) or 0)
+        return request, answer, None
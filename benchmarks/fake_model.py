@@ -0,0 +1,65 @@
+"""
+Offline stand-in for genai.GenerativeModel, for benchmarks. Install it with
+`processor.set_model(FakeModel(...))`; every processor path (single image, parallel,
+batched) then runs unchanged without network access or an API key.
+"""
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+# --- CONFIGURATION ---
+QUESTIONS_PER_IMAGE = 3
+TOKENS_PER_IMAGE = 260      # roughly what Gemini bills for one page-sized image
+TOKENS_PER_ANSWER = 40
+
+def fake_answer(number):
+    """Model-style text for one image: a few numbered questions with answers."""
+    return "\n".join(f"**Question {number * QUESTIONS_PER_IMAGE + i}:** Which option is correct?\n"
+                     f"**Answer:** {'ABCD'[(number + i) % 4]}" for i in range(1, QUESTIONS_PER_IMAGE + 1))
+
+class FakeModel:
+    """
+    Answers generate_content calls after a simulated latency of `latency` seconds plus
+    `per_image` seconds per image (gaussian `jitter`). `throttle_rate` is the chance of a
+    429 (TooManyRequests) and `error_rate` the chance of a 500 (InternalServerError).
+    Batched requests (with a generation_config) get the JSON array BatchProcessor asks for.
+    """
+
+    def __init__(self, latency=0.5, per_image=0.1, jitter=0.1, throttle_rate=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_image = per_image
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+
+    def generate_content(self, contents, generation_config=None):
+        sources = [part[len("Source: "):] for part in contents if isinstance(part, str) and part.startswith("Source: ")]
+        images = sum(1 for part in contents if not isinstance(part, str))
+        with self._lock:
+            self.calls += 1
+            number = self.images
+            self.images += images
+            delay = max(0.0, self._rng.gauss(self.latency + self.per_image * images, self.jitter))
+            roll = self._rng.random()
+        time.sleep(delay)
+        if roll < self.throttle_rate:
+            raise api_exceptions.TooManyRequests("Resource has been exhausted (fake quota).")
+        if roll < self.throttle_rate + self.error_rate:
+            raise api_exceptions.InternalServerError("Fake internal error.")
+        if generation_config is not None and sources:
+            text = json.dumps([{'source': source, 'answer': fake_answer(number + i)}
+                               for i, source in enumerate(sources)])
+        else:
+            text = fake_answer(number)
+        usage = SimpleNamespace(prompt_token_count=TOKENS_PER_IMAGE * images + 30,
+                                candidates_token_count=TOKENS_PER_ANSWER * QUESTIONS_PER_IMAGE * max(1, len(sources)))
+        usage.total_token_count = usage.prompt_token_count + usage.candidates_token_count
+        return SimpleNamespace(text=text, usage_metadata=usage)
@@ -0,0 +1,192 @@
+"""
+Local stand-in for the FUOverflow attachment server, for offline benchmarks.
+Serves synthetic WebP pages at /attachments/<base>.<id>/ to clients that send the
+xf_user/xf_session cookies, and can inject latency, missing IDs (404 gaps), 429 answers
+with Retry-After and connections reset halfway through a body. Supports HEAD and
+Range requests like the real site, so discovery and resumed downloads are exercised too.
+Used by benchmarks.throughput; point downloader.BASE_ATTACHMENT_URL at `FakeXenForo.url`.
+"""
+import io
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageChops, ImageDraw
+
+# --- CONFIGURATION ---
+BASE_NAME = "bench_-_sp_2025_-_re_0001-webp"
+START_ID = 100000
+COOKIES = {'xf_user': 'bench-user', 'xf_session': 'bench-session'}
+IMAGE_SIZE = (1000, 1300)
+VARIANTS = 8               # distinct synthetic pages; IDs cycle through them
+GRAIN = 16                 # scanner noise in grey levels; keeps pages ~230 KB, several download chunks,
+                           # so a reset halfway through a body leaves a partial file to resume
+ATTACHMENT_PATH = re.compile(r"^/attachments/([^/]+)\.(\d+)/?$")
+RANGE_HEADER = re.compile(r"^bytes=(\d+)-$")
+
+def synthetic_page(seed, size=IMAGE_SIZE):
+    """A white exam-like page of dark text bars with scanner grain, encoded as WebP."""
+    rng = random.Random(seed)
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    y = 60
+    while y < size[1] - 60:
+        x = 60
+        while x < size[0] - 100:
+            width = rng.randint(20, 90)
+            draw.rectangle((x, y, x + width, y + 14), fill=rng.randint(0, 60))
+            x += width + rng.randint(8, 16)
+        y += rng.choice((28, 28, 28, 56))
+    noise = Image.frombytes("L", size, rng.randbytes(size[0] * size[1]))
+    noise = noise.point(lambda value: 128 + (value - 128) * GRAIN // 128)
+    image = ImageChops.add(image, noise, offset=-128)
+    buffer = io.BytesIO()
+    image.save(buffer, "WEBP", quality=80)
+    return buffer.getvalue()
+
+class FakeXenForo:
+    """
+    Threaded HTTP server for one attachment series of `count` IDs starting at `start_id`.
+    `latency`/`jitter` are seconds of think time per request; `missing_rate` is the share
+    of IDs inside the series that answer 404; `throttle_rate` and `reset_rate` are the
+    chances that any request gets a 429 (with `retry_after`) or a connection reset.
+    """
+
+    def __init__(self, count=200, base_name=BASE_NAME, start_id=START_ID, latency=0.02, jitter=0.01,
+                 missing_rate=0.0, throttle_rate=0.0, reset_rate=0.0, retry_after=1, cookies=COOKIES,
+                 seed=0, port=0):
+        self.base_name = base_name
+        self.start_id = start_id
+        self.count = count
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.reset_rate = reset_rate
+        self.retry_after = retry_after
+        self.cookies = dict(cookies)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # The first ID always exists: it is the URL the user pastes.
+        ids = range(start_id + 1, start_id + count)
+        self.missing = set(self._rng.sample(ids, int(len(ids) * missing_rate)))
+        self.pages = [synthetic_page(seed * VARIANTS + i) for i in range(VARIANTS)]
+        self.stats = {'requests': 0, 'ok': 0, 'partial': 0, 'missing': 0, 'throttled': 0, 'reset': 0,
+                      'forbidden': 0}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Attachment base URL, to be assigned to downloader.BASE_ATTACHMENT_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/attachments/"
+
+    @property
+    def start_url(self):
+        """The URL of the first attachment, as a user would paste it."""
+        return f"{self.url}{self.base_name}.{self.start_id}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _roll(self):
+        """Returns (think_time, throttled, reset) for one request."""
+        with self._lock:
+            self.stats['requests'] += 1
+            think = max(0.0, self._rng.gauss(self.latency, self.jitter))
+            return think, self._rng.random() < self.throttle_rate, self._rng.random() < self.reset_rate
+
+    def _page(self, base_name, attach_id):
+        if base_name != self.base_name or not self.start_id <= attach_id < self.start_id + self.count:
+            return None
+        if attach_id in self.missing:
+            return None
+        return self.pages[attach_id % VARIANTS]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.respond(head=True)
+
+            def do_GET(self):
+                self.respond(head=False)
+
+            def send_empty(self, status, headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def respond(self, head):
+                think, throttled, reset = server._roll()
+                time.sleep(think)
+                cookies = dict(part.strip().split("=", 1) for part in self.headers.get("Cookie", "").split(";")
+                               if "=" in part)
+                if any(cookies.get(name) != value for name, value in server.cookies.items()):
+                    server._count('forbidden')
+                    return self.send_empty(403)
+                if throttled:
+                    server._count('throttled')
+                    return self.send_empty(429, [("Retry-After", str(server.retry_after))])
+                match = ATTACHMENT_PATH.match(self.path)
+                page = server._page(match.group(1), int(match.group(2))) if match else None
+                if page is None:
+                    server._count('missing')
+                    return self.send_empty(404)
+                offset = 0
+                range_match = RANGE_HEADER.match(self.headers.get("Range", ""))
+                if range_match:
+                    offset = int(range_match.group(1))
+                    if offset >= len(page):
+                        return self.send_empty(416, [("Content-Range", f"bytes */{len(page)}")])
+                body = page[offset:]
+                self.send_response(206 if offset else 200)
+                self.send_header("Content-Type", "image/webp")
+                self.send_header("Content-Length", str(len(body)))
+                if offset:
+                    self.send_header("Content-Range", f"bytes {offset}-{len(page) - 1}/{len(page)}")
+                self.end_headers()
+                if head:
+                    return
+                if reset:
+                    # Half the body, then a TCP RST: the client keeps a partial file to resume.
+                    server._count('reset')
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+                server._count('partial' if offset else 'ok')
+
+        return Handler
+
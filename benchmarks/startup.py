@@ -0,0 +1,57 @@
+"""
+Checks the cold-start import cost of the entry points with `python -X importtime`.
+Each module is imported in a fresh interpreter a few times; the best run must stay under
+the budget, and none of the heavy backends (Gemini SDK, Pillow, NumPy, requests) may be
+imported at startup: they are loaded by the first job that needs them.
+Exits with status 1 when a check fails, so it can guard a build.
+
+Usage: python -m benchmarks.startup [budget_ms] [module ...]   (default: gui_app cli, 250 ms)
+"""
+import os
+import re
+import subprocess
+import sys
+
+# --- CONFIGURATION ---
+MODULES = ("gui_app", "cli")
+BUDGET_MS = 250
+RUNS = 5
+TOP = 8
+HEAVY_MODULES = ("google.generativeai", "google.api_core", "PIL", "numpy", "requests")
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def import_times(module):
+    """Imports `module` in a fresh interpreter; returns [(self_us, cumulative_us, depth, name)]."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=root,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            entries.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return entries
+
+def check(module, budget_ms, runs=RUNS):
+    """Prints the report for one module and returns True if it is within budget and imports no backend."""
+    best = min((import_times(module) for _ in range(runs)), key=lambda entries: entries[-1][1])
+    total_ms = best[-1][1] / 1000
+    heavy = sorted({name for _, _, _, name in best
+                    if any(name == heavy or name.startswith(heavy + ".") for heavy in HEAVY_MODULES)})
+    ok = total_ms <= budget_ms and not heavy
+    print(f"{module}: {total_ms:.1f} ms (budget {budget_ms} ms, best of {runs}) -> {'OK' if ok else 'FAIL'}")
+    for self_us, cumulative_us, depth, name in sorted(best, key=lambda entry: -entry[0])[:TOP]:
+        print(f"  {self_us / 1000:7.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+    if heavy:
+        print(f"  Imported at startup but should be lazy: {', '.join(heavy)}")
+    return ok
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    budget = BUDGET_MS
+    if args and args[0].isdigit():
+        budget = int(args.pop(0))
+    results = [check(module, budget) for module in (args or MODULES)]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,175 @@
+"""
+Offline end-to-end benchmark. Starts a local stand-in for the attachment server
+(benchmarks.fake_server) and installs a fake Gemini model (benchmarks.fake_model), then
+drives the real code: URL parsing, range discovery, download_sequence /
+download_file_with_retry, the parallel or batched processor and the combined pipeline.
+Reports items/s, p50/p99 latency and peak RSS per stage. Faults are injectable, so
+retry, resume and backoff behaviour can be compared between runs without network access.
+
+Usage: python -m benchmarks.throughput [--files 200] [--missing 0.02] [--throttle 0.02] [--resets 0.02]
+                                       [--model-latency 0.5] [--batch-size 1] [--json results.json]
+       python -m benchmarks.throughput --help   (all options)
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+import downloader
+import processor
+from discovery import discover_range
+from downloader import RateLimiter, download_sequence, make_session, parse_url_pattern
+from metrics import METRICS, Histogram
+from parallel import ParallelProcessor
+from batching import BatchProcessor
+from pipeline import run_pipeline
+from benchmarks.fake_model import FakeModel
+from benchmarks.fake_server import COOKIES, FakeXenForo
+
+def peak_rss_mb():
+    """High-water resident set size of this process so far, in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def metric_percentiles(name):
+    """(p50, p99) of the busiest histogram called `name` in METRICS, or (None, None)."""
+    entries = [entry for entry in METRICS.summary()['histograms'] if entry['name'] == name]
+    if not entries:
+        return None, None
+    entry = max(entries, key=lambda entry: entry['count'])
+    return entry['p50'], entry['p99']
+
+def stage_result(name, items, errors, elapsed, p50, p99):
+    return {'stage': name, 'items': items, 'errors': errors, 'seconds': elapsed,
+            'items_per_sec': items / elapsed if elapsed else None, 'p50': p50, 'p99': p99,
+            'peak_rss_mb': peak_rss_mb()}
+
+def format_result(result):
+    def seconds(value):
+        return "-" if value is None else f"{value * 1000:.0f} ms"
+    rss = "-" if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f} MB"
+    return (f"{result['stage']:10} {result['items']:>6} {result['errors']:>6} {result['seconds']:>8.2f} "
+            f"{result['items_per_sec'] or 0:>9.1f} {seconds(result['p50']):>9} {seconds(result['p99']):>9} {rss:>9}")
+
+def bench_discovery(server, base_name, start_id, args, log):
+    METRICS.reset()
+    session = make_session(COOKIES, pool_size=1)
+    start = time.perf_counter()
+    before = server.stats['requests']
+    last_id, missing = discover_range(session, base_name, start_id, RateLimiter(rate=args.rate, burst=args.workers),
+                                      log=log)
+    elapsed = time.perf_counter() - start
+    session.close()
+    print(f"Discovery found IDs {start_id}-{last_id} ({last_id - start_id + 1} of {args.files} served, "
+          f"{len(missing)} gaps seen).")
+    return stage_result('discover', server.stats['requests'] - before, 0, elapsed, None, None)
+
+def bench_download(base_name, start_id, directory, args, log):
+    METRICS.reset()
+    start = time.perf_counter()
+    successful, skipped, _, failed = download_sequence(base_name, start_id, args.files, directory, COOKIES,
+                                                       workers=args.workers, rate=args.rate, log=log)
+    elapsed = time.perf_counter() - start
+    return stage_result('download', successful + skipped, len(failed), elapsed, *metric_percentiles('download_seconds'))
+
+def bench_process(directory, args, log):
+    METRICS.reset()
+    paths = [os.path.join(directory, filename) for filename in processor.list_images(directory)]
+    if args.batch_size > 1:
+        engine = BatchProcessor(batch_size=args.batch_size, log=log)
+    else:
+        engine = ParallelProcessor(max_concurrency=args.concurrency, log=log)
+    latencies = Histogram()
+    errors = 0
+    start = time.perf_counter()
+    for _, answer, error, _, latency in engine.solve(paths):
+        errors += 1 if error else 0
+        if latency is not None:
+            latencies.observe(latency)
+    elapsed = time.perf_counter() - start
+    print(engine.summary())
+    return stage_result('process', len(paths), errors, elapsed, latencies.percentile(50), latencies.percentile(99))
+
+def bench_pipeline(base_name, start_id, directory, args, log):
+    METRICS.reset()
+    start = time.perf_counter()
+    engine = ParallelProcessor(max_concurrency=args.concurrency, log=log)
+    processed, errors = run_pipeline(base_name, start_id, args.files, directory, COOKIES, None,
+                                     os.path.join(directory, "answers.txt"), download_workers=args.workers,
+                                     rate=args.rate, log=log, engine=engine)
+    elapsed = time.perf_counter() - start
+    return stage_result('pipeline', processed, errors, elapsed, *metric_percentiles('gemini_request_seconds'))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline download/processing benchmark.")
+    parser.add_argument("--files", type=int, default=200, help="attachments in the served series")
+    parser.add_argument("--workers", type=int, default=downloader.DEFAULT_WORKERS, help="download workers")
+    parser.add_argument("--rate", type=float, default=200.0, help="download requests per second")
+    parser.add_argument("--latency", type=float, default=0.02, help="server think time per request (s)")
+    parser.add_argument("--missing", type=float, default=0.0, help="share of IDs answering 404")
+    parser.add_argument("--throttle", type=float, default=0.0, help="chance of a 429 per request")
+    parser.add_argument("--resets", type=float, default=0.0, help="chance of a reset mid-body per request")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="fake model time per call (s)")
+    parser.add_argument("--model-per-image", type=float, default=0.1, help="extra fake model time per image (s)")
+    parser.add_argument("--model-throttle", type=float, default=0.0, help="chance of a model 429 per call")
+    parser.add_argument("--model-errors", type=float, default=0.0, help="chance of a model 500 per call")
+    parser.add_argument("--concurrency", type=int, default=8, help="max parallel model requests")
+    parser.add_argument("--batch-size", type=int, default=1, help="images per model request (1 = parallel)")
+    parser.add_argument("--stages", default="discover,download,process,pipeline", help="comma-separated stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the download and processor logs")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = args.stages.split(",")
+    log = print if args.verbose else (lambda message: None)
+    server = FakeXenForo(count=args.files, latency=args.latency, jitter=args.latency / 2, missing_rate=args.missing,
+                         throttle_rate=args.throttle, reset_rate=args.resets, retry_after=args.retry_after,
+                         seed=args.seed)
+    model = FakeModel(latency=args.model_latency, per_image=args.model_per_image, jitter=args.model_latency / 5,
+                      throttle_rate=args.model_throttle, error_rate=args.model_errors, seed=args.seed)
+    processor.set_model(model)
+    results = []
+    with server, tempfile.TemporaryDirectory(prefix="fuo-bench-") as workdir:
+        downloader.BASE_ATTACHMENT_URL = server.url
+        base_name, start_id = parse_url_pattern(server.start_url)
+        images = os.path.join(workdir, "images")
+        if 'discover' in stages:
+            results.append(bench_discovery(server, base_name, start_id, args, log))
+        if 'download' in stages or 'process' in stages:
+            results.append(bench_download(base_name, start_id, images, args, log))
+        if 'process' in stages:
+            results.append(bench_process(images, args, log))
+        if 'pipeline' in stages:
+            results.append(bench_pipeline(base_name, start_id, os.path.join(workdir, "pipeline"), args, log))
+        server_stats = dict(server.stats)
+
+    print(f"\n{'stage':10} {'items':>6} {'errors':>6} {'seconds':>8} {'items/s':>9} {'p50':>9} {'p99':>9} "
+          f"{'peak RSS':>9}")
+    for result in results:
+        print(format_result(result))
+    print("\nServer: " + ", ".join(f"{name} {value}" for name, value in server_stats.items()))
+    print(f"Model: {model.calls} calls for {model.images} images")
+    if server_stats['reset'] and not server_stats['partial']:
+        # Every reset leaves a partial file behind, so at least one Range request must have followed.
+        raise SystemExit("Connections were reset but no download resumed from a partial file.")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'stages': results, 'server': server_stats,
+                       'model': {'calls': model.calls, 'images': model.images}}, f, indent=1)
+        print(f"Results written to '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
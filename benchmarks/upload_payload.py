@@ -0,0 +1,57 @@
+"""
+Compares the request payload built for each image by the old PIL path and the raw-bytes path.
+No request is sent: both payloads go through the SDK's own blob conversion, which is where the
+PIL path decodes and re-encodes the image.
+
+Usage: python -m benchmarks.upload_payload <image directory>
+"""
+import os
+import sys
+import time
+
+from google.generativeai.types import content_types
+
+from processor import list_images, image_part, load_pil_image
+
+def measure(build, image_path):
+    """Returns (payload bytes, CPU seconds) for building one image's blob."""
+    start = time.process_time()
+    blob = content_types.to_blob(build(image_path))
+    return len(blob.data), time.process_time() - start
+
+def pil_payload(image_path):
+    return load_pil_image(image_path)
+
+def raw_payload(image_path):
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    return image_part(image_path, image_bytes) or load_pil_image(image_path)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or not os.path.isdir(sys.argv[1]):
+        print(__doc__.strip())
+        sys.exit(1)
+    image_dir = sys.argv[1]
+    filenames = list_images(image_dir)
+    if not filenames:
+        print("No images found.")
+        sys.exit(1)
+
+    totals = {'pil': [0, 0.0], 'raw': [0, 0.0]}
+    print(f"{'image':40} {'PIL bytes':>12} {'PIL ms':>8} {'raw bytes':>12} {'raw ms':>8}")
+    for filename in filenames:
+        path = os.path.join(image_dir, filename)
+        pil_bytes, pil_cpu = measure(pil_payload, path)
+        raw_bytes, raw_cpu = measure(raw_payload, path)
+        for name, size, cpu in (('pil', pil_bytes, pil_cpu), ('raw', raw_bytes, raw_cpu)):
+            totals[name][0] += size
+            totals[name][1] += cpu
+        print(f"{filename[:40]:40} {pil_bytes:>12,} {pil_cpu * 1000:>8.1f} {raw_bytes:>12,} {raw_cpu * 1000:>8.1f}")
+
+    count = len(filenames)
+    print("\n--- Summary ---")
+    for label, name in (("PIL decode + re-encode", 'pil'), ("Raw bytes", 'raw')):
+        size, cpu = totals[name]
+        print(f"{label:24} {size:>14,} bytes uploaded, {cpu * 1000 / count:.1f} ms CPU per image")
+    if totals['pil'][0]:
+        print(f"Upload reduced by {100.0 * (1 - totals['raw'][0] / totals['pil'][0]):.1f}%")
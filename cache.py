@@ -0,0 +1,96 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+# --- CONFIGURATION ---
+CACHE_FILE = "answer_cache.sqlite3"
+MAX_ENTRIES = 50000
+MAX_AGE_DAYS = 180
+
+def cache_key(image_bytes, prompt, model_name, variant=""):
+    """
+    Content address of one request: hash of the image bytes, the prompt and the model name.
+    `variant` names anything else that changes the request (e.g. a preprocessing profile).
+    """
+    digest = hashlib.sha256()
+    parts = [model_name.encode("utf-8"), prompt.encode("utf-8"), image_bytes]
+    if variant:
+        parts.append(variant.encode("utf-8"))
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+class AnswerCache:
+    """
+    Persistent SQLite cache of Gemini answers keyed by `cache_key`.
+    Entries are evicted by age and, past `max_entries`, least recently used first.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, answer TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """Returns the cached answer for `key`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now))
+            self._conn.commit()
+
+    def evict(self):
+        """Drops entries older than `max_age_days`, then the least recently used beyond `max_entries`."""
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute("DELETE FROM answers WHERE created < ?", (cutoff,))
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE key IN ("
+                    " SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def summary(self):
+        """One-line hit/miss report for the logs."""
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses']
+        rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+        return f"Cache: {stats['hits']} hits, {stats['misses']} misses ({rate:.0f}% hit rate), {stats['entries']} entries stored."
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,143 @@
+import argparse
+import os
+import sys
+import threading
+
+import core
+from downloader import DEFAULT_WORKERS, DEFAULT_RATE, parse_url_pattern
+from processor import OUTPUT_TXT_PATH, load_or_request_api_key
+from preprocess import PROFILES, DEFAULT_PROFILE
+from parallel import MAX_CONCURRENCY
+from prefilter import DEFAULT_MIN_SCORE, BLANK_PAGE_SCORE
+from watcher import DEBOUNCE
+from pack import PACK_SUFFIX, is_pack
+
+# --- SCRIPT EXECUTION ---
+# Non-interactive front end for the headless jobs in core.py:
+#   python cli.py download <first image URL> [--total N]
+#   python cli.py process <image directory> [--watch]
+#   python cli.py run <first image URL> [--total N]
+#   python cli.py jobs <job file (CSV or JSON)>
+# Cookies come from --xf-user/--xf-session or the FUO_XF_USER/FUO_XF_SESSION environment
+# variables; the API key from --api-key, GEMINI_API_KEY or config.txt (prompted if missing).
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Download FUOverflow attachments and solve them with Gemini.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def site_options(command):
+        command.add_argument("--xf-user", default=os.environ.get("FUO_XF_USER"), help="xf_user cookie value")
+        command.add_argument("--xf-session", default=os.environ.get("FUO_XF_SESSION"), help="xf_session cookie value")
+        command.add_argument("--dir", default=core.DOWNLOAD_DIRECTORY, help="download directory")
+        command.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="parallel downloads")
+        command.add_argument("--rate", type=float, default=DEFAULT_RATE, help="requests per second to the site")
+        command.add_argument("--pack", action="store_true",
+                             help=f"store the images in one pack file (<dir>{PACK_SUFFIX}) instead of loose files")
+
+    def download_options(command):
+        command.add_argument("url", help="URL of the FIRST image in the sequence")
+        command.add_argument("--total", type=int, help="number of images (default: find the end automatically)")
+        command.add_argument("--rediscover", action="store_true",
+                             help="probe for the end again instead of using the range cached in the last day")
+        site_options(command)
+
+    def process_options(command):
+        command.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"), help="Gemini API key")
+        command.add_argument("--output", default=OUTPUT_TXT_PATH, help="text file the answers are appended to")
+        command.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE, help="preprocessing profile")
+        command.add_argument("--no-dedup", action="store_true", help="answer identical images separately")
+        command.add_argument("--near-duplicates", action="store_true",
+                             help="also answer re-encoded or rescaled copies of a page once (pixel-checked)")
+        command.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE,
+                             help=f"skip pages whose question score is below this (default 0 = send every image; "
+                                  f"{BLANK_PAGE_SCORE} only drops blank pages)")
+        command.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY, help="max parallel requests")
+
+    download_options(commands.add_parser("download", help="download a sequence of images"))
+    process = commands.add_parser("process", help="answer every image in a directory")
+    process.add_argument("directory", help=f"directory (or {PACK_SUFFIX} file) containing the images")
+    process_options(process)
+    process.add_argument("--batch-size", type=int, default=1, help="images per request (1 = no batching)")
+    process.add_argument("--defer-low-score", action="store_true", help="answer low-scoring pages last instead of skipping them")
+    process.add_argument("--watch", action="store_true", help="keep running and answer images as they are added (Ctrl+C stops)")
+    process.add_argument("--debounce", type=float, default=DEBOUNCE,
+                         help="seconds a new image must stay unchanged before it is answered (with --watch)")
+    run = commands.add_parser("run", help="download a sequence and answer it at the same time")
+    download_options(run)
+    process_options(run)
+    jobs = commands.add_parser("jobs", help="download every sequence listed in a job file")
+    jobs.add_argument("job_file", help="CSV or JSON file with one sequence (url and optional total/end/directory) per entry")
+    jobs.add_argument("--rediscover", action="store_true",
+                      help="probe sets without a total for their end again instead of reusing earlier lengths")
+    site_options(jobs)
+    return parser
+
+def read_cookies(args):
+    xf_user = args.xf_user or input("Paste your xf_user cookie value: ")
+    xf_session = args.xf_session or input("Paste your xf_session cookie value: ")
+    return {'xf_user': xf_user, 'xf_session': xf_session}
+
+def read_sequence(args, cancel_event):
+    """Returns (base_name, start_id, total_files, cookies) from the arguments, or exits with an error."""
+    base_name, start_id = parse_url_pattern(args.url)
+    if base_name is None:
+        sys.exit("Error: Could not parse the URL. Please ensure it has a pattern like '.../some-filename.123456/'")
+    cookies = read_cookies(args)
+    total_files = args.total
+    if total_files is None:
+        total_files = core.discover(base_name, start_id, cookies, cancel_event=cancel_event, refresh=args.rediscover)
+        if total_files is None:
+            sys.exit(1)
+    return base_name, start_id, total_files, cookies
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cancel_event = threading.Event()
+    workspace = core.Workspace()
+    try:
+        if args.command == 'download':
+            base_name, start_id, total_files, cookies = read_sequence(args, cancel_event)
+            _, _, failed_urls = core.download(workspace, base_name, start_id, total_files, cookies, args.dir,
+                                              args.workers, args.rate, cancel_event=cancel_event, packed=args.pack)
+            status = 1 if failed_urls else 0
+        elif args.command == 'jobs':
+            sequences = core.download_jobs(workspace, args.job_file, read_cookies(args), args.dir, args.workers,
+                                           args.rate, cancel_event=cancel_event, packed=args.pack,
+                                           refresh=args.rediscover)
+            status = 1 if sequences is None or any(s.state in ('failed', 'cancelled') for s in sequences) else 0
+        elif args.command == 'process':
+            if not os.path.isdir(args.directory) and not is_pack(args.directory):
+                sys.exit(f"Error: '{args.directory}' is not a valid directory or pack file.")
+            if args.watch and is_pack(args.directory):
+                sys.exit("Error: --watch needs a directory, not a pack file.")
+            api_key = args.api_key or load_or_request_api_key()
+            options = dict(output_txt_path=args.output, profile=args.profile, batch_size=max(1, args.batch_size),
+                           max_concurrency=max(1, args.concurrency), dedup=not args.no_dedup,
+                           near_duplicates=args.near_duplicates, min_score=args.min_score,
+                           defer_low_score=args.defer_low_score, cancel_event=cancel_event)
+            if args.watch:
+                _, errors = core.watch(workspace, args.directory, api_key, debounce=args.debounce, **options)
+            else:
+                _, errors = core.process(workspace, args.directory, api_key, **options)
+            status = 1 if errors else 0
+        else:
+            api_key = args.api_key or load_or_request_api_key()
+            base_name, start_id, total_files, cookies = read_sequence(args, cancel_event)
+            _, errors = core.run(workspace, base_name, start_id, total_files, cookies, api_key,
+                                 output_txt_path=args.output, directory=args.dir, profile=args.profile,
+                                 dedup=not args.no_dedup, near_duplicates=args.near_duplicates,
+                                 min_score=args.min_score, workers=args.workers, rate=args.rate,
+                                 cancel_event=cancel_event, packed=args.pack,
+                                 max_concurrency=max(1, args.concurrency))
+            status = 1 if errors else 0
+    except KeyboardInterrupt:
+        cancel_event.set()
+        print("\nCancelled. Run again to resume where this run stopped.")
+        return 130
+    finally:
+        workspace.close()
+    core.report_metrics()
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
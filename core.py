@@ -0,0 +1,365 @@
+import os
+import threading
+
+from downloader import DEFAULT_WORKERS, DEFAULT_RATE, MAX_RETRIES, download_sequence
+from processor import PROMPT, OUTPUT_TXT_PATH, list_images, write_result
+from preprocess import Preprocessor, DEFAULT_PROFILE
+from prefilter import Prefilter, DEFAULT_MIN_SCORE
+from parallel import ParallelProcessor, MAX_CONCURRENCY
+from batching import BatchProcessor
+from pipeline import run_pipeline
+from jobqueue import JobQueue, JobFileError, load_jobs
+from cache import AnswerCache
+from journal import Journal
+from results import ResultStore
+from discovery import discover_total, ProbeError, RangeCache
+from watcher import FolderWatcher, DEBOUNCE, POLL_INTERVAL
+from pack import PACK_SUFFIX, file_stat, is_pack, open_pack
+from metrics import METRICS, METRICS_JSON, METRICS_PROM
+
+# --- CONFIGURATION ---
+DOWNLOAD_DIRECTORY = "downloaded_images"
+
+# Headless jobs shared by the GUI, cli.py and the interactive scripts. Nothing here (or in the
+# modules above) imports the Gemini SDK, Pillow, NumPy or requests at import time; each backend
+# is loaded by the first job that needs it, so starting the GUI or a download stays fast.
+
+class Workspace:
+    """
+    The state files every run shares: answer cache, near-duplicate index, job journal and
+    results store. Each one is opened on first use and then reused by later runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = None
+        self._index = None
+        self._journal = None
+        self._store = None
+        self._bank = None
+
+    def cache(self):
+        with self._lock:
+            if self._cache is None:
+                self._cache = AnswerCache()
+            return self._cache
+
+    def index(self, near_duplicates=False):
+        """
+        The PerceptualIndex; importing it loads NumPy and Pillow. It merges identical pages only,
+        or also re-encoded copies with `near_duplicates` (the index is rebuilt when that changes).
+        """
+        from dedup import PerceptualIndex, DEFAULT_THRESHOLD, NEAR_THRESHOLD
+        threshold = NEAR_THRESHOLD if near_duplicates else DEFAULT_THRESHOLD
+        with self._lock:
+            if self._index is not None and self._index.threshold != threshold:
+                self._index.save()
+                self._index = None
+            if self._index is None:
+                self._index = PerceptualIndex(threshold=threshold)
+            return self._index
+
+    def journal(self):
+        with self._lock:
+            if self._journal is None:
+                self._journal = Journal()
+            return self._journal
+
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                self._store = ResultStore()
+            return self._store
+
+    def bank(self):
+        """The AnswerBank over the results store; importing it loads NumPy."""
+        with self._lock:
+            if self._bank is None:
+                from answerbank import AnswerBank
+                self._bank = AnswerBank()
+            return self._bank
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.save()
+            for opened in (self._cache, self._journal, self._bank, self._store):
+                if opened is not None:
+                    opened.close()
+            self._cache = self._index = self._journal = self._store = self._bank = None
+
+def discover(base_name, start_id, cookies, log=print, cancel_event=None, refresh=False):
+    """
+    Finds the number of files in a sequence. Ranges are cached per base name for a day;
+    `refresh` probes again anyway. Returns None on failure.
+    """
+    log("Total not given; discovering where the sequence ends...")
+    try:
+        return discover_total(base_name, start_id, cookies, cache=RangeCache(), refresh=refresh, log=log,
+                              cancel_event=cancel_event)
+    except ProbeError as e:
+        log(f"Discovery failed: {e}")
+        return None
+
+def download(workspace, base_name, start_id, total_files, cookies, directory=DOWNLOAD_DIRECTORY,
+             workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, max_retries=MAX_RETRIES, log=print, cancel_event=None,
+             progress=None, packed=False):
+    """
+    Downloads a sequence, resuming through the workspace journal; with `packed` the images go
+    into `<directory>.pack` instead of loose files. Returns (successful, skipped, failed_urls).
+    """
+    if progress is not None:
+        progress.start(total_files)
+    log("--- Starting Batch Download ---")
+    successful, skipped, missing, failed_urls = download_sequence(
+        base_name, start_id, total_files, directory, cookies, workers=workers, rate=rate, max_retries=max_retries,
+        log=log, cancel_event=cancel_event, journal=workspace.journal(), progress=progress,
+        pack=open_pack(directory + PACK_SUFFIX) if packed else None)
+    log("\n--- Download Finished ---")
+    log(f"Summary: {successful} downloaded, {skipped} skipped, {missing} missing on the server, "
+        f"{len(failed_urls)} failed (out of {total_files} total).")
+    if failed_urls:
+        log("Failed URLs:\n" + "\n".join(failed_urls))
+    return successful, skipped, failed_urls
+
+def download_jobs(workspace, job_file, cookies, directory=DOWNLOAD_DIRECTORY, workers=DEFAULT_WORKERS,
+                  rate=DEFAULT_RATE, max_retries=MAX_RETRIES, log=print, cancel_event=None, progress=None,
+                  packed=False, refresh=False):
+    """
+    Downloads every sequence of a job file in one run, each into its own folder under
+    `directory` (or its own pack file with `packed`). Returns the list of Sequences with their
+    results, or None when the job file is invalid.
+    """
+    try:
+        sequences = load_jobs(job_file, directory)
+    except JobFileError as e:
+        log(f"Error: {e}")
+        return None
+    log(f"--- Starting Job Queue: {len(sequences)} sets from '{job_file}' ---")
+    JobQueue(sequences, cookies, workers, rate, max_retries, journal=workspace.journal(), log=log,
+             cancel_event=cancel_event, progress=progress, packed=packed, refresh=refresh).run()
+    log("\n--- Job Queue Finished ---")
+    for sequence in sequences:
+        log(f"{sequence.name}: {sequence.state} ({sequence.successful} downloaded, {sequence.skipped} skipped, "
+            f"{len(sequence.failed_urls)} failed)")
+    failed_urls = [url for sequence in sequences for url in sequence.failed_urls]
+    if failed_urls:
+        log("Failed URLs:\n" + "\n".join(failed_urls))
+    return sequences
+
+def _open_engine(workspace, prompt, api_key, profile, batch_size, max_concurrency, dedup, near_duplicates,
+                 min_score, defer_low_score, log, cancel_event):
+    """
+    Returns (engine, preprocessor, prefilter, index) for answering images; close the
+    preprocessor and the prefilter when done.
+    """
+    index = workspace.index(near_duplicates) if dedup else None
+    preprocessor = Preprocessor(profile, log=log)
+    prefilter = Prefilter(min_score, defer_low_score, log=log)
+    if batch_size > 1:
+        engine = BatchProcessor(prompt, api_key, workspace.cache(), index, preprocessor, batch_size, log=log,
+                                cancel_event=cancel_event)
+    else:
+        engine = ParallelProcessor(prompt, api_key, workspace.cache(), index, preprocessor, max_concurrency, log=log,
+                                   cancel_event=cancel_event)
+    return engine, preprocessor, prefilter, index
+
+def _answer(workspace, job, image_paths, engine, prefilter, index, output_file, log, progress, cancel_event):
+    """
+    Answers one list of images not yet answered for `job` and writes every result to the text
+    output, the results store and the journal. Returns (processed, errors, duplicates).
+    """
+    journal, store = workspace.journal(), workspace.store()
+    processed, errors, duplicates = 0, 0, 0
+    image_paths, skipped = prefilter.split(image_paths)
+    if index is not None:
+        index.add_many(image_paths)
+    for full_path, note, score in skipped:
+        write_result(output_file, os.path.basename(full_path), note, None)
+        store.add(full_path, note, skipped=True)
+        journal.mark_processed(job, full_path, 'skipped', score, prefilter.min_score)
+        processed += 1
+        if progress is not None:
+            progress.update()
+    output_file.flush()
+    for full_path, answer, error, duplicate_of, latency in engine.solve(image_paths):
+        filename = os.path.basename(full_path)
+        if progress is not None:
+            progress.update(nbytes=file_stat(full_path)[0], error=bool(error))
+        log(f"Processed image: {filename}")
+        if error:
+            log(f"  -> ERROR: {error}")
+        elif duplicate_of:
+            duplicates += 1
+            log(f"  -> Duplicate of {duplicate_of}, reused its answer.")
+        else:
+            log("  -> Success.")
+        write_result(output_file, filename, answer, error)
+        output_file.flush()
+        store.add(full_path, answer, error, latency)
+        journal.mark_processed(job, full_path, 'error' if error else 'done')
+        processed += 1
+        errors += 1 if error else 0
+        if cancel_event is not None and cancel_event.is_set():
+            break
+    if index is not None:
+        index.save()
+    return processed, errors, duplicates
+
+def process(workspace, image_dir, api_key=None, prompt=PROMPT, output_txt_path=OUTPUT_TXT_PATH,
+            profile=DEFAULT_PROFILE, batch_size=1, max_concurrency=MAX_CONCURRENCY, dedup=True,
+            near_duplicates=False, min_score=DEFAULT_MIN_SCORE, defer_low_score=False, log=print, progress=None,
+            cancel_event=None):
+    """
+    Answers every image of a folder that the journal has not answered for `output_txt_path` yet,
+    appending the results to the text output and the results store. More than one image per
+    request uses the BatchProcessor, otherwise requests run in parallel. Images the prefilter
+    scores below `min_score` are recorded as skipped (or answered last with `defer_low_score`).
+    Returns (processed, errors).
+    """
+    log(f"Processing images in: {image_dir}")
+    log(f"Results will be saved to: {output_txt_path}\n")
+    engine, preprocessor, prefilter, index = _open_engine(
+        workspace, prompt, api_key, profile, batch_size, max_concurrency, dedup, near_duplicates, min_score,
+        defer_low_score, log, cancel_event)
+    try:
+        job = os.path.abspath(output_txt_path)
+        all_paths = [os.path.join(image_dir, filename) for filename in list_images(image_dir)]
+        image_paths = workspace.journal().pending_images(job, all_paths, prefilter.skip_below)
+        if len(image_paths) < len(all_paths):
+            log(f"Resuming: {len(all_paths) - len(image_paths)} images were already answered in an earlier run.")
+        if progress is not None:
+            progress.start(len(image_paths))
+        with open(output_txt_path, "a", encoding="utf-8") as output_file:
+            processed, errors, duplicates = _answer(workspace, job, image_paths, engine, prefilter, index,
+                                                    output_file, log, progress, cancel_event)
+    finally:
+        preprocessor.close()
+        prefilter.close()
+    log(f"\nBatch processing complete. Results appended to '{output_txt_path}'.")
+    log(f"Near-duplicates answered without a new request: {duplicates}")
+    log(prefilter.summary())
+    log(workspace.cache().summary())
+    log(preprocessor.summary())
+    log(engine.summary())
+    update_bank(workspace, log)
+    return processed, errors
+
+def watch(workspace, image_dir, api_key=None, prompt=PROMPT, output_txt_path=OUTPUT_TXT_PATH,
+          profile=DEFAULT_PROFILE, batch_size=1, max_concurrency=MAX_CONCURRENCY, dedup=True,
+          near_duplicates=False, min_score=DEFAULT_MIN_SCORE, defer_low_score=False, debounce=DEBOUNCE,
+          poll_interval=POLL_INTERVAL, log=print, progress=None, cancel_event=None, on_queue_depth=None,
+          metrics=METRICS):
+    """
+    Keeps answering a folder until `cancel_event` is set: images already in it that the journal
+    has not answered go first, then every image that is added or changed, once it has finished
+    being written. Only the new images are read each time. The number of images waiting is
+    passed to `on_queue_depth` and exported as the `watch_queue_depth` gauge in the metrics
+    files, which are rewritten from `metrics` (e.g. the caller's METRICS.scope()) after every
+    batch. Returns (processed, errors).
+    """
+    if is_pack(image_dir):
+        log(f"Error: '{image_dir}' is a pack file; only folders can be watched.")
+        return 0, 1
+    cancel_event = cancel_event or threading.Event()
+    log(f"Results will be saved to: {output_txt_path}")
+    watcher = FolderWatcher(image_dir, debounce, poll_interval, log=log)
+    engine, preprocessor, prefilter, index = _open_engine(
+        workspace, prompt, api_key, profile, batch_size, max_concurrency, dedup, near_duplicates, min_score,
+        defer_low_score, log, cancel_event)
+    job = os.path.abspath(output_txt_path)
+    processed, errors, depth = 0, 0, None
+    if progress is not None:
+        progress.start(0)
+    log("Waiting for images. Stop the watch to finish.\n")
+    try:
+        with open(output_txt_path, "a", encoding="utf-8") as output_file:
+            while not cancel_event.is_set():
+                batch = watcher.next_batch(timeout=poll_interval)
+                if depth != watcher.queue_depth + len(batch):
+                    depth = watcher.queue_depth + len(batch)
+                    METRICS.gauge('watch_queue_depth', depth)
+                    if on_queue_depth is not None:
+                        on_queue_depth(depth)
+                    metrics.write()
+                batch = workspace.journal().pending_images(job, batch, prefilter.skip_below)
+                if not batch:
+                    continue
+                log(f"--- {len(batch)} new images, {watcher.queue_depth} more waiting ---")
+                if progress is not None:
+                    progress.set_total(progress.done + len(batch) + watcher.queue_depth)
+                done, failed, _ = _answer(workspace, job, batch, engine, prefilter, index, output_file, log,
+                                          progress, cancel_event)
+                processed += done
+                errors += failed
+                update_bank(workspace, log)
+                METRICS.count('watch_batches')
+                metrics.write()
+    finally:
+        watcher.close()
+        preprocessor.close()
+        prefilter.close()
+    log(f"\nWatch stopped: {processed} images answered, {errors} errors. Results appended to '{output_txt_path}'.")
+    log(prefilter.summary())
+    log(workspace.cache().summary())
+    log(preprocessor.summary())
+    log(engine.summary())
+    return processed, errors
+
+def run(workspace, base_name, start_id, total_files, cookies, api_key=None, prompt=PROMPT,
+        output_txt_path=OUTPUT_TXT_PATH, directory=DOWNLOAD_DIRECTORY, profile=DEFAULT_PROFILE, dedup=True,
+        near_duplicates=False, min_score=DEFAULT_MIN_SCORE, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, log=print,
+        process_log=None, cancel_event=None, progress=None, process_progress=None, packed=False,
+        max_concurrency=MAX_CONCURRENCY):
+    """
+    Downloads a sequence and answers it in one pipelined run. Pages the prefilter scores below
+    `min_score` are recorded as skipped. Up to `max_concurrency` images are answered at once,
+    under the same adaptive limit as `process`. Returns (processed, errors).
+    """
+    process_log = process_log or log
+    cancel_event = cancel_event or threading.Event()
+    for tracker in (progress, process_progress):
+        if tracker is not None:
+            tracker.start(total_files)
+    log("--- Starting Download and Solve ---")
+    process_log(f"Results will be saved to: {output_txt_path}\n")
+    cache = workspace.cache()
+    preprocessor = Preprocessor(profile, log=process_log)
+    prefilter = Prefilter(min_score, log=process_log)
+    index = workspace.index(near_duplicates) if dedup else None
+    engine = ParallelProcessor(prompt, api_key, cache, index, preprocessor, max_concurrency, log=process_log,
+                               cancel_event=cancel_event)
+    try:
+        processed, errors = run_pipeline(
+            base_name, start_id, total_files, directory, cookies, api_key, output_txt_path, prompt=prompt,
+            download_workers=workers, rate=rate, log=log, process_log=process_log, cancel_event=cancel_event,
+            cache=cache, index=index, preprocessor=preprocessor,
+            journal=workspace.journal(), store=workspace.store(), progress=progress,
+            process_progress=process_progress, prefilter=prefilter,
+            pack=open_pack(directory + PACK_SUFFIX) if packed else None, engine=engine)
+    finally:
+        preprocessor.close()
+        prefilter.close()
+    status = "cancelled" if cancel_event is not None and cancel_event.is_set() else "complete"
+    process_log(f"\nDownload and solve {status}: {processed} images written, {errors} errors.")
+    process_log(prefilter.summary())
+    process_log(cache.summary())
+    process_log(preprocessor.summary())
+    process_log(engine.summary())
+    update_bank(workspace, process_log)
+    return processed, errors
+
+def update_bank(workspace, log=print):
+    """Clusters the questions stored since the last update into the answer bank. Returns how many were added."""
+    with METRICS.span('answer_bank_update'):
+        added = workspace.bank().update()
+    log(f"{workspace.bank().summary()} ({added} new)")
+    return added
+
+def report_metrics(log=print, metrics=METRICS):
+    """
+    Writes the run's metrics files and logs the percentiles. A script that makes one run can
+    report METRICS itself; callers that run several actions pass each one's METRICS.scope().
+    """
+    metrics.write()
+    log(f"\n{metrics.report()}\nMetrics written to '{METRICS_JSON}' and '{METRICS_PROM}'.")
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from metrics import METRICS
+from pack import image_source, file_stat, image_exists
+
+# --- CONFIGURATION ---
+INDEX_FILE = "phash_index.json"
+INDEX_VERSION = 2
+HASH_NAME = 'dhash'
+HASH_SIZE = 16            # 16x16 = 256-bit hashes; 8x8 cannot tell apart pages that share a layout
+DEFAULT_THRESHOLD = 0     # max Hamming distance for a hash match; 0 = only pages whose hashes are identical
+NEAR_THRESHOLD = 8        # opt-in distance for re-encoded or rescaled copies (out of 256 bits)
+BLOCK_SIZE = 8            # every hash match is confirmed block by block at the smaller page's resolution
+BLOCK_TOLERANCE = 16.0    # mean grey-level difference any one block may have; a changed word exceeds it
+MAX_CONFIRMATIONS = 16    # hash matches pixel-checked per new image, closest first
+
+# --- Perceptual hashes ---
+# Every hash works on a batch: the decoded thumbnails are stacked into one array
+# and the bits for all images are computed with a handful of NumPy operations.
+
+THUMBNAIL_SIZES = {'ahash': (HASH_SIZE, HASH_SIZE), 'dhash': (HASH_SIZE + 1, HASH_SIZE),
+                   'phash': (HASH_SIZE * 4, HASH_SIZE * 4)}
+
+def _thumbnail(img, size):
+    return np.asarray(img.convert('L').resize(size, Image.LANCZOS), dtype=np.float32)
+
+def _thumbnails(image_paths, size):
+    """Decodes images into one (N, h, w) float array of grayscale thumbnails."""
+    thumbs = []
+    for path in image_paths:
+        with Image.open(image_source(path)) as img:
+            img.draft('L', (size[0] * 4, size[1] * 4))
+            thumbs.append(_thumbnail(img, size))
+    return np.stack(thumbs)
+
+def _pack(bits):
+    """Turns an (N, bits) boolean array into N Python ints."""
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+def _ahash_bits(pixels):
+    return pixels > pixels.mean(axis=(1, 2), keepdims=True)
+
+def _dhash_bits(pixels):
+    return pixels[:, :, 1:] > pixels[:, :, :-1]
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+def _phash_bits(pixels):
+    dct = _dct_matrix(pixels.shape[1])
+    low = np.einsum('ij,njk,lk->nil', dct, pixels, dct)[:, :HASH_SIZE, :HASH_SIZE]
+    flat = low.reshape(len(low), -1)
+    return flat > np.median(flat[:, 1:], axis=1, keepdims=True)
+
+HASH_BITS = {'ahash': _ahash_bits, 'dhash': _dhash_bits, 'phash': _phash_bits}
+
+def ahash(image_paths):
+    return _pack(_ahash_bits(_thumbnails(image_paths, THUMBNAIL_SIZES['ahash'])))
+
+def dhash(image_paths):
+    return _pack(_dhash_bits(_thumbnails(image_paths, THUMBNAIL_SIZES['dhash'])))
+
+def phash(image_paths):
+    return _pack(_phash_bits(_thumbnails(image_paths, THUMBNAIL_SIZES['phash'])))
+
+HASH_FUNCTIONS = {'ahash': ahash, 'dhash': dhash, 'phash': phash}
+
+def fingerprints(image_paths, hash_name=HASH_NAME):
+    """
+    Decodes every image once and returns (hashes, digests): its perceptual hash and a SHA-256
+    of its decoded pixels, which is equal for identical pages however they were encoded.
+    """
+    thumbs, digests = [], []
+    for path in image_paths:
+        with Image.open(image_source(path)) as img:
+            img = img.convert('RGB')
+            digests.append(hashlib.sha256(f"{img.size}".encode("ascii") + img.tobytes()).hexdigest())
+            thumbs.append(_thumbnail(img, THUMBNAIL_SIZES[hash_name]))
+    return _pack(HASH_BITS[hash_name](np.stack(thumbs))), digests
+
+def same_page(path_a, path_b):
+    """
+    Pixel check behind every hash match. The pages are compared at the smaller one's resolution
+    and count as the same only if their shapes agree and no BLOCK_SIZE square differs by more
+    than BLOCK_TOLERANCE on average. Compression noise stays well below that; a different
+    question printed on the same template changes whole words and does not.
+    """
+    with Image.open(image_source(path_a)) as img_a, Image.open(image_source(path_b)) as img_b:
+        (width_a, height_a), (width_b, height_b) = img_a.size, img_b.size
+        if abs(width_a / height_a - width_b / height_b) > 0.01:
+            return False
+        size = min(img_a.size, img_b.size, key=lambda size: size[0] * size[1])
+        a, b = _thumbnail(img_a, size), _thumbnail(img_b, size)
+    height, width = size[1] // BLOCK_SIZE * BLOCK_SIZE, size[0] // BLOCK_SIZE * BLOCK_SIZE
+    blocks = np.abs(a - b)[:height, :width].reshape(height // BLOCK_SIZE, BLOCK_SIZE, width // BLOCK_SIZE, BLOCK_SIZE)
+    return float(blocks.mean(axis=(1, 3)).max()) <= BLOCK_TOLERANCE
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+# --- Index ---
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance; a range query only visits a few branches."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def within(self, value, threshold):
+        """Returns [(distance, item)] of every entry within `threshold`, closest first."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= threshold:
+                found.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - threshold <= edge <= distance + threshold:
+                    stack.append(child)
+        return sorted(found)
+
+    def nearest(self, value, threshold):
+        """Returns (distance, item) of the closest entry within `threshold`, or None."""
+        found = self.within(value, threshold)
+        return found[0] if found else None
+
+class PerceptualIndex:
+    """
+    Persistent duplicate index of images.
+    Each image is mapped to a cluster representative: the first image seen with the same
+    decoded pixels or, failing that, whose hash is within `threshold` bits of it and which
+    passes the pixel check in `same_page`. Only representatives live in the BK-tree, so new
+    downloads are checked incrementally against everything seen before. The default
+    threshold of 0 only merges pages that are identical; NEAR_THRESHOLD also merges
+    re-encoded copies. An index saved with another threshold or format is rebuilt.
+    """
+
+    def __init__(self, path=INDEX_FILE, threshold=DEFAULT_THRESHOLD, hash_name=HASH_NAME):
+        self.path = path
+        self.threshold = threshold
+        self.hash_name = hash_name
+        self.entries = {}
+        self.tree = BKTree()
+        self.digests = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (data.get('version'), data.get('hash_name'), data.get('threshold')) == \
+                    (INDEX_VERSION, hash_name, threshold):
+                self.entries = data['entries']
+        for image_path, (value, _, _, representative, digest) in self.entries.items():
+            if representative == image_path:
+                self.tree.add(value, image_path)
+                self.digests.setdefault(digest, image_path)
+
+    def _match(self, key, value, digest):
+        """The representative for a newly hashed image: an identical page, a confirmed hash match, or itself."""
+        representative = self.digests.get(digest)
+        if representative is not None:
+            return representative
+        # Pages sharing a template can hash alike, so each match must also pass the pixel check.
+        candidates = [item for _, item in self.tree.within(value, self.threshold) if item != key]
+        for candidate in candidates[:MAX_CONFIRMATIONS]:
+            try:
+                if same_page(key, candidate):
+                    return candidate
+            except Exception:
+                continue    # the representative is gone or unreadable
+        return key
+
+    def add_many(self, image_paths):
+        """Hashes any new or changed images in one batch and assigns their clusters."""
+        stale = []
+        for path in image_paths:
+            key = os.path.abspath(path)
+            stat = file_stat(path)
+            entry = self.entries.get(key)
+            if entry is None or entry[1] != stat[0] or entry[2] != stat[1]:
+                stale.append((key, stat))
+        if not stale:
+            return
+        try:
+            with METRICS.span('perceptual_hash'):
+                hashes, digests = fingerprints([key for key, _ in stale], self.hash_name)
+        except Exception:
+            # One unreadable image must not sink the whole batch; hash the rest one by one.
+            hashes, digests = [], []
+            for key, _ in stale:
+                try:
+                    value, digest = fingerprints([key], self.hash_name)
+                    hashes.extend(value)
+                    digests.extend(digest)
+                except Exception:
+                    hashes.append(None)
+                    digests.append(None)
+        with self._lock:
+            for (key, stat), value, digest in zip(stale, hashes, digests):
+                if value is None:
+                    continue
+                representative = self._match(key, value, digest)
+                if representative == key:
+                    self.tree.add(value, key)
+                    self.digests.setdefault(digest, key)
+                self.entries[key] = [value, stat[0], stat[1], representative, digest]
+
+    def representative(self, image_path):
+        """
+        Returns the absolute path of the image whose answer should be used for `image_path`.
+        That is the cluster representative while it still exists (on disk or in its pack), else the image itself.
+        """
+        self.add_many([image_path])
+        key = os.path.abspath(image_path)
+        entry = self.entries.get(key)
+        if entry is None or not image_exists(entry[3]):
+            return key
+        return entry[3]
+
+    def clusters(self, image_paths):
+        """Groups the given images as {representative: [members]}."""
+        self.add_many(image_paths)
+        groups = {}
+        for path in image_paths:
+            groups.setdefault(self.representative(path), []).append(path)
+        return groups
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'version': INDEX_VERSION, 'hash_name': self.hash_name, 'threshold': self.threshold,
+                    'entries': self.entries}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
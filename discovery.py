@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+
+from downloader import (MAX_RETRIES, BASE_BACKOFF, MISSING_STATUS, RETRYABLE_STATUS, RateLimiter, make_session,
+                        attachment_url, backoff_delay, parse_retry_after)
+
+# --- CONFIGURATION ---
+RANGES_FILE = "attachment_ranges.json"
+MAX_GAP = 4              # this many missing IDs in a row end a series; shorter gaps are skipped over
+MAX_SERIES = 5000        # galloping never looks further than this past the start ID
+PROBE_TIMEOUT = 15
+RANGE_MAX_AGE = 24 * 3600   # seconds a cached range is trusted; a thread can get new attachments
+
+class ProbeError(Exception):
+    """An attachment could not be probed because of repeated transient errors."""
+
+def probe_attachment(session, url, limiter=None, max_retries=MAX_RETRIES, base_delay=BASE_BACKOFF,
+                     cancel_event=None):
+    """
+    Checks whether an attachment exists with a HEAD request (GET without reading the body
+    when HEAD is not allowed). Returns True or False; 404/410 count as missing right away,
+    429/5xx and connection errors are retried with backoff and raise ProbeError at the end.
+    """
+    import requests
+    last_error = None
+    for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ProbeError("cancelled")
+        if limiter is not None and not limiter.acquire(url, cancel_event):
+            raise ProbeError("cancelled")
+        delay = backoff_delay(attempt, base_delay)
+        try:
+            with session.head(url, timeout=PROBE_TIMEOUT, allow_redirects=True) as response:
+                status, headers = response.status_code, response.headers
+            if status == 405:
+                with session.get(url, timeout=PROBE_TIMEOUT, stream=True) as response:
+                    status, headers = response.status_code, response.headers
+            if status in MISSING_STATUS:
+                return False
+            if status in RETRYABLE_STATUS:
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                if retry_after is not None:
+                    delay = retry_after
+                if limiter is not None and status in (429, 503):
+                    limiter.penalize(url, delay)
+                raise requests.exceptions.HTTPError(f"HTTP {status}")
+            if status >= 400:
+                # 401/403 mean the cookies are wrong, not that the series ended.
+                raise ProbeError(f"HTTP {status} for {url}; check the xf_user/xf_session cookies.")
+            if limiter is not None:
+                limiter.reward(url)
+            return True
+        except requests.exceptions.RequestException as e:
+            last_error = e
+            if attempt + 1 < max_retries:
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        raise ProbeError("cancelled")
+                else:
+                    time.sleep(delay)
+    raise ProbeError(f"Could not probe {url}: {last_error}")
+
+class RangeCache:
+    """Discovered attachment ranges per base name, kept in a JSON file for `max_age` seconds."""
+
+    def __init__(self, path=RANGES_FILE, max_age=RANGE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.ranges = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.ranges = json.load(f)
+
+    def get(self, base_name, start_id):
+        """Returns (last_id, missing_ids) cached for a series starting at `start_id`, or None (also once expired)."""
+        entry = self.ranges.get(base_name)
+        if entry is None or entry['start'] != start_id:
+            return None
+        if time.time() - entry.get('updated', 0) > self.max_age:
+            return None
+        return entry['end'], entry['missing']
+
+    def put(self, base_name, start_id, last_id, missing_ids):
+        with self._lock:
+            self.ranges[base_name] = {'start': start_id, 'end': last_id, 'missing': sorted(missing_ids),
+                                      'updated': time.time()}
+            if not self.path:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.ranges, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+def discover_range(session, base_name, start_id, limiter=None, max_gap=MAX_GAP, cache=None, refresh=False,
+                   log=print, cancel_event=None):
+    """
+    Finds the last attachment ID of a series that starts at `start_id`.
+    Gallops forward (start+1, +2, +4, ...) until an ID is "dead", i.e. it and the next
+    `max_gap - 1` IDs are all missing, then binary-searches between the last live and the
+    first dead position. Gaps shorter than `max_gap` are tolerated. Every probe result is
+    remembered, so no ID is requested twice. With a RangeCache the result is stored per base
+    name and reused unless `refresh` is set.
+    Returns (last_id, missing_ids) where missing_ids are the IDs inside the range seen missing.
+    """
+    if cache is not None and not refresh:
+        cached = cache.get(base_name, start_id)
+        if cached is not None:
+            log(f"[DISCOVERY] Using cached range for {base_name}: IDs {start_id}-{cached[0]}.")
+            return cached
+    seen = {}
+
+    def exists(attach_id):
+        if attach_id not in seen:
+            seen[attach_id] = probe_attachment(session, attachment_url(base_name, attach_id), limiter,
+                                               cancel_event=cancel_event)
+        return seen[attach_id]
+
+    def alive(attach_id):
+        """The first existing ID in [attach_id, attach_id + max_gap), or None."""
+        for candidate in range(attach_id, attach_id + max_gap):
+            if exists(candidate):
+                return candidate
+        return None
+
+    if not exists(start_id):
+        raise ProbeError(f"The start attachment {start_id} does not exist.")
+    live, step = start_id, 1
+    while True:
+        position = start_id + step
+        if step > MAX_SERIES:
+            dead = position
+            break
+        found = alive(position)
+        if found is None:
+            dead = position
+            break
+        live = found
+        step *= 2
+    log(f"[DISCOVERY] Series ends between IDs {live} and {dead}; narrowing down...")
+    while dead - live > 1:
+        middle = (live + dead) // 2
+        found = alive(middle)
+        if found is None:
+            dead = middle
+        else:
+            live = found
+    last_id = live
+    missing = [attach_id for attach_id, ok in seen.items() if not ok and start_id <= attach_id <= last_id]
+    log(f"[DISCOVERY] {base_name}: IDs {start_id}-{last_id} ({last_id - start_id + 1} files, "
+        f"{len(seen)} probes, {len(missing)} known gaps).")
+    if cache is not None:
+        cache.put(base_name, start_id, last_id, missing)
+    return last_id, sorted(missing)
+
+def discover_total(base_name, start_id, cookies, cache=None, refresh=False, log=print, cancel_event=None):
+    """Convenience wrapper for the CLIs and the GUI: returns the number of files from `start_id` to the end."""
+    session = make_session(cookies, pool_size=1)
+    try:
+        last_id, _ = discover_range(session, base_name, start_id, RateLimiter(), cache=cache, refresh=refresh,
+                                    log=log, cancel_event=cancel_event)
+    finally:
+        session.close()
+    return last_id - start_id + 1
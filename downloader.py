@@ -0,0 +1,336 @@
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from journal import file_checksum
+from pack import file_stat
+from metrics import METRICS, BYTES_BUCKETS
+
+# --- Configuration ---
+BASE_ATTACHMENT_URL = "https://fuoverflow.com/attachments/"
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+MAX_RETRIES = 4
+BASE_BACKOFF = 1.0      # seconds, doubled on every attempt
+MAX_BACKOFF = 60.0      # upper bound for a single backoff sleep
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 2.0      # requests per second, per host
+DEFAULT_BURST = 4
+MIN_RATE = 0.2          # the limiter never slows a host down below this
+CHUNK_SIZE = 65536
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+MISSING_STATUS = (404, 410)   # the ID does not exist; retrying cannot help
+PART_SUFFIX = ".part"    # incomplete downloads live next to their target until renamed
+
+
+# --- URL helpers ---
+
+def parse_url_pattern(url):
+    """
+    Uses a simple regex to extract the full base name and the attachment ID.
+    Example: .../ite302c_-_sp_2025_-_re_3811-webp.199272/
+    - Group 1 (base_name): ite302c_-_sp_2025_-_re_3811-webp
+    - Group 2 (start_id):  199272
+    """
+    pattern = re.compile(r"/([^/]+)\.(\d+)/?$")
+    match = pattern.search(url)
+    if match:
+        return match.group(1), int(match.group(2))
+    return None, None
+
+def attachment_url(base_name, attach_id):
+    """Builds the attachment URL for one ID of a sequence."""
+    return f"{BASE_ATTACHMENT_URL}{base_name}.{attach_id}/"
+
+def attachment_filename(base_name, attach_id):
+    """Builds the local filename for one ID of a sequence."""
+    return f"{base_name}.{attach_id}.webp"
+
+
+# --- Rate limiting and backoff ---
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter keyed by host.
+    Every host gets its own bucket. A 429/503 answer pauses the host for the
+    requested time and halves its rate; successful requests slowly restore it.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, url):
+        host = urlparse(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = {'tokens': float(self.burst), 'rate': self.rate,
+                      'updated': time.monotonic(), 'paused_until': 0.0}
+            self._buckets[host] = bucket
+        return bucket
+
+    def acquire(self, url, cancel_event=None):
+        """Blocks until a request to the host of `url` is allowed. Returns False if cancelled."""
+        while True:
+            with self._lock:
+                bucket = self._bucket(url)
+                now = time.monotonic()
+                elapsed = now - bucket['updated']
+                bucket['tokens'] = min(self.burst, bucket['tokens'] + elapsed * bucket['rate'])
+                bucket['updated'] = now
+                if now >= bucket['paused_until'] and bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return True
+                wait = max(bucket['paused_until'] - now, (1 - bucket['tokens']) / bucket['rate'])
+            if cancel_event is not None:
+                if cancel_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def penalize(self, url, delay):
+        """Pauses the host for `delay` seconds and halves its request rate."""
+        with self._lock:
+            bucket = self._bucket(url)
+            bucket['paused_until'] = max(bucket['paused_until'], time.monotonic() + delay)
+            bucket['tokens'] = 0.0
+            bucket['rate'] = max(MIN_RATE, bucket['rate'] / 2)
+
+    def reward(self, url):
+        """Additively restores the rate of a host after a successful request."""
+        with self._lock:
+            bucket = self._bucket(url)
+            bucket['rate'] = min(self.rate, bucket['rate'] + self.rate / 20)
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def backoff_delay(attempt, base_delay=BASE_BACKOFF, max_delay=MAX_BACKOFF):
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+# --- Downloading ---
+
+def make_session(cookies, headers=None, pool_size=DEFAULT_WORKERS):
+    """Creates a requests.Session whose connection pool is shared by all workers."""
+    # requests is imported on first use so that importing this module (e.g. for the GUI) stays cheap.
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers or {'User-Agent': USER_AGENT})
+    session.cookies.update(cookies)
+    return session
+
+class MissingAttachment(Exception):
+    """The server answered 404/410: the attachment ID does not exist."""
+
+def download_file_with_retry(session, image_url, filepath, limiter=None, max_retries=MAX_RETRIES,
+                             base_delay=BASE_BACKOFF, log=print, cancel_event=None):
+    """
+    Downloads a file to a specific filepath with a retry mechanism.
+    Retries use exponential backoff with jitter; a Retry-After header from the
+    server takes precedence and is also fed back into the rate limiter.
+    A 404/410 means the ID does not exist and raises MissingAttachment at once, without retrying.
+    Data goes to `filepath + PART_SUFFIX` and is renamed into place only once complete,
+    so an interrupted download never looks finished; the next attempt (or run)
+    resumes the partial file with an HTTP Range request.
+    """
+    import requests
+    filename = os.path.basename(filepath)
+    part_path = filepath + PART_SUFFIX
+    for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        waited = time.perf_counter()
+        if limiter is not None and not limiter.acquire(image_url, cancel_event):
+            return False
+        METRICS.observe('download_wait_seconds', time.perf_counter() - waited)
+        delay = backoff_delay(attempt, base_delay)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        started = time.perf_counter()
+        headers = {'Range': f"bytes={offset}-"} if offset else None
+        try:
+            # The context manager hands the connection back to the pool even on errors.
+            with session.get(image_url, stream=True, timeout=30, headers=headers) as response:
+                # Time to the response headers: DNS, connect, TLS and server think time together.
+                METRICS.observe('download_ttfb_seconds', response.elapsed.total_seconds())
+                if response.status_code in RETRYABLE_STATUS:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after is not None:
+                        delay = retry_after
+                    if limiter is not None and response.status_code in (429, 503):
+                        limiter.penalize(image_url, delay)
+                if response.status_code in MISSING_STATUS:
+                    log(f"[MISSING] {filename} does not exist (HTTP {response.status_code}); not retrying.")
+                    METRICS.count('download_missing')
+                    raise MissingAttachment(filename)
+                if response.status_code == 416 and offset:
+                    # The partial file is already complete (or the server disagrees with it); start over.
+                    os.remove(part_path)
+                    raise requests.exceptions.HTTPError(f"416 Range Not Satisfiable for {filename}", response=response)
+                response.raise_for_status()
+                resumed = offset and response.status_code == 206
+                expected = response.headers.get('Content-Length')
+                transfer_started = time.perf_counter()
+                with open(part_path, 'ab' if resumed else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                METRICS.observe('download_transfer_seconds', time.perf_counter() - transfer_started)
+                received = os.path.getsize(part_path) - (offset if resumed else 0)
+                METRICS.count('download_bytes', received)
+                if expected is not None and expected.isdigit() and received != int(expected):
+                    raise requests.exceptions.ConnectionError(
+                        f"Incomplete transfer: {received} of {expected} bytes received")
+            os.replace(part_path, filepath)
+            METRICS.observe('download_seconds', time.perf_counter() - started)
+            METRICS.observe('download_size_bytes', os.path.getsize(filepath), buckets=BYTES_BUCKETS)
+            if limiter is not None:
+                limiter.reward(image_url)
+            log(f"[SUCCESS] Downloaded {filename}" + (f" (resumed at {offset} bytes)" if resumed else ""))
+            return True
+        except requests.exceptions.RequestException as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            METRICS.count('download_errors', cause=f"http_{status}" if status else type(e).__name__)
+            log(f"[ATTEMPT {attempt + 1}/{max_retries}] Failed for {filename}. Error: {e}")
+            if attempt + 1 < max_retries:
+                METRICS.count('download_retries')
+                log(f"Retrying in {delay:.1f} seconds...")
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        return False
+                else:
+                    time.sleep(delay)
+            else:
+                log(f"[FAILURE] All {max_retries} attempts failed for {filename}.")
+    return False
+
+def _resume_from(filepath):
+    """Turns an incomplete file without a finished journal record into the partial download it is resumed from."""
+    part_path = filepath + PART_SUFFIX
+    if os.path.exists(part_path) and os.path.getsize(part_path) >= os.path.getsize(filepath):
+        os.remove(filepath)
+    else:
+        os.replace(filepath, part_path)
+
+def fetch_attachment(session, base_name, attach_id, directory, limiter=None, max_retries=MAX_RETRIES,
+                     log=print, cancel_event=None, journal=None, pack=None):
+    """
+    Downloads one attachment of a sequence unless it is already complete on disk.
+    With a Journal the state, byte count and checksum of every download are recorded,
+    and a file whose size no longer matches its record is fetched again.
+    With an ImagePack the finished file is moved into the pack (`directory` only holds
+    downloads in progress) and the returned path points inside the pack.
+    An ID the server reports as missing is journaled as such and not requested again.
+    Returns (status, filepath) with status 'skipped', 'downloaded', 'missing' or 'failed'.
+    """
+    filename = attachment_filename(base_name, attach_id)
+    filepath = os.path.join(directory, filename)
+    if pack is not None:
+        complete = filename in pack
+    elif journal is not None:
+        complete = journal.is_downloaded(base_name, attach_id, filepath)
+        if not complete and os.path.exists(filepath):
+            record = journal.download_state(base_name, attach_id)
+            if record is None or record[0] == 'started':
+                _resume_from(filepath)
+    else:
+        complete = os.path.exists(filepath)
+    if pack is not None:
+        filepath, loose_path = os.path.join(pack.path, filename), filepath
+    if complete:
+        log(f"[SKIPPED] {filename} already exists.")
+        return 'skipped', filepath
+    if journal is not None:
+        record = journal.download_state(base_name, attach_id)
+        if record is not None and record[0] == 'missing':
+            log(f"[MISSING] {filename} did not exist in an earlier run; not requesting it again.")
+            return 'missing', filepath
+        journal.mark_download(base_name, attach_id, 'started')
+    try:
+        ok = download_file_with_retry(session, attachment_url(base_name, attach_id),
+                                      loose_path if pack is not None else filepath,
+                                      limiter, max_retries, BASE_BACKOFF, log, cancel_event)
+    except MissingAttachment:
+        if journal is not None:
+            journal.mark_download(base_name, attach_id, 'missing')
+        return 'missing', filepath
+    if ok and pack is not None:
+        checksum = pack.add_file(loose_path, filename, attach_id)
+        os.remove(loose_path)
+    if journal is not None:
+        if ok:
+            if pack is None:
+                checksum = file_checksum(filepath)
+            journal.mark_download(base_name, attach_id, 'done', file_stat(filepath)[0], checksum)
+        elif cancel_event is None or not cancel_event.is_set():
+            journal.mark_download(base_name, attach_id, 'failed')
+    return ('downloaded' if ok else 'failed'), filepath
+
+def download_sequence(base_name, start_id, total_files, directory, cookies, workers=DEFAULT_WORKERS,
+                      rate=DEFAULT_RATE, max_retries=MAX_RETRIES, log=print, cancel_event=None, journal=None,
+                      progress=None, pack=None):
+    """
+    Downloads `total_files` consecutive attachments on a bounded worker pool.
+    All workers share one session (connection pool) and one per-host limiter.
+    With a Journal, a restarted run skips finished IDs and resumes partial ones.
+    A ProgressTracker is updated with every finished ID and the bytes downloaded.
+    With an ImagePack the files end up in the pack instead of `directory`.
+    An interrupt (Ctrl+C) cancels the queued IDs instead of waiting for them.
+    Returns (successful, skipped, missing, failed_urls); missing IDs are gaps, not failures.
+    """
+    cancel_event = cancel_event or threading.Event()
+    os.makedirs(directory, exist_ok=True)
+    session = make_session(cookies, pool_size=workers)
+    limiter = RateLimiter(rate=rate, burst=max(1, workers))
+
+    successful, skipped, missing = 0, 0, 0
+    failed_urls = []
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {executor.submit(fetch_attachment, session, base_name, start_id + i, directory, limiter,
+                                   max_retries, log, cancel_event, journal, pack): start_id + i
+                   for i in range(total_files)}
+        for future in as_completed(pending):
+            status, filepath = future.result()
+            if progress is not None:
+                progress.update(nbytes=file_stat(filepath)[0] if status == 'downloaded' else 0,
+                                error=status == 'failed')
+            if status == 'downloaded':
+                successful += 1
+            elif status == 'skipped':
+                skipped += 1
+            elif status == 'missing':
+                missing += 1
+            else:
+                failed_urls.append(attachment_url(base_name, pending[future]))
+    except BaseException:
+        # Leaving a `with` block would wait for every queued ID; cancel them instead.
+        cancel_event.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        session.close()
+    return successful, skipped, missing, sorted(failed_urls)
@@ -4,59 +4,25 @@ import os
 import threading
 import queue
 import time
-import re
-import requests
-from PIL import Image
-import getpass
-import google.generativeai as genai
+import core
+from core import DOWNLOAD_DIRECTORY
+from downloader import parse_url_pattern, DEFAULT_WORKERS
+from processor import CONFIG_FILE, PROMPT, OUTPUT_TXT_PATH
+from preprocess import PROFILES, DEFAULT_PROFILE
+from parallel import MAX_CONCURRENCY
+from prefilter import DEFAULT_MIN_SCORE, BLANK_PAGE_SCORE
+from pack import PACK_SUFFIX, is_pack
+from results import format_match
+from progress import ProgressTracker
+from metrics import METRICS
 
 # --- Constants and Configuration ---
-CONFIG_FILE = "config.txt"
-DOWNLOAD_DIRECTORY = "downloaded_images"
-
-# --- Core Logic from test.py and AI.py ---
-
-def download_file_with_retry(image_url, filepath, cookies, headers, max_retries, retry_delay, log_queue):
-    """Downloads a file with a retry mechanism and logs progress to a queue."""
-    filename = os.path.basename(filepath)
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(image_url, cookies=cookies, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            # FIXED: Added "DOWNLOADER:" prefix
-            log_queue.put(f"DOWNLOADER:[SUCCESS] Downloaded {filename}\n")
-            return True
-        except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
-            # FIXED: Added "DOWNLOADER:" prefix
-            log_queue.put(f"DOWNLOADER:[ATTEMPT {attempt + 1}/{max_retries}] Failed for {filename}. Error: {e}\n")
-            if attempt + 1 < max_retries:
-                time.sleep(retry_delay)
-            else:
-                # FIXED: Added "DOWNLOADER:" prefix
-                log_queue.put(f"DOWNLOADER:[FAILURE] All {max_retries} attempts failed for {filename}.\n")
-    return False
-
-def parse_url_pattern(url):
-    """Uses regex to extract the base name and attachment ID from a URL."""
-    pattern = re.compile(r"/([^/]+)\.(\d+)/?$")
-    match = pattern.search(url)
-    if match:
-        return match.group(1), int(match.group(2))
-    return None, None
-
-def get_answer_from_image_with_gemini(image_path, prompt, api_key):
-    """Sends an image and prompt to the Gemini model."""
-    try:
-        genai.configure(api_key=api_key)
-        img = Image.open(image_path)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content([prompt, img])
-        return response.text, None
-    except Exception as e:
-        return None, f"An error occurred while processing {os.path.basename(image_path)}: {e}"
+LOG_INTERVAL_MS = 100      # how often queued log messages are rendered
+MAX_LOG_LINES = 2000       # each log keeps only its most recent lines
+MAX_MESSAGES_PER_TICK = 5000
+# Log channels: every queued message is a (channel, text) pair.
+DOWNLOADER = 'downloader'
+PROCESSOR = 'processor'
 
 # --- GUI Application Class ---
 
@@ -67,33 +33,83 @@ class App(tk.Tk):
         self.geometry("800x600")
 
         self.log_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.watch_cancel_event = threading.Event()
+        self.watch_queue_depth = None       # set by the watch thread, shown by process_log_queue
+        self.workspace = core.Workspace()   # cache, index, journal and results store, opened on first use
+        self.progress_widgets = {}
 
         self.tabControl = ttk.Notebook(self)
         self.downloader_tab = ttk.Frame(self.tabControl)
         self.processor_tab = ttk.Frame(self.tabControl)
+        self.search_tab = ttk.Frame(self.tabControl)
         self.tabControl.add(self.downloader_tab, text='Image Downloader')
         self.tabControl.add(self.processor_tab, text='Gemini Processor')
+        self.tabControl.add(self.search_tab, text='Search Answers')
         self.tabControl.pack(expand=1, fill="both")
 
         self.create_downloader_widgets()
         self.create_processor_widgets()
+        self.create_search_widgets()
+        self.logs = {DOWNLOADER: self.downloader_log, PROCESSOR: self.processor_log}
         
-        self.after(100, self.process_log_queue)
+        self.after(LOG_INTERVAL_MS, self.process_log_queue)
+
+    def log(self, channel, message):
+        """Queues a message for one tab's log; safe to call from worker threads."""
+        self.log_queue.put((channel, message))
+
+    def logger(self, channel):
+        """Returns a one-argument log function for the engines, which log without newlines."""
+        return lambda message: self.log_queue.put((channel, f"{message}\n"))
 
     def process_log_queue(self):
-        """Processes messages from the log queue to update GUI."""
-        while not self.log_queue.empty():
+        """
+        Renders queued log messages: everything that arrived since the last tick is
+        joined into one insert per log, and each log is trimmed to MAX_LOG_LINES lines.
+        Also refreshes the progress bars and the watch queue depth.
+        """
+        batches = {DOWNLOADER: [], PROCESSOR: []}
+        for _ in range(MAX_MESSAGES_PER_TICK):
             try:
-                message = self.log_queue.get_nowait()
-                if "DOWNLOADER:" in message:
-                    self.downloader_log.insert(tk.END, message.replace("DOWNLOADER:", ""))
-                    self.downloader_log.see(tk.END)
-                elif "PROCESSOR:" in message:
-                    self.processor_log.insert(tk.END, message.replace("PROCESSOR:", ""))
-                    self.processor_log.see(tk.END)
+                channel, message = self.log_queue.get_nowait()
             except queue.Empty:
-                pass
-        self.after(100, self.process_log_queue)
+                break
+            batches[channel].append(message)
+        for channel, messages in batches.items():
+            if messages:
+                self.append_log(self.logs[channel], "".join(messages))
+        for channel, (tracker, bar, label) in self.progress_widgets.items():
+            stats = tracker.snapshot()
+            bar.config(maximum=max(1, stats['total']), value=stats['done'])
+            label.config(text=tracker.format())
+        depth = self.watch_queue_depth
+        self.queue_label.config(text="" if depth is None else f"Watching: {depth} images waiting")
+        self.after(LOG_INTERVAL_MS, self.process_log_queue)
+
+    def append_log(self, widget, text):
+        widget.insert(tk.END, text)
+        lines = int(widget.index("end-1c").split(".")[0])
+        if lines > MAX_LOG_LINES:
+            widget.delete("1.0", f"{lines - MAX_LOG_LINES + 1}.0")
+        widget.see(tk.END)
+
+    def create_progress_widgets(self, frame, channel):
+        """Adds a progress bar and a live items/s, MB/s, ETA and error line to a tab."""
+        progress_frame = ttk.Frame(frame, padding=(10, 0))
+        progress_frame.pack(padx=10, fill="x")
+        bar = ttk.Progressbar(progress_frame, mode="determinate")
+        bar.pack(fill="x")
+        label = ttk.Label(progress_frame, text="")
+        label.pack(anchor="w")
+        self.progress_widgets[channel] = (ProgressTracker(), bar, label)
+
+    def tracker(self, channel):
+        return self.progress_widgets[channel][0]
+
+    def report_metrics(self, channel, metrics):
+        """Writes an action's metrics files and shows the percentiles in a tab's log."""
+        core.report_metrics(self.logger(channel), metrics)
 
     # --- Downloader Tab Methods ---
     def create_downloader_widgets(self):
@@ -103,7 +119,7 @@ class App(tk.Tk):
         ttk.Label(input_frame, text="Start URL:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
         self.start_url_entry = ttk.Entry(input_frame, width=60)
         self.start_url_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
-        ttk.Label(input_frame, text="Total Files:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text="Total Files (empty = auto):").grid(row=1, column=0, padx=5, pady=5, sticky="w")
         self.total_files_entry = ttk.Entry(input_frame)
         self.total_files_entry.grid(row=1, column=1, padx=5, pady=5, sticky="w")
         ttk.Label(input_frame, text="xf_user Cookie:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
@@ -112,83 +128,189 @@ class App(tk.Tk):
         ttk.Label(input_frame, text="xf_session Cookie:").grid(row=3, column=0, padx=5, pady=5, sticky="w")
         self.xf_session_entry = ttk.Entry(input_frame, show="*")
         self.xf_session_entry.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Label(input_frame, text="Parallel Downloads:").grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        self.workers_entry = ttk.Entry(input_frame)
+        self.workers_entry.insert(0, str(DEFAULT_WORKERS))
+        self.workers_entry.grid(row=4, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text="Job File (optional):").grid(row=5, column=0, padx=5, pady=5, sticky="w")
+        self.job_file_entry = ttk.Entry(input_frame, width=60)
+        self.job_file_entry.grid(row=5, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Button(input_frame, text="Browse...", command=self.browse_job_file).grid(row=5, column=2, padx=5, pady=5)
+        self.packed_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text=f"Store downloads in one pack file ({DOWNLOAD_DIRECTORY}{PACK_SUFFIX})",
+                        variable=self.packed_var).grid(row=6, column=1, padx=5, pady=5, sticky="w")
+        self.rediscover_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="Find the end of the sequence again (ignore earlier results)",
+                        variable=self.rediscover_var).grid(row=7, column=1, padx=5, pady=5, sticky="w")
         input_frame.columnconfigure(1, weight=1)
-        self.download_button = ttk.Button(frame, text="Start Download", command=self.start_download_thread)
-        self.download_button.pack(padx=10, pady=5)
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(padx=10, pady=5)
+        self.download_button = ttk.Button(button_frame, text="Start Download", command=self.start_download_thread)
+        self.download_button.pack(side="left", padx=5)
+        self.solve_button = ttk.Button(button_frame, text="Download and Solve", command=self.start_solve_thread)
+        self.solve_button.pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel_event.set, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+        self.create_progress_widgets(frame, DOWNLOADER)
         log_frame = ttk.LabelFrame(frame, text="Log", padding=(10, 5))
         log_frame.pack(padx=10, pady=10, fill="both", expand=True)
         self.downloader_log = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=15)
         self.downloader_log.pack(fill="both", expand=True)
         
+    def browse_job_file(self):
+        path = filedialog.askopenfilename(filetypes=[("Job files", "*.csv *.json"), ("All files", "*.*")])
+        if path:
+            self.job_file_entry.delete(0, tk.END)
+            self.job_file_entry.insert(0, path)
+
     def start_download_thread(self):
         self.download_button.config(state="disabled")
+        self.solve_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.cancel_event.clear()
         self.downloader_log.delete(1.0, tk.END)
         thread = threading.Thread(target=self.run_downloader, daemon=True)
         thread.start()
 
-    def run_downloader(self):
+    def read_downloader_inputs(self):
+        """
+        Validates the downloader fields. Returns (base_name, start_id, total_files, workers, cookies) or None.
+        An empty total means the end of the sequence has to be discovered (total_files is None).
+        """
         start_url = self.start_url_entry.get()
         total_files_str = self.total_files_entry.get()
         xf_user = self.xf_user_entry.get()
         xf_session = self.xf_session_entry.get()
 
-        if not all([start_url, total_files_str, xf_user, xf_session]):
-            messagebox.showerror("Error", "All fields are required.")
-            self.download_button.config(state="normal")
-            return
-            
+        if not all([start_url, xf_user, xf_session]):
+            messagebox.showerror("Error", "Start URL and both cookies are required.")
+            return None
+
         try:
-            total_files = int(total_files_str)
+            total_files = int(total_files_str) if total_files_str.strip() else None
+            workers = max(1, int(self.workers_entry.get() or DEFAULT_WORKERS))
         except ValueError:
-            messagebox.showerror("Error", "Total files must be a valid number.")
-            self.download_button.config(state="normal")
-            return
+            messagebox.showerror("Error", "Total files and parallel downloads must be valid numbers.")
+            return None
 
         base_name, start_id = parse_url_pattern(start_url)
         if base_name is None:
             messagebox.showerror("Error", "Could not parse the URL pattern.")
-            self.download_button.config(state="normal")
-            return
-            
-        self.log_queue.put(f"DOWNLOADER:Parsed URL. Base name: {base_name}, Start ID: {start_id}\n")
-        self.log_queue.put(f"DOWNLOADER:--- Starting Batch Download ---\n")
+            return None
 
-        if not os.path.exists(DOWNLOAD_DIRECTORY):
-            os.makedirs(DOWNLOAD_DIRECTORY)
-        
         cookies = {'xf_user': xf_user, 'xf_session': xf_session}
-        headers = {'User-Agent': 'Mozilla/5.0'}
+        return base_name, start_id, total_files, workers, cookies
+
+    def discover_total_files(self, base_name, start_id, cookies):
+        """Probes for the end of the sequence. Returns the file count, or None if it could not be found."""
+        return core.discover(base_name, start_id, cookies, log=self.logger(DOWNLOADER), cancel_event=self.cancel_event,
+                             refresh=self.rediscover_var.get())
+
+    def run_job_file(self, job_file):
+        """Downloads every sequence of a job file; the start URL and total fields are not used."""
+        xf_user, xf_session = self.xf_user_entry.get(), self.xf_session_entry.get()
+        if not xf_user or not xf_session:
+            messagebox.showerror("Error", "Both cookies are required.")
+            return
+        try:
+            workers = max(1, int(self.workers_entry.get() or DEFAULT_WORKERS))
+        except ValueError:
+            messagebox.showerror("Error", "Parallel downloads must be a valid number.")
+            return
+        # Each action collects its own metrics, so one tab's run never clears another's.
+        with METRICS.scope() as metrics:
+            core.download_jobs(self.workspace, job_file, {'xf_user': xf_user, 'xf_session': xf_session},
+                               DOWNLOAD_DIRECTORY, workers=workers, log=self.logger(DOWNLOADER),
+                               cancel_event=self.cancel_event, progress=self.tracker(DOWNLOADER),
+                               packed=self.packed_var.get(), refresh=self.rediscover_var.get())
+        self.report_metrics(DOWNLOADER, metrics)
+
+    def finish_download(self):
+        self.download_button.config(state="normal")
+        self.solve_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
 
-        successful, skipped = 0, 0
-        failed_urls = []
-        
-        for i in range(total_files):
-            current_id = start_id + i
-            file_url = f"https://fuoverflow.com/attachments/{base_name}.{current_id}/"
-            filename = f"{base_name}.{current_id}.webp"
-            filepath = os.path.join(DOWNLOAD_DIRECTORY, filename)
-            
-            if os.path.exists(filepath):
-                self.log_queue.put(f"DOWNLOADER:[SKIPPED] {filename} already exists.\n")
-                skipped += 1
-                continue
-
-            # NEW: Log the attempt before it happens
-            self.log_queue.put(f"DOWNLOADER:Downloading {filename} from {file_url}\n")
-                
-            if download_file_with_retry(file_url, filepath, cookies, headers, 4, 5, self.log_queue):
-                successful += 1
-            else:
-                failed_urls.append(file_url)
-            time.sleep(0.5)
-
-        self.log_queue.put(f"DOWNLOADER:\n--- Download Finished ---\n")
-        self.log_queue.put(f"DOWNLOADER:Summary: {successful} downloaded, {skipped} skipped, {len(failed_urls)} failed.\n")
-        
-        if failed_urls:
-            self.log_queue.put("DOWNLOADER:Failed URLs:\n" + "\n".join(failed_urls) + "\n")
-            
+    def run_downloader(self):
+        job_file = self.job_file_entry.get().strip()
+        if job_file:
+            self.run_job_file(job_file)
+            self.finish_download()
+            return
+        inputs = self.read_downloader_inputs()
+        if inputs is None:
+            self.finish_download()
+            return
+        base_name, start_id, total_files, workers, cookies = inputs
+
+        self.log(DOWNLOADER, f"Parsed URL. Base name: {base_name}, Start ID: {start_id}\n")
+        if total_files is None:
+            total_files = self.discover_total_files(base_name, start_id, cookies)
+            if total_files is None:
+                self.finish_download()
+                return
+        with METRICS.scope() as metrics:
+            core.download(self.workspace, base_name, start_id, total_files, cookies, DOWNLOAD_DIRECTORY,
+                          workers=workers, log=self.logger(DOWNLOADER), cancel_event=self.cancel_event,
+                          progress=self.tracker(DOWNLOADER), packed=self.packed_var.get())
+        self.report_metrics(DOWNLOADER, metrics)
+        self.finish_download()
+
+    def start_solve_thread(self):
+        self.download_button.config(state="disabled")
+        self.solve_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.cancel_event.clear()
+        self.downloader_log.delete(1.0, tk.END)
+        self.processor_log.delete(1.0, tk.END)
+        thread = threading.Thread(target=self.run_download_and_solve, daemon=True)
+        thread.start()
+
+    def finish_solve(self):
         self.download_button.config(state="normal")
+        self.solve_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+
+    def run_download_and_solve(self):
+        """Downloads and solves in one pipelined run; uses the API key from the processor tab."""
+        api_key = self.api_key_entry.get()
+        if not api_key:
+            messagebox.showerror("Error", "Enter your Gemini API Key in the Gemini Processor tab first.")
+            self.finish_solve()
+            return
+        try:
+            min_score = float(self.min_score_entry.get() or 0)
+            max_concurrency = max(1, int(self.concurrency_entry.get() or MAX_CONCURRENCY))
+        except ValueError:
+            messagebox.showerror("Error", "The minimum question score and parallel requests must be valid numbers.")
+            self.finish_solve()
+            return
+        inputs = self.read_downloader_inputs()
+        if inputs is None:
+            self.finish_solve()
+            return
+        base_name, start_id, total_files, workers, cookies = inputs
+
+        self.log(DOWNLOADER, f"Parsed URL. Base name: {base_name}, Start ID: {start_id}\n")
+        if total_files is None:
+            total_files = self.discover_total_files(base_name, start_id, cookies)
+            if total_files is None:
+                self.finish_solve()
+                return
+        try:
+            with METRICS.scope() as metrics:
+                core.run(self.workspace, base_name, start_id, total_files, cookies, api_key,
+                         profile=self.profile_combo.get() or DEFAULT_PROFILE, dedup=self.dedup_var.get(),
+                         near_duplicates=self.near_duplicates_var.get(), min_score=min_score, workers=workers,
+                         log=self.logger(DOWNLOADER), process_log=self.logger(PROCESSOR),
+                         cancel_event=self.cancel_event, progress=self.tracker(DOWNLOADER),
+                         process_progress=self.tracker(PROCESSOR), packed=self.packed_var.get(),
+                         max_concurrency=max_concurrency)
+        except Exception as e:
+            messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+            self.finish_solve()
+            return
+        self.report_metrics(PROCESSOR, metrics)
+        self.finish_solve()
 
     # --- Processor Tab Methods ---
     def create_processor_widgets(self):
@@ -208,9 +330,47 @@ class App(tk.Tk):
         self.dir_path_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
         browse_button = ttk.Button(input_frame, text="Browse...", command=self.browse_directory)
         browse_button.grid(row=1, column=2, padx=5, pady=5)
+        dedup_frame = ttk.Frame(input_frame)
+        dedup_frame.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        self.dedup_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(dedup_frame, text="Send only one image per group of identical pages",
+                        variable=self.dedup_var).pack(side="left")
+        self.near_duplicates_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dedup_frame, text="Also merge re-encoded copies",
+                        variable=self.near_duplicates_var).pack(side="left", padx=(10, 0))
+        ttk.Label(input_frame, text="Preprocessing:").grid(row=3, column=0, padx=5, pady=5, sticky="w")
+        self.profile_combo = ttk.Combobox(input_frame, values=list(PROFILES), state="readonly")
+        self.profile_combo.set(DEFAULT_PROFILE)
+        self.profile_combo.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text="Images per Request:").grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        self.batch_size_entry = ttk.Entry(input_frame)
+        self.batch_size_entry.insert(0, "1")
+        self.batch_size_entry.grid(row=4, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text="Max Parallel Requests:").grid(row=5, column=0, padx=5, pady=5, sticky="w")
+        self.concurrency_entry = ttk.Entry(input_frame)
+        self.concurrency_entry.insert(0, str(MAX_CONCURRENCY))
+        self.concurrency_entry.grid(row=5, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(input_frame, text=f"Min. Question Score (0 = off, {BLANK_PAGE_SCORE} = blank pages):").grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.min_score_entry = ttk.Entry(input_frame)
+        self.min_score_entry.insert(0, str(DEFAULT_MIN_SCORE))
+        self.min_score_entry.grid(row=6, column=1, padx=5, pady=5, sticky="w")
+        self.defer_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="Answer low-scoring images last instead of skipping them",
+                        variable=self.defer_var).grid(row=7, column=1, padx=5, pady=5, sticky="w")
+        self.watch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="Keep watching the directory and answer new images as they arrive",
+                        variable=self.watch_var).grid(row=8, column=1, padx=5, pady=5, sticky="w")
         input_frame.columnconfigure(1, weight=1)
-        self.process_button = ttk.Button(frame, text="Start Processing", command=self.start_processing_thread)
-        self.process_button.pack(padx=10, pady=5)
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(padx=10, pady=5)
+        self.process_button = ttk.Button(button_frame, text="Start Processing", command=self.start_processing_thread)
+        self.process_button.pack(side="left", padx=5)
+        self.stop_watch_button = ttk.Button(button_frame, text="Stop Watching", command=self.watch_cancel_event.set,
+                                            state="disabled")
+        self.stop_watch_button.pack(side="left", padx=5)
+        self.create_progress_widgets(frame, PROCESSOR)
+        self.queue_label = ttk.Label(frame, text="")
+        self.queue_label.pack(padx=20, anchor="w")
         log_frame = ttk.LabelFrame(frame, text="Log", padding=(10, 5))
         log_frame.pack(padx=10, pady=10, fill="both", expand=True)
         self.processor_log = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=15)
@@ -237,47 +397,91 @@ class App(tk.Tk):
             self.process_button.config(state="normal")
             return
 
-        if not os.path.isdir(image_dir):
-            messagebox.showerror("Error", "The provided path is not a valid directory.")
+        if not os.path.isdir(image_dir) and not is_pack(image_dir):
+            messagebox.showerror("Error", "The provided path is not a valid directory or pack file.")
+            self.process_button.config(state="normal")
+            return
+
+        try:
+            batch_size = max(1, int(self.batch_size_entry.get() or 1))
+            max_concurrency = max(1, int(self.concurrency_entry.get() or MAX_CONCURRENCY))
+            min_score = float(self.min_score_entry.get() or 0)
+        except ValueError:
+            messagebox.showerror("Error", "Images per request, parallel requests and the question score must be valid numbers.")
             self.process_button.config(state="normal")
             return
 
         with open(CONFIG_FILE, "w") as f:
             f.write(api_key)
             
-        output_txt_path = "all_questions_and_answers.txt"
-        prompt = "Read the attached image. Extract every question you can find and provide a correct, concise answer for each one."
-        valid_extensions = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
-
-        self.log_queue.put(f"PROCESSOR:Processing images in: {image_dir}\n")
-        self.log_queue.put(f"PROCESSOR:Results will be saved to: {output_txt_path}\n\n")
-
+        args = (self.workspace, image_dir, api_key, PROMPT, OUTPUT_TXT_PATH,
+                self.profile_combo.get() or DEFAULT_PROFILE, batch_size, max_concurrency)
+        options = dict(dedup=self.dedup_var.get(), near_duplicates=self.near_duplicates_var.get(),
+                       min_score=min_score, defer_low_score=self.defer_var.get(),
+                       log=self.logger(PROCESSOR), progress=self.tracker(PROCESSOR))
         try:
-            with open(output_txt_path, "a", encoding="utf-8") as output_file:
-                for filename in sorted(os.listdir(image_dir)):
-                    if filename.lower().endswith(valid_extensions):
-                        full_path = os.path.join(image_dir, filename)
-                        self.log_queue.put(f"PROCESSOR:Processing image: {filename}...\n")
-                        
-                        answer, error = get_answer_from_image_with_gemini(full_path, prompt, api_key)
-                        
-                        output_file.write(f"--- Question Source: {filename} ---\n")
-                        if error:
-                            self.log_queue.put(f"PROCESSOR:  -> ERROR: {error}\n")
-                            output_file.write(f"An error occurred: {error}\n")
-                        else:
-                            self.log_queue.put(f"PROCESSOR:  -> Success.\n")
-                            output_file.write(answer.strip() + "\n")
-                        
-                        output_file.write("\n" + "="*80 + "\n\n")
+            with METRICS.scope() as metrics:
+                if self.watch_var.get():
+                    self.watch_cancel_event.clear()
+                    self.stop_watch_button.config(state="normal")
+                    core.watch(*args, cancel_event=self.watch_cancel_event, on_queue_depth=self.set_watch_queue_depth,
+                               metrics=metrics, **options)
+                else:
+                    core.process(*args, **options)
         except Exception as e:
             messagebox.showerror("Error", f"An unexpected error occurred: {e}")
-            self.process_button.config(state="normal")
+            self.finish_processing()
             return
+        self.report_metrics(PROCESSOR, metrics)
+        self.finish_processing()
 
-        self.log_queue.put(f"PROCESSOR:\nBatch processing complete. Results appended to '{output_txt_path}'.\n")
+    def set_watch_queue_depth(self, depth):
+        self.watch_queue_depth = depth
+
+    def finish_processing(self):
+        self.watch_queue_depth = None
+        self.stop_watch_button.config(state="disabled")
         self.process_button.config(state="normal")
 
+    # --- Search Tab Methods ---
+    def create_search_widgets(self):
+        frame = self.search_tab
+        input_frame = ttk.Frame(frame, padding=(10, 5))
+        input_frame.pack(padx=10, pady=10, fill="x")
+        ttk.Label(input_frame, text="Search:").pack(side="left", padx=5)
+        self.search_entry = ttk.Entry(input_frame, width=60)
+        self.search_entry.pack(side="left", padx=5, fill="x", expand=True)
+        self.search_entry.bind("<Return>", lambda event: self.run_search())
+        ttk.Button(input_frame, text="Search", command=self.run_search).pack(side="left", padx=5)
+        ttk.Button(input_frame, text="Export Answer Bank", command=self.start_bank_export_thread).pack(side="left", padx=5)
+        self.search_status = ttk.Label(frame, text="")
+        self.search_status.pack(padx=10, anchor="w")
+        results_frame = ttk.LabelFrame(frame, text="Matches", padding=(10, 5))
+        results_frame.pack(padx=10, pady=10, fill="both", expand=True)
+        self.search_results = scrolledtext.ScrolledText(results_frame, wrap=tk.WORD, height=15)
+        self.search_results.pack(fill="both", expand=True)
+
+    def run_search(self):
+        """Runs a full-text query on the results store; fast enough to stay on the Tk thread."""
+        start = time.perf_counter()
+        matches = self.workspace.store().search(self.search_entry.get())
+        elapsed = (time.perf_counter() - start) * 1000
+        self.search_results.delete(1.0, tk.END)
+        self.search_results.insert(tk.END, "\n".join(format_match(*match) for match in matches))
+        self.search_status.config(text=f"{len(matches)} matches in {elapsed:.1f} ms")
+
+    def start_bank_export_thread(self):
+        self.search_status.config(text="Updating the answer bank...")
+        threading.Thread(target=self.run_bank_export, daemon=True).start()
+
+    def run_bank_export(self):
+        """Brings the answer bank up to date and writes it next to the text output."""
+        from answerbank import ANSWER_BANK_PATH
+        bank = self.workspace.bank()
+        bank.update()
+        count = bank.export(ANSWER_BANK_PATH)
+        self.search_status.config(text=f"{bank.summary()} {count} entries written to '{ANSWER_BANK_PATH}'.")
+
 
 if __name__ == "__main__":
     app = App()
@@ -0,0 +1,247 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from downloader import (DEFAULT_WORKERS, DEFAULT_RATE, MAX_RETRIES, RateLimiter, make_session, fetch_attachment,
+                        attachment_url, parse_url_pattern)
+from discovery import discover_range, ProbeError, RangeCache
+from progress import ProgressTracker
+from pack import PACK_SUFFIX, file_stat, open_pack
+
+# --- CONFIGURATION ---
+JOB_FIELDS = ('url', 'total', 'end', 'directory', 'name')   # CSV columns, in this order when there is no header
+STATUS_INTERVAL = 15.0    # seconds between per-sequence progress lines
+
+class JobFileError(ValueError):
+    """The job file cannot be read, or one of its entries is invalid."""
+
+class Sequence:
+    """One entry of a job file: an attachment sequence, how many files it has and where they go."""
+
+    def __init__(self, name, base_name, start_id, total, directory):
+        self.name = name
+        self.base_name = base_name
+        self.start_id = start_id
+        self.total = total
+        self.directory = directory
+        self.state = 'pending'     # then 'done', 'failed', 'skipped' (finished earlier) or 'cancelled'
+        self.successful = 0
+        self.skipped = 0
+        self.missing = 0           # IDs the server does not have; gaps, not failures
+        self.failed_urls = []
+        self.progress = ProgressTracker()
+
+    def status(self):
+        return f"{self.name}: {self.progress.format()}"
+
+def _parse_int(value, what, number):
+    value = str(value if value is not None else "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise JobFileError(f"Job {number}: '{value}' is not a valid {what}.")
+
+def _sequence(entry, number, root):
+    """Builds a Sequence from one job entry (a dict with the JOB_FIELDS)."""
+    url = str(entry.get('url') or "").strip()
+    base_name, start_id = parse_url_pattern(url)
+    if base_name is None:
+        raise JobFileError(f"Job {number}: could not parse the URL '{url}'.")
+    total = _parse_int(entry.get('total'), "number of files", number)
+    end = _parse_int(entry.get('end'), "last attachment ID", number)
+    if total is None and end is not None:
+        if end < start_id:
+            raise JobFileError(f"Job {number}: the last ID {end} comes before the first ID {start_id}.")
+        total = end - start_id + 1
+    if total is not None and total < 1:
+        raise JobFileError(f"Job {number}: the number of files must be at least 1.")
+    name = str(entry.get('name') or "").strip() or base_name
+    directory = str(entry.get('directory') or "").strip() or os.path.join(root, name)
+    return Sequence(name, base_name, start_id, total, directory)
+
+def load_jobs(path, root):
+    """
+    Reads a job file. JSON holds a list (or {"jobs": [...]}) of objects with the JOB_FIELDS, or
+    plain URL strings; CSV has one sequence per row, with a header row or in JOB_FIELDS order,
+    and lines starting with '#' are comments. Only `url` is required: without `total` or `end`
+    the length is discovered, and each sequence goes to `root/<name>` (the base name unless the
+    entry has a name) or its own `directory`. Raises JobFileError.
+    """
+    try:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            text = f.read()
+    except OSError as e:
+        raise JobFileError(f"Cannot read the job file: {e}")
+    if path.lower().endswith(".json"):
+        try:
+            entries = json.loads(text)
+        except ValueError as e:
+            raise JobFileError(f"The job file is not valid JSON: {e}")
+        if isinstance(entries, dict):
+            entries = entries.get('jobs', [])
+        entries = [{'url': entry} if isinstance(entry, str) else entry for entry in entries]
+    else:
+        rows = [row for row in csv.reader(text.splitlines()) if row and not row[0].lstrip().startswith("#")]
+        if rows and rows[0][0].strip().lower() == 'url':
+            header, rows = [column.strip().lower() for column in rows[0]], rows[1:]
+        else:
+            header = JOB_FIELDS
+        entries = [dict(zip(header, row)) for row in rows]
+    sequences, seen, directories = [], set(), set()
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise JobFileError(f"Job {number}: expected an object or a URL.")
+        sequence = _sequence(entry, number, root)
+        if (sequence.base_name, sequence.start_id) in seen:
+            raise JobFileError(f"Job {number}: {sequence.name} is listed twice.")
+        directory = os.path.normcase(os.path.abspath(sequence.directory))
+        if directory in directories:
+            raise JobFileError(f"Job {number}: {sequence.directory} is already used by another sequence; "
+                               f"give this one a name or a directory.")
+        seen.add((sequence.base_name, sequence.start_id))
+        directories.add(directory)
+        sequences.append(sequence)
+    if not sequences:
+        raise JobFileError("The job file lists no sequences.")
+    return sequences
+
+def interleave(sequences):
+    """Yields (sequence, attach_id) round-robin over the sequences, so each advances at the same pace."""
+    position = 0
+    while True:
+        active = [sequence for sequence in sequences if position < sequence.total]
+        if not active:
+            return
+        for sequence in active:
+            yield sequence, sequence.start_id + position
+        position += 1
+
+class JobQueue:
+    """
+    Downloads many sequences in one run. All of them share one session (connection pool) and one
+    per-host RateLimiter, and their IDs are queued round-robin, so every sequence advances at the
+    same pace instead of one after the other. With a Journal, every sequence's length and outcome
+    are recorded: a finished set is skipped without checking its files again, a discovered length
+    is not probed again (unless `refresh` is set, to pick up files added to a thread since),
+    and interrupted sets resume through the per-file download journal.
+    With `packed`, each set is stored in its own pack file, `<directory>.pack`.
+    """
+
+    def __init__(self, sequences, cookies, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, max_retries=MAX_RETRIES,
+                 journal=None, log=print, cancel_event=None, progress=None, packed=False, refresh=False):
+        self.sequences = sequences
+        self.cookies = cookies
+        self.workers = workers
+        self.rate = rate
+        self.max_retries = max_retries
+        self.journal = journal
+        self.log = log
+        self.cancel_event = cancel_event or threading.Event()
+        self.progress = progress
+        self.packed = packed
+        self.refresh = refresh
+
+    def _cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _prepare(self, session, limiter):
+        """Fills in missing lengths and returns the sequences that still have work to do."""
+        ranges = RangeCache()
+        active = []
+        for sequence in self.sequences:
+            if self._cancelled():
+                break
+            record = self.journal.sequence_state(sequence.base_name, sequence.start_id) if self.journal else None
+            if record is not None and sequence.total is None and not self.refresh:
+                sequence.total = record[1]
+            if record is not None and record == ('done', sequence.total):
+                sequence.state = 'skipped'
+                self.log(f"[QUEUE] {sequence.name}: all {sequence.total} files finished in an earlier run; skipped.")
+                continue
+            if sequence.total is None:
+                try:
+                    last_id, _ = discover_range(session, sequence.base_name, sequence.start_id, limiter,
+                                                cache=ranges, refresh=self.refresh, log=self.log,
+                                                cancel_event=self.cancel_event)
+                except ProbeError as e:
+                    if self._cancelled():
+                        break
+                    sequence.state = 'failed'
+                    self.log(f"[QUEUE] {sequence.name}: discovery failed ({e}); skipping this set.")
+                    continue
+                sequence.total = last_id - sequence.start_id + 1
+            if self.journal is not None:
+                self.journal.mark_sequence(sequence.base_name, sequence.start_id, sequence.total, 'started')
+            os.makedirs(sequence.directory, exist_ok=True)
+            sequence.progress.start(sequence.total)
+            active.append(sequence)
+        return active
+
+    def _finish(self, sequence):
+        sequence.state = 'failed' if sequence.failed_urls else 'done'
+        if self.journal is not None:
+            self.journal.mark_sequence(sequence.base_name, sequence.start_id, sequence.total, sequence.state)
+        self.log(f"[QUEUE] {sequence.name} finished: {sequence.successful} downloaded, {sequence.skipped} skipped, "
+                 f"{sequence.missing} missing, {len(sequence.failed_urls)} failed "
+                 f"-> {sequence.directory + (PACK_SUFFIX if self.packed else '')}")
+
+    def run(self):
+        """Downloads every sequence. Returns the sequences with their counts and final state."""
+        session = make_session(self.cookies, pool_size=self.workers)
+        limiter = RateLimiter(rate=self.rate, burst=max(1, self.workers))
+        try:
+            active = self._prepare(session, limiter)
+            if self._cancelled():
+                active = []
+            if self.progress is not None:
+                self.progress.start(sum(sequence.total for sequence in active))
+            if active:
+                self.log(f"[QUEUE] Downloading {len(active)} sets, "
+                         f"{sum(sequence.total for sequence in active)} files in total.")
+            packs = {sequence: open_pack(sequence.directory + PACK_SUFFIX) if self.packed else None
+                     for sequence in active}
+            next_status = time.monotonic() + STATUS_INTERVAL
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            try:
+                pending = {executor.submit(fetch_attachment, session, sequence.base_name, attach_id,
+                                           sequence.directory, limiter, self.max_retries, self.log,
+                                           self.cancel_event, self.journal, packs[sequence]): (sequence, attach_id)
+                           for sequence, attach_id in interleave(active)}
+                for future in as_completed(pending):
+                    sequence, attach_id = pending[future]
+                    status, filepath = future.result()
+                    nbytes = file_stat(filepath)[0] if status == 'downloaded' else 0
+                    sequence.progress.update(nbytes=nbytes, error=status == 'failed')
+                    if self.progress is not None:
+                        self.progress.update(nbytes=nbytes, error=status == 'failed')
+                    if status == 'downloaded':
+                        sequence.successful += 1
+                    elif status == 'skipped':
+                        sequence.skipped += 1
+                    elif status == 'missing':
+                        sequence.missing += 1
+                    elif not self._cancelled():
+                        sequence.failed_urls.append(attachment_url(sequence.base_name, attach_id))
+                    if sequence.progress.done == sequence.total and not self._cancelled():
+                        self._finish(sequence)
+                    if time.monotonic() >= next_status:
+                        next_status = time.monotonic() + STATUS_INTERVAL
+                        self.log("[QUEUE] " + " | ".join(s.status() for s in active if s.state == 'pending'))
+            except BaseException:
+                # Leaving a `with` block would wait for every queued ID; cancel them instead.
+                self.cancel_event.set()
+                raise
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        finally:
+            session.close()
+        for sequence in self.sequences:
+            sequence.failed_urls.sort()
+            if sequence.state == 'pending':
+                sequence.state = 'cancelled'
+        return self.sequences
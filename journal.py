@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from pack import file_stat
+
+# --- CONFIGURATION ---
+JOURNAL_FILE = "job_journal.sqlite3"
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# End markers of the formats that have one; WebP carries its length in the RIFF header instead.
+TRAILERS = ((b"\x89PNG", b"IEND\xaeB`\x82"), (b"\xff\xd8", b"\xff\xd9"), (b"GIF8", b";"))
+
+def image_complete(path):
+    """
+    True when an image file holds all of its bytes: a WebP as long as its RIFF header says, or a
+    PNG, JPEG or GIF that ends with its end marker. False for truncated files and unknown formats.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return size >= int.from_bytes(head[4:8], "little") + 8
+        for magic, trailer in TRAILERS:
+            if head.startswith(magic):
+                f.seek(max(0, size - len(trailer) - 2))
+                return trailer in f.read()
+    return False
+
+class Journal:
+    """
+    Durable SQLite journal of job progress, so an interrupted run resumes where it stopped.
+    Downloads are keyed by (job, attachment ID) with their state, byte count and checksum;
+    whole sequences of a job queue by (base name, start ID) with their length and outcome;
+    processed images by (job, path) with the size and mtime they had when answered, and for
+    pages the prefilter skipped, their score and the minimum score they fell below.
+    Every change is committed right away. Safe to share between worker threads.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            " job TEXT NOT NULL, attach_id INTEGER NOT NULL, state TEXT NOT NULL,"
+            " bytes INTEGER, checksum TEXT, updated REAL NOT NULL,"
+            " PRIMARY KEY (job, attach_id))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sequences ("
+            " base_name TEXT NOT NULL, start_id INTEGER NOT NULL, total INTEGER NOT NULL,"
+            " state TEXT NOT NULL, updated REAL NOT NULL,"
+            " PRIMARY KEY (base_name, start_id))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " job TEXT NOT NULL, image TEXT NOT NULL, state TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime REAL NOT NULL, updated REAL NOT NULL,"
+            " score REAL, min_score REAL,"
+            " PRIMARY KEY (job, image))")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed)")}
+        for column in ('score', 'min_score'):
+            if column not in columns:
+                # Journals from before skipped pages kept their score.
+                self._conn.execute(f"ALTER TABLE processed ADD COLUMN {column} REAL")
+        self._conn.commit()
+
+    # --- Downloads ---
+
+    def mark_download(self, job, attach_id, state, size=None, checksum=None):
+        """Records a download state: 'started', 'done', 'failed' or 'missing' (the server has no such ID)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads (job, attach_id, state, bytes, checksum, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (job, attach_id, state, size, checksum, time.time()))
+            self._conn.commit()
+
+    def download_state(self, job, attach_id):
+        """Returns (state, bytes, checksum) for one attachment, or None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, bytes, checksum FROM downloads WHERE job = ? AND attach_id = ?",
+                (job, attach_id)).fetchone()
+
+    def is_downloaded(self, job, attach_id, filepath):
+        """
+        True when `filepath` holds a complete download. A file without a record predates the
+        journal, and one still recorded as 'started' was moved into place just before a crash;
+        either is adopted as done only if `image_complete` accepts it. A recorded size that no
+        longer matches means the file is damaged and has to be fetched again.
+        """
+        if not os.path.exists(filepath):
+            return False
+        record = self.download_state(job, attach_id)
+        size = os.path.getsize(filepath)
+        if record is None or record[0] == 'started':
+            if not image_complete(filepath):
+                return False
+            self.mark_download(job, attach_id, 'done', size, file_checksum(filepath))
+            return True
+        state, recorded_size, _ = record
+        return state == 'done' and recorded_size == size
+
+    # --- Sequences ---
+
+    def mark_sequence(self, base_name, start_id, total, state):
+        """Records a sequence of a job queue: 'started', 'done' or 'failed'."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sequences (base_name, start_id, total, state, updated)"
+                " VALUES (?, ?, ?, ?, ?)", (base_name, start_id, total, state, time.time()))
+            self._conn.commit()
+
+    def sequence_state(self, base_name, start_id):
+        """Returns (state, total) for one sequence, or None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, total FROM sequences WHERE base_name = ? AND start_id = ?",
+                (base_name, start_id)).fetchone()
+
+    # --- Processing ---
+
+    def mark_processed(self, job, image_path, state='done', score=None, min_score=None):
+        """
+        Records that an image has been answered ('done'), failed ('error') or was held back by the
+        prefilter ('skipped', with its score and the minimum score it fell below).
+        """
+        size, mtime = file_stat(image_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed (job, image, state, size, mtime, updated, score, min_score)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job, os.path.abspath(image_path), state, size, mtime, time.time(), score, min_score))
+            self._conn.commit()
+
+    def is_processed(self, job, image_path, min_score=None):
+        """
+        True when the image was answered for this job and has not changed since. A page the
+        prefilter skipped only counts while it would still be skipped: with `min_score` (the
+        current run's, 0 when it answers every page) it is pending again once its score is no
+        longer below it, or when its score was not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, size, mtime, score FROM processed WHERE job = ? AND image = ?",
+                (job, os.path.abspath(image_path))).fetchone()
+        if row is None or row[0] not in ('done', 'skipped'):
+            return False
+        if row[0] == 'skipped' and min_score is not None and (row[3] is None or row[3] >= min_score):
+            return False
+        return (row[1], row[2]) == file_stat(image_path)
+
+    def pending_images(self, job, image_paths, min_score=None):
+        """Filters out the images this job has already answered (see `is_processed` for `min_score`)."""
+        return [path for path in image_paths if not self.is_processed(job, path, min_score)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,242 @@
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+METRICS_JSON = "run_metrics.json"
+METRICS_PROM = "run_metrics.prom"     # Prometheus text format, e.g. for the node_exporter textfile collector
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1024, 10240, 51200, 102400, 262144, 524288, 1048576, 4194304, 16777216)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+RESERVOIR_SIZE = 5000                 # samples kept per histogram for percentiles
+PERCENTILES = (50, 90, 99)
+TRACE_FLUSH_EVENTS = 10000            # trace events held in memory before they are appended to the trace file
+
+class Histogram:
+    """Cumulative-bucket histogram plus a uniform reservoir sample for percentiles."""
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def summary(self):
+        result = {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None}
+        for p in PERCENTILES:
+            result[f"p{p}"] = self.percentile(p)
+        return result
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _prom_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Metrics:
+    """
+    Run-wide registry of counters, gauges and histograms, keyed by name and labels.
+    `span` times a block of code, records it as `<name>_seconds` and passes it to every
+    trace hook, which is how an external profiler or tracer can follow the stages.
+    `scope` gives one run a registry of its own, so runs never have to reset the shared one.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._scopes = ()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    @contextmanager
+    def scope(self):
+        """
+        Yields a fresh Metrics that receives everything recorded here while the block runs,
+        e.g. one per GUI action. Actions that overlap in time see each other's samples in
+        their scopes, but none of them clears what another has collected.
+        """
+        scope = Metrics()
+        with self._lock:
+            self._scopes += (scope,)
+        try:
+            yield scope
+        finally:
+            with self._lock:
+                self._scopes = tuple(other for other in self._scopes if other is not scope)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            scopes = self._scopes
+        for scope in scopes:
+            scope.count(name, amount, **labels)
+
+    def gauge(self, name, value, **labels):
+        """Sets a value that can go up and down, such as a queue depth."""
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+            scopes = self._scopes
+        for scope in scopes:
+            scope.gauge(name, value, **labels)
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+            scopes = self._scopes
+        for scope in scopes:
+            scope.observe(name, value, buckets, **labels)
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe(f"{name}_seconds", duration, **labels)
+            for hook in list(self._hooks):
+                hook(name, labels, start, duration)
+
+    def add_hook(self, hook):
+        """Registers hook(name, labels, start, duration), called after every span (start is perf_counter time)."""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def summary(self):
+        """Plain dict of every counter, gauge and histogram summary, for the JSON report."""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(key), 'value': value}
+                        for (name, key), value in sorted(self.counters.items())]
+            gauges = [{'name': name, 'labels': dict(key), 'value': value}
+                      for (name, key), value in sorted(self.gauges.items())]
+            histograms = [{'name': name, 'labels': dict(key), **histogram.summary()}
+                          for (name, key), histogram in sorted(self.histograms.items())]
+        return {'started': self.started, 'duration': time.time() - self.started,
+                'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def to_prometheus(self, prefix="fuoverflow_"):
+        lines = []
+        with self._lock:
+            for (name, key), value in sorted(self.counters.items()):
+                lines.append(f"{prefix}{name}_total{_prom_labels(key)} {value}")
+            for (name, key), value in sorted(self.gauges.items()):
+                lines.append(f"{prefix}{name}{_prom_labels(key)} {value}")
+            for (name, key), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{_prom_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}{name}_bucket{_prom_labels(key, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{prefix}{name}_sum{_prom_labels(key)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{_prom_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Human-readable lines for the console or the GUI log."""
+        summary = self.summary()
+        lines = [f"--- Metrics ({summary['duration']:.1f} s) ---"]
+        for entry in summary['histograms']:
+            labels = "".join(f" {key}={value}" for key, value in entry['labels'].items())
+            unit = " s" if entry['name'].endswith('_seconds') else ""
+            percentiles = ", ".join(f"p{p} {entry[f'p{p}']:.3g}{unit}" for p in PERCENTILES)
+            lines.append(f"{entry['name']}{labels}: n={entry['count']}, {percentiles}")
+        for entry in summary['counters'] + summary['gauges']:
+            labels = "".join(f" {key}={value}" for key, value in entry['labels'].items())
+            lines.append(f"{entry['name']}{labels}: {entry['value']:g}")
+        return "\n".join(lines)
+
+    def write(self, json_path=METRICS_JSON, prom_path=METRICS_PROM):
+        """Writes the JSON summary and the Prometheus text file (each via a temp file and rename)."""
+        for path, text in ((json_path, json.dumps(self.summary(), indent=1)), (prom_path, self.to_prometheus())):
+            if not path:
+                continue
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+class ChromeTraceHook:
+    """
+    Trace hook that collects spans as Chrome trace events; open the written file in
+    chrome://tracing or Perfetto to see every stage on a per-thread timeline.
+    Events are appended to the file every `flush_events`, so a long watch only holds one
+    batch in memory. The file uses the trace format's JSON array form, whose closing
+    bracket is optional: a trace cut short by a crash still opens.
+    """
+
+    def __init__(self, path="trace.json", flush_events=TRACE_FLUSH_EVENTS):
+        self.path = path
+        self.flush_events = flush_events
+        self.events = []
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, name, labels, start, duration):
+        event = {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': labels}
+        with self._lock:
+            self.events.append(event)
+            if len(self.events) >= self.flush_events:
+                self._flush()
+
+    def _flush(self):
+        with open(self.path, "a" if self.written else "w", encoding="utf-8") as f:
+            for event in self.events:
+                f.write((",\n" if self.written else "[\n") + json.dumps(event))
+                self.written += 1
+        self.events = []
+
+    def write(self):
+        """Appends the remaining events and closes the array."""
+        with self._lock:
+            self._flush()
+            with open(self.path, "a" if self.written else "w", encoding="utf-8") as f:
+                f.write("\n]\n" if self.written else "[]\n")
+
+METRICS = Metrics()
+
+if os.environ.get("FUO_TRACE"):
+    # FUO_TRACE=<file> records every span of the run for chrome://tracing.
+    import atexit
+    _trace_hook = ChromeTraceHook(os.environ["FUO_TRACE"])
+    METRICS.add_hook(_trace_hook)
+    atexit.register(_trace_hook.write)
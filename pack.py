@@ -0,0 +1,286 @@
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# --- CONFIGURATION ---
+PACK_SUFFIX = ".pack"         # downloaded_images.pack holds what downloaded_images/ would
+INDEX_SUFFIX = ".idx"         # SQLite index next to the pack: name -> offset, length, hash
+COPY_CHUNK = 1 << 20
+
+# Images inside a pack are addressed like files in a folder named after the pack, e.g.
+# "downloaded_images.pack/name-webp.199272.webp", so every stage that takes an image path
+# works on packed images as well. read_bytes, image_source and file_stat below resolve
+# such paths through the pack's memory map instead of opening a file per image.
+
+def is_pack(path):
+    return path.endswith(PACK_SUFFIX) and os.path.isfile(path)
+
+def split_packed(path):
+    """Returns (pack_path, name) for a path inside a pack, or None for an ordinary file."""
+    pack_path, name = os.path.split(path)
+    if is_pack(pack_path):
+        return pack_path, name
+    return None
+
+class ImagePack:
+    """
+    Append-only pack file of images plus a SQLite index of each image's offset, length,
+    SHA-256 and attachment ID. Adding an image that is already packed appends the new bytes
+    and repoints the index; `compact` drops the superseded copies. Reads slice a shared
+    memory map, which is re-created when the pack has grown. Safe to share between worker
+    threads; other processes may read a pack while one process appends to it, but compaction
+    needs the pack to itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            open(path, "ab").close()
+        self._conn = sqlite3.connect(path + INDEX_SUFFIX, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " name TEXT PRIMARY KEY, attach_id INTEGER, offset INTEGER NOT NULL, length INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL, added REAL NOT NULL, new_offset INTEGER)")
+        self._conn.commit()
+        self._recover()
+        self._entries = {name: (offset, length, sha256, added) for name, offset, length, sha256, added in
+                         self._conn.execute("SELECT name, offset, length, sha256, added FROM images")}
+        self._file = open(path, "r+b")
+        self._map = None
+
+    def _recover(self):
+        """Finishes or rolls back a compaction that was interrupted (see `compact`)."""
+        if self._conn.execute("SELECT 1 FROM images WHERE new_offset IS NOT NULL LIMIT 1").fetchone() is None:
+            return
+        with self._conn:
+            if os.path.exists(self.path + ".tmp"):
+                # The new pack was never swapped in: the old offsets still hold.
+                os.remove(self.path + ".tmp")
+                self._conn.execute("UPDATE images SET new_offset = NULL")
+            else:
+                self._conn.execute("UPDATE images SET offset = new_offset, new_offset = NULL")
+
+    def __contains__(self, name):
+        return self._entry(name) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def names(self):
+        """The packed image names, sorted."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM images ORDER BY name")]
+
+    def _entry(self, name):
+        """(offset, length, sha256, added) for one image; looks in the index again for images another process added."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                row = self._conn.execute("SELECT offset, length, sha256, added FROM images WHERE name = ?",
+                                         (name,)).fetchone()
+                if row is not None:
+                    entry = self._entries[name] = tuple(row)
+            return entry
+
+    def add(self, name, data, attach_id=None):
+        """Appends one image and indexes it. The bytes are on disk before the index points at them."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            added = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (name, attach_id, offset, length, sha256, added)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (name, attach_id, offset, len(data), digest, added))
+            self._conn.commit()
+            self._entries[name] = (offset, len(data), digest, added)
+        return digest
+
+    def add_file(self, file_path, name=None, attach_id=None):
+        with open(file_path, "rb") as f:
+            return self.add(name or os.path.basename(file_path), f.read(), attach_id)
+
+    def read(self, name):
+        """Returns the bytes of one image; raises KeyError if it is not in the pack."""
+        entry = self._entry(name)
+        if entry is None:
+            raise KeyError(f"{name} is not in {self.path}")
+        offset, length = entry[0], entry[1]
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[offset:offset + length]
+
+    def stat(self, name):
+        """(size, mtime) of one image, with the time it was packed standing in for the mtime."""
+        entry = self._entry(name)
+        if entry is None:
+            raise FileNotFoundError(f"{name} is not in {self.path}")
+        return entry[1], entry[3]
+
+    def sha256(self, name):
+        entry = self._entry(name)
+        return entry[2] if entry is not None else None
+
+    def verify(self):
+        """Returns the names whose bytes no longer match their recorded hash."""
+        return [name for name in self.names() if hashlib.sha256(self.read(name)).hexdigest() != self.sha256(name)]
+
+    def dead_bytes(self):
+        """Bytes taken up by superseded copies and interrupted appends."""
+        with self._lock:
+            live = self._conn.execute("SELECT COALESCE(SUM(length), 0) FROM images").fetchone()[0]
+        return os.path.getsize(self.path) - live
+
+    def compact(self):
+        """
+        Rewrites the pack with only the live images, in name order, and swaps it in.
+        The new offsets are committed next to the old ones before the swap, so a pack opened
+        after a crash at any point either finishes the swap or keeps the old file.
+        Returns the number of bytes reclaimed.
+        """
+        before = os.path.getsize(self.path)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            rows = self._conn.execute("SELECT name, offset, length FROM images ORDER BY name").fetchall()
+            moved = []
+            with open(tmp_path, "wb") as out:
+                for name, offset, length in rows:
+                    moved.append((out.tell(), name))
+                    self._file.seek(offset)
+                    remaining = length
+                    while remaining:
+                        chunk = self._file.read(min(COPY_CHUNK, remaining))
+                        out.write(chunk)
+                        remaining -= len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            with self._conn:
+                self._conn.executemany("UPDATE images SET new_offset = ? WHERE name = ?", moved)
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            with self._conn:
+                self._conn.execute("UPDATE images SET offset = new_offset, new_offset = NULL")
+            self._file = open(self.path, "r+b")
+            self._entries = {name: (offset, length, sha256, added) for name, offset, length, sha256, added in
+                             self._conn.execute("SELECT name, offset, length, sha256, added FROM images")}
+        return before - os.path.getsize(self.path)
+
+    def export(self, directory):
+        """Writes every image back out as a loose file. Returns the number of files written."""
+        os.makedirs(directory, exist_ok=True)
+        names = self.names()
+        for name in names:
+            tmp_path = os.path.join(directory, name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(self.read(name))
+            os.replace(tmp_path, os.path.join(directory, name))
+        return len(names)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._conn.close()
+
+# Packs opened by path, one per pack file and process: a forked worker process must not use
+# its parent's SQLite connection, so it opens its own.
+_packs = {}
+_packs_lock = threading.Lock()
+
+def open_pack(path):
+    """Returns the shared ImagePack for a pack file, opening it on first use."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _packs_lock:
+        pack = _packs.get(key)
+        if pack is None:
+            pack = _packs[key] = ImagePack(path)
+        return pack
+
+def read_bytes(image_path):
+    """The bytes of an image, from its pack or its file."""
+    packed = split_packed(image_path)
+    if packed is not None:
+        return open_pack(packed[0]).read(packed[1])
+    with open(image_path, "rb") as f:
+        return f.read()
+
+def image_source(image_path):
+    """Something Image.open accepts: the path itself, or an in-memory file for a packed image."""
+    packed = split_packed(image_path)
+    if packed is None:
+        return image_path
+    return io.BytesIO(open_pack(packed[0]).read(packed[1]))
+
+def file_stat(image_path):
+    """(size, mtime) of an image, packed or not."""
+    packed = split_packed(image_path)
+    if packed is not None:
+        return open_pack(packed[0]).stat(packed[1])
+    stat = os.stat(image_path)
+    return stat.st_size, stat.st_mtime
+
+def image_exists(image_path):
+    """Whether an image is still there, packed or not."""
+    packed = split_packed(image_path)
+    if packed is not None:
+        return packed[1] in open_pack(packed[0])
+    return os.path.isfile(image_path)
+
+# --- SCRIPT EXECUTION ---
+USAGE = """Usage:
+  python pack.py import <pack> <directory>   Add the images of a folder to a pack (created if missing)
+  python pack.py export <pack> <directory>   Write every packed image back out as a loose file
+  python pack.py compact <pack>              Drop superseded copies from a pack
+  python pack.py verify <pack>               Check every packed image against its hash
+  python pack.py stats <pack>                Show the image count and the space taken by dead bytes"""
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ('import', 'export', 'compact', 'verify', 'stats') \
+            or (sys.argv[1] in ('import', 'export') and len(sys.argv) < 4):
+        print(USAGE)
+        sys.exit(1)
+    command, pack_path = sys.argv[1], sys.argv[2]
+    if command != 'import' and not is_pack(pack_path):
+        sys.exit(f"Error: '{pack_path}' is not a pack file.")
+    pack = ImagePack(pack_path)
+    if command == 'import':
+        from results import attachment_id
+        directory = sys.argv[3]
+        names = [name for name in sorted(os.listdir(directory)) if os.path.isfile(os.path.join(directory, name))]
+        for name in names:
+            pack.add_file(os.path.join(directory, name), name, attachment_id(name))
+        print(f"Packed {len(names)} files from '{directory}' into '{pack_path}'.")
+    elif command == 'export':
+        print(f"Exported {pack.export(sys.argv[3])} images to '{sys.argv[3]}'.")
+    elif command == 'compact':
+        print(f"Compacted '{pack_path}': {pack.compact() / 1024 / 1024:.1f} MB reclaimed.")
+    elif command == 'verify':
+        damaged = pack.verify()
+        for name in damaged:
+            print(f"[DAMAGED] {name}")
+        print(f"{len(pack)} images checked, {len(damaged)} damaged.")
+        pack.close()
+        sys.exit(1 if damaged else 0)
+    else:
+        print(f"{len(pack)} images, {os.path.getsize(pack_path) / 1024 / 1024:.1f} MB, "
+              f"{pack.dead_bytes() / 1024 / 1024:.1f} MB dead.")
+    pack.close()
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader import backoff_delay
+from processor import PROMPT, answer_image, error_message, resolve_target
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+DEFAULT_CONCURRENCY = 4       # requests in flight at the start of a run
+MAX_CONCURRENCY = 16
+TARGET_LATENCY = 30.0         # seconds; slower answers mean the API is queueing our requests
+MAX_RETRIES = 5               # attempts per image when the API keeps throttling
+BASE_BACKOFF = 2.0
+THROTTLE_ERRORS = ('TooManyRequests', 'ServiceUnavailable')   # google.api_core exceptions, resolved on first use
+
+def throttle_errors():
+    """The exception classes that mean the API is throttling us (imports the SDK)."""
+    from google.api_core import exceptions as api_exceptions
+    return tuple(getattr(api_exceptions, name) for name in THROTTLE_ERRORS)
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight requests. Every answered request raises the limit by 1/limit
+    (about +1 per round of requests); a 429/quota error halves it, and answers slower than
+    `target_latency` trim it by 10%, so the run settles just below the rate limit.
+    """
+
+    def __init__(self, initial=DEFAULT_CONCURRENCY, max_limit=MAX_CONCURRENCY, target_latency=TARGET_LATENCY):
+        self.max_limit = max_limit
+        self.limit = float(max(1, min(initial, max_limit)))
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, cancel_event=None):
+        """Waits for a free slot. Returns False if the run was cancelled meanwhile."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                self._cond.wait(0.2)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif latency is not None and latency > self.target_latency:
+                self.limit = max(1.0, self.limit * 0.9)
+            elif latency is not None:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+class ParallelProcessor:
+    """
+    Answers a folder of images on a worker pool that shares one configured model.
+    The number of requests in flight follows AdaptiveConcurrency; throttled requests are
+    retried with backoff, every other failure becomes that image's error. Near-duplicates
+    are resolved up front so each cluster is sent once, and results come back in input order.
+    """
+
+    def __init__(self, prompt=PROMPT, api_key=None, cache=None, index=None, preprocessor=None,
+                 max_concurrency=MAX_CONCURRENCY, log=print, cancel_event=None):
+        self.prompt = prompt
+        self.api_key = api_key
+        self.cache = cache
+        self.index = index
+        self.preprocessor = preprocessor
+        self.limiter = AdaptiveConcurrency(min(DEFAULT_CONCURRENCY, max_concurrency), max_concurrency)
+        self.log = log
+        self.cancel_event = cancel_event or threading.Event()
+
+    def solve(self, image_paths):
+        """
+        Yields (image_path, answer, error, duplicate_of, latency) for every image, in input order.
+        `latency` is the seconds spent answering the image, None for near-duplicates.
+        """
+        targets = []
+        for image_path in image_paths:
+            try:
+                target, duplicate_of = resolve_target(image_path, self.index)
+                targets.append((image_path, target, duplicate_of, None))
+            except Exception as e:
+                targets.append((image_path, None, None, error_message(image_path, e)))
+        with ThreadPoolExecutor(max_workers=self.limiter.max_limit) as executor:
+            futures = {}
+            for _, target, _, _ in targets:
+                if target is not None and target not in futures:
+                    futures[target] = executor.submit(self.answer, target)
+            completed = False
+            try:
+                for image_path, target, duplicate_of, error in targets:
+                    if target is None:
+                        yield image_path, None, error, None, None
+                        continue
+                    answer, error, latency = futures[target].result()
+                    yield image_path, answer, error, duplicate_of, None if duplicate_of else latency
+                completed = True
+            finally:
+                if not completed:
+                    # The caller gave up on the generator early; stop the queued work.
+                    self.cancel_event.set()
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def summary(self):
+        return (f"Parallel requests: settled at {int(self.limiter.limit)} in flight, "
+                f"{self.limiter.throttled} throttled responses.")
+
+    def answer(self, image_path):
+        """
+        Returns (answer, error, latency) for one image, waiting for a slot under the adaptive
+        limit and retrying throttled requests. Safe to call from several threads at once.
+        """
+        throttled_by = throttle_errors()
+        for attempt in range(MAX_RETRIES):
+            queued = time.monotonic()
+            if not self.limiter.acquire(self.cancel_event):
+                return None, error_message(image_path, "cancelled"), None
+            start = time.monotonic()
+            METRICS.observe('gemini_queue_seconds', start - queued)
+            try:
+                answer = answer_image(image_path, self.prompt, self.api_key, self.cache, self.preprocessor)
+            except throttled_by as e:
+                self.limiter.release(throttled=True)
+                METRICS.count('gemini_throttled')
+                if attempt + 1 == MAX_RETRIES:
+                    return None, error_message(image_path, e), None
+                delay = backoff_delay(attempt, BASE_BACKOFF)
+                self.log(f"  -> Rate limited on {os.path.basename(image_path)}; "
+                         f"now {int(self.limiter.limit)} in flight, retrying in {delay:.1f} seconds...")
+                if self.cancel_event.wait(delay):
+                    return None, error_message(image_path, "cancelled"), None
+                continue
+            except Exception as e:
+                self.limiter.release()
+                METRICS.count('gemini_errors', cause=type(e).__name__)
+                return None, error_message(image_path, e), time.monotonic() - start
+            latency = time.monotonic() - start
+            self.limiter.release(latency)
+            METRICS.observe('image_seconds', latency)
+            return answer, None, latency
+        return None, error_message(image_path, "too many attempts"), None
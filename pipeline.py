@@ -0,0 +1,242 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from downloader import (DEFAULT_WORKERS, DEFAULT_RATE, MAX_RETRIES, RateLimiter, make_session,
+                        attachment_filename, fetch_attachment, parse_url_pattern)
+from processor import PROMPT, solve_image, write_result
+from pack import file_stat
+
+# --- CONFIGURATION ---
+QUEUE_SIZE = 8           # downloaded-but-unprocessed images held in memory at most
+POLL_INTERVAL = 0.2
+
+_DONE = object()
+_ANSWERED = object()      # stands in for the answer of an image a previous run already wrote
+_MISSING = object()       # stands in for the answer of an ID the server does not have; nothing is written
+
+def _put(q, item, cancel_event):
+    """Blocking put that gives up once the run is cancelled."""
+    while not cancel_event.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def run_pipeline(base_name, start_id, total_files, directory, cookies, api_key, output_txt_path,
+                 prompt=PROMPT, download_workers=DEFAULT_WORKERS, process_workers=None,
+                 queue_size=QUEUE_SIZE, rate=DEFAULT_RATE, log=print, process_log=None, cancel_event=None,
+                 cache=None, index=None, preprocessor=None, journal=None, store=None,
+                 progress=None, process_progress=None, prefilter=None, pack=None, engine=None):
+    """
+    Downloads a sequence of attachments and solves them with Gemini at the same time.
+    Downloaded images go through a bounded queue (backpressure: downloaders wait when
+    the processor falls behind) and results are written in attachment-ID order.
+    An optional AnswerCache skips the model call for images it has already seen, and an
+    optional PerceptualIndex checks every new download against earlier near-duplicates.
+    A Preprocessor shrinks images on its own process pool before they are uploaded.
+    Images are answered on `process_workers` threads (by default one per request a
+    ParallelProcessor `engine` may have in flight, else one); with an engine the requests
+    follow its adaptive concurrency limit and throttled ones are retried with backoff.
+    With a Journal, a restarted run resumes partial downloads and skips images that
+    were already written to `output_txt_path`. A ResultStore gets every result as well.
+    `progress` and `process_progress` (ProgressTrackers) follow the two stages.
+    A Prefilter scores every download first and skips pages without question text.
+    With an ImagePack the downloads are stored in the pack and answered from there.
+    If a processor fails, the run is cancelled, the results so far are written and the
+    error is raised. Returns (processed, errors).
+    """
+    process_log = process_log or log
+    cancel_event = cancel_event or threading.Event()
+    if process_workers is None:
+        process_workers = engine.limiter.max_limit if engine is not None else 1
+    os.makedirs(directory, exist_ok=True)
+
+    session = make_session(cookies, pool_size=download_workers)
+    limiter = RateLimiter(rate=rate, burst=max(1, download_workers))
+    image_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue()
+    answers = {}
+    job = os.path.abspath(output_txt_path)
+    skip_below = prefilter.skip_below if prefilter is not None else 0.0
+    failures = []
+
+    def fetch(attach_id):
+        status, filepath = fetch_attachment(session, base_name, attach_id, directory, limiter, MAX_RETRIES,
+                                            log, cancel_event, journal, pack)
+        filename = attachment_filename(base_name, attach_id)
+        if progress is not None:
+            progress.update(nbytes=file_stat(filepath)[0] if status == 'downloaded' else 0,
+                            error=status == 'failed')
+        _put(image_queue, (attach_id, filename, filepath if status != 'failed' else None, status), cancel_event)
+
+    def process_queue():
+        while True:
+            try:
+                item = image_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if cancel_event.is_set():
+                    return
+                continue
+            if item is _DONE or cancel_event.is_set():
+                return
+            attach_id, filename, filepath, status = item
+            duplicate_of, latency = None, None
+            if status == 'missing':
+                if process_progress is not None:
+                    process_progress.update()
+                result_queue.put((attach_id, None, _MISSING, None, None, None))
+                continue
+            if filepath is not None and journal is not None and journal.is_processed(job, filepath, skip_below):
+                process_log(f"[SKIPPED] {filename} was already answered.")
+                if process_progress is not None:
+                    process_progress.update()
+                result_queue.put((attach_id, filepath, _ANSWERED, None, None, None))
+                continue
+            note, score = prefilter.check(filepath) if filepath is not None and prefilter is not None else (None, None)
+            if note is not None:
+                if process_progress is not None:
+                    process_progress.update()
+                result_queue.put((attach_id, filepath, note, None, None, score))
+                continue
+            if filepath is None:
+                answer, error = None, f"Download failed for {filename}."
+            else:
+                process_log(f"Processing image: {filename}...")
+                start = time.monotonic()
+                answer, error, duplicate_of = solve_image(filepath, prompt, api_key, cache, index, answers, preprocessor,
+                                                            engine)
+                latency = None if duplicate_of else time.monotonic() - start
+                if duplicate_of and not error:
+                    process_log(f"  -> Duplicate of {duplicate_of}, reused its answer.")
+            if error or not duplicate_of:
+                process_log(f"  -> ERROR: {error}" if error else "  -> Success.")
+            if process_progress is not None:
+                process_progress.update(error=bool(error))
+            result_queue.put((attach_id, filepath, answer, error, latency, None))
+
+    def process():
+        try:
+            process_queue()
+        except Exception as e:
+            # Cancelling makes the downloaders give up on the full queue instead of waiting for this thread.
+            failures.append(e)
+            process_log(f"ERROR: Processing stopped: {e}")
+            cancel_event.set()
+
+    processors = [threading.Thread(target=process, daemon=True) for _ in range(process_workers)]
+    for thread in processors:
+        thread.start()
+
+    executor = ThreadPoolExecutor(max_workers=download_workers)
+    futures = [executor.submit(fetch, start_id + i) for i in range(total_files)]
+
+    def close_stages():
+        wait(futures)
+        for _ in processors:
+            _put(image_queue, _DONE, cancel_event)
+        for thread in processors:
+            thread.join()
+        result_queue.put(_DONE)
+
+    threading.Thread(target=close_stages, daemon=True).start()
+
+    # Results arrive out of order; hold them back until every lower ID has been written.
+    processed, errors = 0, 0
+    pending = {}
+    next_id = start_id
+    try:
+        with open(output_txt_path, "a", encoding="utf-8") as output_file:
+            def write(attach_id, filepath, answer, error, latency, skip_score):
+                nonlocal processed, errors
+                skipped = skip_score is not None
+                if answer is _ANSWERED or answer is _MISSING:
+                    return
+                write_result(output_file, attachment_filename(base_name, attach_id), answer, error)
+                output_file.flush()
+                processed += 1
+                errors += 1 if error else 0
+                if store is not None and filepath is not None:
+                    if skipped:
+                        # The skip note is stored like the text output shows it, but not indexed as questions.
+                        store.add(filepath, answer, skipped=True)
+                    else:
+                        store.add(filepath, answer, error, latency)
+                if journal is not None and filepath is not None:
+                    if skipped:
+                        journal.mark_processed(job, filepath, 'skipped', skip_score, prefilter.min_score)
+                    else:
+                        journal.mark_processed(job, filepath, 'error' if error else 'done')
+
+            while True:
+                item = result_queue.get()
+                if item is _DONE:
+                    break
+                pending[item[0]] = item
+                while next_id in pending:
+                    write(*pending.pop(next_id))
+                    next_id += 1
+            # After a cancel there can be gaps; keep whatever finished, still in order.
+            for attach_id in sorted(pending):
+                write(*pending[attach_id])
+    except BaseException:
+        cancel_event.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        session.close()
+        if index is not None:
+            index.save()
+    if failures:
+        raise failures[0]
+    return processed, errors
+
+# --- SCRIPT EXECUTION ---
+if __name__ == "__main__":
+    import core
+    from processor import load_or_request_api_key
+
+    print("--- Download and Solve ---")
+    api_key = load_or_request_api_key()
+    if not api_key:
+        print("Error: No API key was provided.")
+        exit()
+
+    start_url = input("\nEnter the URL of the FIRST image in the sequence: ")
+    try:
+        total_files_str = input("Enter the TOTAL number of images to download (leave empty to find it automatically): ")
+        total_files = int(total_files_str) if total_files_str.strip() else None
+    except ValueError:
+        print("Error: Please enter a valid number.")
+        exit()
+
+    print("\nEnter your authentication cookies (input will be visible):")
+    xf_user_value = input("Paste your xf_user cookie value: ")
+    xf_session_value = input("Paste your xf_session cookie value: ")
+
+    base_name, start_id = parse_url_pattern(start_url)
+    if base_name is None:
+        print("\nError: Could not parse the URL.")
+        print("Please ensure the URL has a pattern like '.../some-filename.123456/'")
+        exit()
+
+    cookies = {'xf_user': xf_user_value, 'xf_session': xf_session_value}
+    if total_files is None:
+        total_files = core.discover(base_name, start_id, cookies)
+        if total_files is None:
+            exit()
+    cancel_event = threading.Event()
+    workspace = core.Workspace()
+    try:
+        core.run(workspace, base_name, start_id, total_files, cookies, api_key, cancel_event=cancel_event)
+    except KeyboardInterrupt:
+        cancel_event.set()
+        print("\nCancelled. Run again to resume where this run stopped.")
+        exit()
+    finally:
+        workspace.close()
+    core.report_metrics()
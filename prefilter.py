@@ -0,0 +1,229 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import METRICS
+from pack import image_source
+
+# --- CONFIGURATION ---
+# Pages scoring below the minimum are skipped (or answered last). The filter is off by default:
+# a short question on a large page can score as low as a logo (~0.15-0.2), so only
+# BLANK_PAGE_SCORE is safe without checking a sample of the skipped pages first.
+DEFAULT_MIN_SCORE = 0.0
+BLANK_PAGE_SCORE = 0.05
+ANALYSIS_SIDE = 1000          # images are scored on a grayscale copy at most this large
+BACKGROUND_TOLERANCE = 24     # grey levels a pixel may differ from the page background and still be background
+INK_CONTRAST = 60             # grey levels a pixel must differ from the background to count as ink
+EDGE_STEP = 40                # neighbouring pixels this far apart form an edge
+MIN_PAPER = 0.4               # below this background share the image looks like a photo, not a page
+TEXTURE_EDGES = 0.2           # above this edge density the image is texture or noise rather than text
+# A text-like mark is a connected ink component about the size of a character or word.
+MARK_HEIGHT = (0.003, 0.05)   # as a share of the image height
+MARK_MAX_WIDTH = 0.3          # as a share of the image width
+# Feature values at which a page counts as fully text-like, and how much each one weighs.
+TEXT_MARKS_TARGET = 60
+EDGE_TARGET = 0.04
+CONTRAST_TARGET = 40.0
+WEIGHTS = {'text_marks': 0.6, 'edges': 0.25, 'contrast': 0.15}
+INLINE_BATCH = 4              # batches this small are scored in the calling thread, without the process pool
+SCORE_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0)
+
+def _label_runs(ink):
+    """
+    Connected components (8-connectivity) of a boolean image, computed on horizontal runs.
+    Returns the bounding boxes as four arrays: top, bottom, left, right (inclusive).
+    """
+    import numpy as np
+    height, width = ink.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = ink
+    changes = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(changes == 1)
+    _, ends = np.nonzero(changes == -1)         # exclusive; same row-major order as the starts
+    count = len(rows)
+    if count == 0:
+        return (np.zeros(0, dtype=int),) * 4
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_bounds = np.searchsorted(rows, np.arange(height + 1))
+    for row in range(1, height):
+        previous = range(row_bounds[row - 1], row_bounds[row])
+        if not previous:
+            continue
+        j = previous.start
+        for i in range(row_bounds[row], row_bounds[row + 1]):
+            # Skip runs of the row above that end before this one starts (diagonal contact counts).
+            while j < previous.stop and ends[j] < starts[i]:
+                j += 1
+            k = j
+            while k < previous.stop and starts[k] <= ends[i]:
+                root_i, root_k = find(i), find(k)
+                if root_i != root_k:
+                    parent[root_k] = root_i
+                k += 1
+    roots = np.array([find(i) for i in range(count)])
+    labels, roots = np.unique(roots, return_inverse=True)
+    top = np.full(len(labels), height)
+    bottom = np.zeros(len(labels), dtype=int)
+    left = np.full(len(labels), width)
+    right = np.zeros(len(labels), dtype=int)
+    np.minimum.at(top, roots, rows)
+    np.maximum.at(bottom, roots, rows)
+    np.minimum.at(left, roots, starts)
+    np.maximum.at(right, roots, ends - 1)
+    return top, bottom, left, right
+
+def image_features(image_path, side=ANALYSIS_SIDE):
+    """
+    Cheap statistics of an image: share of background pixels, pixel standard deviation,
+    edge density and the number of text-like connected ink components.
+    Runs in a worker process, so it takes and returns plain values.
+    """
+    import numpy as np
+    from PIL import Image
+    with Image.open(image_source(image_path)) as img:
+        img.draft('L', (side, side))
+        gray = img.convert('L')
+    scale = side / max(gray.size)
+    if scale < 1:
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    height, width = pixels.shape
+    background_level = int(np.median(pixels))
+    distance = np.abs(pixels - background_level)
+    edges = (np.abs(np.diff(pixels, axis=1))[:-1, :] > EDGE_STEP) | (np.abs(np.diff(pixels, axis=0))[:, :-1] > EDGE_STEP)
+    top, bottom, left, right = _label_runs(distance > INK_CONTRAST)
+    mark_heights = bottom - top + 1
+    mark_widths = right - left + 1
+    marks = ((mark_heights >= max(2, MARK_HEIGHT[0] * height)) & (mark_heights <= MARK_HEIGHT[1] * height)
+             & (mark_widths <= MARK_MAX_WIDTH * width))
+    return {'background': float((distance <= BACKGROUND_TOLERANCE).mean()), 'contrast': float(pixels.std()),
+            'edges': float(edges.mean()) if edges.size else 0.0, 'text_marks': int(marks.sum())}
+
+def question_score(features):
+    """Scores features from 0 (blank, logo, photo) to 1 (a page full of text)."""
+    parts = {'text_marks': features['text_marks'] / TEXT_MARKS_TARGET, 'edges': features['edges'] / EDGE_TARGET,
+             'contrast': features['contrast'] / CONTRAST_TARGET}
+    score = sum(weight * min(1.0, parts[name]) for name, weight in WEIGHTS.items())
+    if features['background'] < MIN_PAPER:
+        score *= features['background'] / MIN_PAPER
+    if features['edges'] > TEXTURE_EDGES:
+        score *= (TEXTURE_EDGES / features['edges']) ** 2
+    return score
+
+def score_image(image_path):
+    """Returns (score, features) for one image, or (None, error text) when it cannot be read."""
+    try:
+        features = image_features(image_path)
+    except Exception as e:
+        return None, str(e)
+    return question_score(features), features
+
+class Prefilter:
+    """
+    Scores images locally before they are sent to Gemini and holds back the ones that
+    do not look like question pages (blank scans, covers, logos, photos). Below
+    `min_score` an image is skipped with a note that records its score, or with
+    `defer` it is only moved to the end of the run. Unreadable images are never held back.
+    Larger batches are scored on a process pool that is started once and kept until `close`.
+    """
+
+    def __init__(self, min_score=DEFAULT_MIN_SCORE, defer=False, max_workers=None, log=None):
+        self.min_score = min_score
+        self.defer = defer
+        self.max_workers = max_workers
+        self.log = log
+        self.scored = 0
+        self.skipped = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def enabled(self):
+        return self.min_score > 0
+
+    @property
+    def skip_below(self):
+        """The score under which this run skips pages; 0 when it answers every page."""
+        return self.min_score if self.enabled and not self.defer else 0.0
+
+    def _book(self, image_path, score, features):
+        """Counts one score; returns the skip note when the image is held back."""
+        if score is None:
+            return None
+        METRICS.observe('prefilter_score', score, buckets=SCORE_BUCKETS)
+        with self._lock:
+            self.scored += 1
+            if score >= self.min_score:
+                return None
+            if self.defer:
+                self.deferred += 1
+            else:
+                self.skipped += 1
+        METRICS.count('prefilter_deferred' if self.defer else 'prefilter_skipped')
+        note = (f"Skipped: no question text detected (score {score:.2f} < {self.min_score:.2f}; "
+                f"{features['text_marks']} text-like marks, {100 * features['edges']:.1f}% edges, "
+                f"{100 * features['background']:.0f}% background).")
+        if self.log:
+            action = "answering it last" if self.defer else "skipped"
+            self.log(f"  -> {os.path.basename(image_path)} scored {score:.2f}; {action}.")
+        return note
+
+    def check(self, image_path):
+        """
+        Scores one image in this thread. Returns (note, score): the skip note, or None when it
+        should be answered, and its score.
+        """
+        if not self.enabled:
+            return None, None
+        with METRICS.span('prefilter'):
+            score, features = score_image(image_path)
+        note = self._book(image_path, score, features)
+        return None if self.defer else note, score
+
+    def split(self, image_paths):
+        """
+        Scores a list of images, on the process pool unless there are at most INLINE_BATCH of them.
+        Returns (to_answer, skipped): the images to send, with deferred ones moved to the end, and
+        [(image_path, note, score)] for the skipped ones.
+        """
+        if not self.enabled or not image_paths:
+            return list(image_paths), []
+        with METRICS.span('prefilter'):
+            if len(image_paths) <= INLINE_BATCH:
+                scores = [score_image(image_path) for image_path in image_paths]
+            else:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                scores = list(self._pool.map(score_image, image_paths, chunksize=8))
+        to_answer, deferred, skipped = [], [], []
+        for image_path, (score, features) in zip(image_paths, scores):
+            note = self._book(image_path, score, features)
+            if note is None:
+                to_answer.append(image_path)
+            elif self.defer:
+                deferred.append(image_path)
+            else:
+                skipped.append((image_path, note, score))
+        return to_answer + deferred, skipped
+
+    def summary(self):
+        if not self.enabled:
+            return "Question prefilter: off."
+        if self.defer:
+            return (f"Question prefilter: {self.deferred} of {self.scored} images scored below "
+                    f"{self.min_score:.2f} and were answered last.")
+        return (f"Question prefilter: {self.skipped} of {self.scored} images scored below {self.min_score:.2f} "
+                f"and were skipped; {self.skipped} API calls avoided.")
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
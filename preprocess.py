@@ -0,0 +1,135 @@
+import io
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import METRICS
+from pack import image_source
+
+# --- CONFIGURATION ---
+# Each profile is a set of preprocessing options; 'off' sends the original file. It is the default:
+# a lossy re-encode can blur small print, so shrinking has to be asked for.
+PROFILES = {
+    'off': None,
+    'balanced': {'max_side': 1600, 'grayscale': False, 'crop_borders': True, 'quality': 85},
+    'compact': {'max_side': 1024, 'grayscale': True, 'crop_borders': True, 'quality': 70},
+}
+DEFAULT_PROFILE = 'off'
+MIN_SAVING = 0.25         # an image that was neither cropped nor resized is only re-encoded to save this share
+BORDER_TOLERANCE = 12     # how far a pixel may differ from the border colour and still count as border
+TILE_SIZE = 768           # Gemini bills large images per 768x768 tile
+TOKENS_PER_TILE = 258
+SMALL_IMAGE_SIDE = 384    # images within 384x384 cost a single tile
+
+def estimate_image_tokens(width, height):
+    """
+    Approximates the Gemini image-token cost of a width x height image from the tile rules.
+    Only the preprocessed image is ever sent, so savings based on this stay an estimate.
+    """
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TOKENS_PER_TILE
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE) * TOKENS_PER_TILE
+
+def crop_uniform_borders(img):
+    """Crops borders that have the same colour as the top-left pixel."""
+    from PIL import Image, ImageChops
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background).convert('L').point(lambda v: 255 if v > BORDER_TOLERANCE else 0)
+    bbox = diff.getbbox()
+    return img.crop(bbox) if bbox else img
+
+def preprocess_image(image_path, options):
+    """
+    Applies one profile's options to an image.
+    Runs in a worker process, so it only takes and returns plain picklable values:
+    (data, mime_type, original_size, new_size).
+    """
+    from PIL import Image
+    with Image.open(image_source(image_path)) as img:
+        original_size = img.size
+        img = img.convert('L' if options['grayscale'] else 'RGB')
+    if options['crop_borders']:
+        img = crop_uniform_borders(img)
+    max_side = options['max_side']
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format='WEBP', quality=options['quality'], method=4)
+    return buffer.getvalue(), 'image/webp', original_size, img.size
+
+class Preprocessor:
+    """
+    Runs a preprocessing profile on a process pool so the CPU work overlaps with network I/O,
+    and keeps per-image and total bytes saved, the prompt tokens actually billed for the
+    shrunk images (from usage_metadata) and the estimated image tokens saved.
+    """
+
+    def __init__(self, profile=DEFAULT_PROFILE, max_workers=None, log=None):
+        self.profile = profile
+        self.options = PROFILES[profile]
+        self.log = log
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.tokens_saved = 0       # estimated with estimate_image_tokens, never measured
+        self.prompt_tokens = 0      # billed, from usage_metadata
+        self.images = 0
+        self._lock = threading.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=max_workers) if self.options else None
+
+    def run(self, image_path, image_bytes):
+        """
+        Returns (data, mime_type, report) for one image. The original bytes are kept (data is
+        None) when the profile is off, when the result is not smaller, and when the image was
+        neither cropped nor resized and the re-encode saves less than MIN_SAVING of its bytes.
+        """
+        if self._pool is None:
+            return None, None, None
+        with METRICS.span('preprocess', profile=self.profile):
+            data, mime_type, original_size, new_size = self._pool.submit(
+                preprocess_image, image_path, self.options).result()
+        if len(data) >= len(image_bytes):
+            return None, None, None
+        if new_size == original_size and len(data) > (1 - MIN_SAVING) * len(image_bytes):
+            METRICS.count('preprocess_kept_original')
+            return None, None, None
+        report = {'filename': os.path.basename(image_path), 'bytes_before': len(image_bytes),
+                  'bytes_after': len(data), 'original_size': original_size, 'new_size': new_size}
+        return data, mime_type, report
+
+    def record(self, report, response):
+        """Books a report once the response (and its usage_metadata) is known."""
+        if report is None:
+            return
+        estimated_before = estimate_image_tokens(*report['original_size'])
+        estimated_after = estimate_image_tokens(*report['new_size'])
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        # The original is never sent, so what it would have cost can only be estimated.
+        tokens_saved = estimated_before - estimated_after
+        with self._lock:
+            self.images += 1
+            self.bytes_before += report['bytes_before']
+            self.bytes_after += report['bytes_after']
+            self.tokens_saved += tokens_saved
+            self.prompt_tokens += prompt_tokens
+        if self.log:
+            before, after = report['bytes_before'], report['bytes_after']
+            message = (f"  -> Preprocessed {report['filename']}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB "
+                       f"(-{100.0 * (before - after) / before:.0f}%)")
+            if prompt_tokens:
+                message += f", {prompt_tokens} prompt tokens billed"
+            message += f", an estimated {tokens_saved} image tokens saved"
+            self.log(message)
+
+    def summary(self):
+        if self._pool is None:
+            return "Preprocessing: off."
+        saved = self.bytes_before - self.bytes_after
+        billed = f" {self.prompt_tokens} prompt tokens billed for them;" if self.prompt_tokens else ""
+        return (f"Preprocessing ({self.profile}): {self.images} images shrunk, {saved / 1024 / 1024:.1f} MB saved;"
+                f"{billed} an estimated {self.tokens_saved} image tokens saved (from tile sizes, not measured).")
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
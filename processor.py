@@ -0,0 +1,221 @@
+import os
+import getpass
+import threading
+from concurrent.futures import Future
+# Pillow and the Gemini SDK are imported where they are first needed: the SDK alone takes
+# seconds to import, and the GUI and the downloader must not pay for it at startup.
+from cache import cache_key
+from metrics import METRICS, TOKEN_BUCKETS
+from pack import is_pack, open_pack, read_bytes, image_source
+
+# --- CONFIGURATION ---
+CONFIG_FILE = "config.txt"
+MODEL_NAME = 'gemini-2.5-flash'
+PROMPT = "Read the attached image. Extract every question you can find and provide a correct, concise answer for each one."
+VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+OUTPUT_TXT_PATH = "all_questions_and_answers.txt"
+# Formats Gemini accepts as raw bytes; anything else goes through PIL.
+MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
+
+_client = {'api_key': None, 'model': None}
+_client_lock = threading.Lock()
+_answers_lock = threading.Lock()
+
+def load_or_request_api_key():
+    """
+    Loads the API key from the config file, or prompts the user if it doesn't exist.
+    """
+    # Check if the config file exists and has content
+    if os.path.exists(CONFIG_FILE) and os.path.getsize(CONFIG_FILE) > 0:
+        print("API key found in config.txt. Using existing key.")
+        with open(CONFIG_FILE, "r") as f:
+            return f.read().strip()
+    else:
+        # Prompt the user for the key if the file doesn't exist
+        print("API key not found. Please enter it now.")
+        api_key = getpass.getpass("Enter your Google Gemini API Key: ")
+
+        # Save the key to the file for future use
+        try:
+            with open(CONFIG_FILE, "w") as f:
+                f.write(api_key)
+            print(f"API key saved to {CONFIG_FILE} for future use.")
+            return api_key
+        except Exception as e:
+            print(f"Warning: Could not save API key to file. You may be prompted again next time. Error: {e}")
+            return api_key
+
+def list_images(image_dir):
+    """Returns the sorted image filenames of a directory, or of a pack file (see pack.py)."""
+    names = open_pack(image_dir).names() if is_pack(image_dir) else sorted(os.listdir(image_dir))
+    return [f for f in names if f.lower().endswith(VALID_EXTENSIONS)]
+
+def load_pil_image(image_path):
+    """Decodes an image fully and closes the file handle right away."""
+    from PIL import Image
+    with Image.open(image_source(image_path)) as img:
+        img.load()
+        return img.copy()
+
+def image_part(image_path, image_bytes, mime_type=None):
+    """
+    Builds the request part for an image: the original bytes with their MIME type, so the
+    SDK uploads the file as-is instead of decoding and re-encoding it. Returns None for
+    formats that have to go through PIL.
+    """
+    mime_type = mime_type or MIME_TYPES.get(os.path.splitext(image_path)[1].lower())
+    if mime_type is None:
+        return None
+    return {'mime_type': mime_type, 'data': image_bytes}
+
+def generate_from_image(model, prompt, image_path, image_bytes, mime_type=None):
+    """Calls the model with the raw-bytes fast path, falling back to a PIL image if rejected."""
+    from google.api_core import exceptions as api_exceptions
+    part = image_part(image_path, image_bytes, mime_type)
+    if part is not None:
+        try:
+            with METRICS.span('gemini_request', path='raw'):
+                response = model.generate_content([prompt, part])
+            record_usage(response)
+            return response
+        except api_exceptions.InvalidArgument:
+            METRICS.count('gemini_raw_rejected')
+    with METRICS.span('image_decode'):
+        image = load_pil_image(image_path)
+    with METRICS.span('gemini_request', path='pil'):
+        response = model.generate_content([prompt, image])
+    record_usage(response)
+    return response
+
+def record_usage(response, images=1):
+    """Books the token counts from a response's usage_metadata."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    for field, name in (('prompt_token_count', 'prompt'), ('candidates_token_count', 'output'),
+                        ('total_token_count', 'total')):
+        value = getattr(usage, field, 0) or 0
+        METRICS.count('gemini_tokens', value, kind=name)
+        METRICS.observe('gemini_tokens_per_image', value / images, buckets=TOKEN_BUCKETS, kind=name)
+
+def prepare_image(image_path, prompt, cache=None, preprocessor=None):
+    """
+    Reads one image and looks it up in the cache. Returns (key, cached_answer, data, mime_type, report):
+    on a hit only the first two are set, otherwise `data` holds the bytes to upload (preprocessed
+    when a Preprocessor shrank them) and `report` is the preprocessing report to record.
+    """
+    image_bytes = read_bytes(image_path)
+    key = None
+    if cache is not None:
+        variant = preprocessor.profile if preprocessor is not None and preprocessor.options else ""
+        key = cache_key(image_bytes, prompt, MODEL_NAME, variant)
+        cached = cache.get(key)
+        if cached is not None:
+            return key, cached, None, None, None
+    data, mime_type, report = None, None, None
+    if preprocessor is not None:
+        data, mime_type, report = preprocessor.run(image_path, image_bytes)
+    return key, None, data or image_bytes, mime_type, report
+
+def get_model(api_key=None):
+    """
+    Returns the shared GenerativeModel. The client is configured only when the API key
+    changes, so a run builds one model object instead of one per image.
+    """
+    with _client_lock:
+        if _client['model'] is None or (api_key and api_key != _client['api_key']):
+            import google.generativeai as genai
+            if api_key:
+                genai.configure(api_key=api_key)
+            _client['api_key'] = api_key or _client['api_key']
+            _client['model'] = genai.GenerativeModel(MODEL_NAME)
+        return _client['model']
+
+def set_model(model):
+    """
+    Installs a ready model object (anything with a Gemini-style `generate_content`) as the
+    shared model, e.g. the offline fake used by the benchmarks. Calls to `get_model`
+    without an API key keep returning it.
+    """
+    with _client_lock:
+        _client['api_key'] = None
+        _client['model'] = model
+
+def answer_image(image_path, prompt, api_key=None, cache=None, preprocessor=None):
+    """
+    Sends a single image and a text prompt to the Gemini model and returns the answer text.
+    With an AnswerCache, identical image bytes + prompt + model are answered from the cache
+    instead. A Preprocessor shrinks the image first; its profile is part of the cache key.
+    API errors are raised so callers can tell rate limits from other failures.
+    """
+    key, cached, data, mime_type, report = prepare_image(image_path, prompt, cache, preprocessor)
+    if cached is not None:
+        METRICS.count('gemini_cache_hits')
+        return cached
+    response = generate_from_image(get_model(api_key), prompt, image_path, data, mime_type)
+    if preprocessor is not None:
+        preprocessor.record(report, response)
+    if cache is not None:
+        cache.put(key, response.text)
+    return response.text
+
+def get_answer_from_image_with_gemini(image_path, prompt, api_key=None, cache=None, preprocessor=None):
+    """Like `answer_image`, but returns (answer, error) instead of raising."""
+    try:
+        return answer_image(image_path, prompt, api_key, cache, preprocessor), None
+    except Exception as e:
+        METRICS.count('gemini_errors', cause=type(e).__name__)
+        return None, error_message(image_path, e)
+
+def error_message(image_path, error):
+    return f"An error occurred while processing {os.path.basename(image_path)}: {error}"
+
+def resolve_target(image_path, index=None):
+    """Returns (target, duplicate_of): the image to actually answer and, if it differs, its filename."""
+    if index is None:
+        return image_path, None
+    target = index.representative(image_path)
+    if target != os.path.abspath(image_path):
+        return target, os.path.basename(target)
+    return target, None
+
+def solve_image(image_path, prompt, api_key=None, cache=None, index=None, answers=None, preprocessor=None,
+                engine=None):
+    """
+    Answers one image. With a PerceptualIndex, near-duplicates are answered through their
+    cluster representative, and `answers` (shared for the run) keeps each cluster to one call:
+    when several workers reach a cluster at once, the first one asks and the others wait for it.
+    A ParallelProcessor `engine` sends the request under its adaptive limit with throttle retries.
+    Returns (answer, error, duplicate_of) where duplicate_of is the representative's filename.
+    """
+    target, duplicate_of = resolve_target(image_path, index)
+
+    def ask():
+        if engine is not None:
+            return engine.answer(target)[:2]
+        return get_answer_from_image_with_gemini(target, prompt, api_key, cache, preprocessor)
+
+    if answers is None:
+        return (*ask(), duplicate_of)
+    with _answers_lock:
+        pending = answers.get(target)
+        owner = pending is None
+        if owner:
+            pending = answers[target] = Future()
+    if owner:
+        try:
+            pending.set_result(ask())
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+    answer, error = pending.result()
+    return answer, error, duplicate_of
+
+def write_result(output_file, filename, answer, error):
+    """Appends one image's answer (or error) to the text output."""
+    output_file.write(f"--- Question Source: {filename} ---\n")
+    if error:
+        output_file.write(f"An error occurred: {error}\n")
+    else:
+        output_file.write(answer.strip() + "\n")
+    output_file.write("\n" + "="*80 + "\n\n")
@@ -0,0 +1,75 @@
+import collections
+import threading
+import time
+
+# --- CONFIGURATION ---
+RATE_WINDOW = 10.0     # seconds of history behind the items/s and MB/s figures
+
+class ProgressTracker:
+    """
+    Thread-safe progress counters for one run: items done, errors and bytes, plus
+    items/s and MB/s over a sliding window and the ETA they imply. Workers call
+    `update`; a UI polls `snapshot` or `format` at its own pace.
+    """
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self.start(0)
+
+    def start(self, total):
+        with self._lock:
+            self.total = total
+            self.done = 0
+            self.errors = 0
+            self.bytes = 0
+            self.started = time.monotonic()
+            self._events = collections.deque()
+            self._window_items = 0
+            self._window_bytes = 0
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+
+    def update(self, items=1, nbytes=0, error=False):
+        now = time.monotonic()
+        with self._lock:
+            self.done += items
+            self.bytes += nbytes
+            self.errors += 1 if error else 0
+            self._events.append((now, items, nbytes))
+            self._window_items += items
+            self._window_bytes += nbytes
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._events and now - self._events[0][0] > self.window:
+            _, items, nbytes = self._events.popleft()
+            self._window_items -= items
+            self._window_bytes -= nbytes
+
+    def snapshot(self):
+        """Returns a dict with done, total, errors, items_per_sec, mb_per_sec and eta (seconds or None)."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            span = min(self.window, max(now - self.started, 1e-6))
+            items, nbytes = self._window_items, self._window_bytes
+            done, total, errors = self.done, self.total, self.errors
+        items_per_sec = items / span
+        remaining = max(0, total - done)
+        eta = remaining / items_per_sec if items_per_sec > 0 else None
+        return {'done': done, 'total': total, 'errors': errors, 'items_per_sec': items_per_sec,
+                'mb_per_sec': nbytes / span / 1024 / 1024, 'eta': eta}
+
+    def format(self):
+        """One-line status such as '120/500 | 4.2 items/s | 1.3 MB/s | ETA 1m30s | 2 errors'."""
+        stats = self.snapshot()
+        if stats['eta'] is None:
+            eta = "--"
+        else:
+            minutes, seconds = divmod(int(stats['eta']), 60)
+            eta = f"{minutes}m{seconds:02d}s"
+        return (f"{stats['done']}/{stats['total']} | {stats['items_per_sec']:.1f} items/s | "
+                f"{stats['mb_per_sec']:.2f} MB/s | ETA {eta} | {stats['errors']} errors")
@@ -0,0 +1,182 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from processor import MODEL_NAME, OUTPUT_TXT_PATH, write_result
+
+# --- CONFIGURATION ---
+RESULTS_FILE = "results.sqlite3"
+SEARCH_LIMIT = 50
+
+# A new question starts at lines like "Question 3", "**Câu 3:**", "Q3." or "3)".
+QUESTION_START = re.compile(r"^[\s>*#_-]*(?:(?:question|câu|q)\s*\d+|\d+\s*[.)])", re.IGNORECASE | re.MULTILINE)
+ANSWER_MARKER = re.compile(r"[*_]*(?:correct answer|answer|đáp án|trả lời)[*_]*\s*[:：][*_]*", re.IGNORECASE)
+ATTACHMENT_ID = re.compile(r"\.(\d+)\.[^.]+$")
+
+def split_questions(text):
+    """
+    Splits one model response into [(question, answer)] pairs. A response without
+    recognisable question headings is kept as a single pair.
+    """
+    if not text or not text.strip():
+        return []
+    starts = [match.start() for match in QUESTION_START.finditer(text)]
+    if not starts:
+        blocks = [text]
+    else:
+        # Anything before the first heading is a preamble ("Here are the answers:") and is dropped.
+        blocks = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    pairs = []
+    for block in blocks:
+        match = ANSWER_MARKER.search(block)
+        if match:
+            pairs.append((block[:match.start()].strip(), block[match.end():].strip()))
+        else:
+            pairs.append((block.strip(), ""))
+    return [pair for pair in pairs if pair[0] or pair[1]]
+
+def attachment_id(filename):
+    """Extracts the attachment ID from a downloaded filename like 'name-webp.199272.webp'."""
+    match = ATTACHMENT_ID.search(filename)
+    return int(match.group(1)) if match else None
+
+def fts_query(text):
+    """Turns free text into an FTS5 query that matches documents containing every word."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"' for word in words)
+
+class ResultStore:
+    """
+    SQLite store of processor results: one row per source image (file, attachment ID,
+    model, timestamp, latency, full answer or error) and one row per extracted
+    question/answer pair, indexed with FTS5 for fast search. A page the prefilter skipped
+    keeps its note as the answer, flagged `skipped`, without questions. Re-processing an
+    image replaces its earlier record instead of adding a duplicate.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY, source TEXT NOT NULL UNIQUE, filename TEXT NOT NULL,"
+            " attachment_id INTEGER, model TEXT NOT NULL, created REAL NOT NULL,"
+            " latency REAL, answer TEXT, error TEXT, skipped INTEGER NOT NULL DEFAULT 0)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if 'skipped' not in columns:
+            # Older stores kept the prefilter's note in the error column.
+            self._conn.execute("ALTER TABLE results ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE results SET answer = error, error = NULL, skipped = 1"
+                               " WHERE answer IS NULL AND error LIKE 'Skipped: %'")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            " id INTEGER PRIMARY KEY, result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,"
+            " number INTEGER NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS questions_result ON questions(result_id)")
+        self.fts = True
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5("
+                " question, answer, content='questions', content_rowid='id')")
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS questions_ai AFTER INSERT ON questions BEGIN"
+                " INSERT INTO questions_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer); END")
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS questions_ad AFTER DELETE ON questions BEGIN"
+                " INSERT INTO questions_fts(questions_fts, rowid, question, answer)"
+                " VALUES ('delete', old.id, old.question, old.answer); END")
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE, which is slower but works.
+            self.fts = False
+        self._conn.commit()
+
+    def add(self, image_path, answer, error=None, latency=None, model=MODEL_NAME, skipped=False):
+        """
+        Stores (or replaces) the result for one image and its extracted questions. With
+        `skipped`, `answer` is the prefilter's note and no questions are extracted from it.
+        """
+        source = os.path.abspath(image_path)
+        filename = os.path.basename(image_path)
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE source = ?", (source,))
+            cursor = self._conn.execute(
+                "INSERT INTO results (source, filename, attachment_id, model, created, latency, answer, error, skipped)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, filename, attachment_id(filename), model, time.time(), latency, answer, error, int(skipped)))
+            if not error and not skipped:
+                self._conn.executemany(
+                    "INSERT INTO questions (result_id, number, question, answer) VALUES (?, ?, ?, ?)",
+                    [(cursor.lastrowid, number, question, text)
+                     for number, (question, text) in enumerate(split_questions(answer), 1)])
+            self._conn.commit()
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """Returns up to `limit` matches as (filename, number, question, answer), best first."""
+        with self._lock:
+            if self.fts:
+                query = fts_query(text)
+                if not query:
+                    return []
+                return self._conn.execute(
+                    "SELECT r.filename, q.number, q.question, q.answer FROM questions_fts"
+                    " JOIN questions q ON q.id = questions_fts.rowid JOIN results r ON r.id = q.result_id"
+                    " WHERE questions_fts MATCH ? ORDER BY bm25(questions_fts) LIMIT ?",
+                    (query, limit)).fetchall()
+            pattern = f"%{text}%"
+            return self._conn.execute(
+                "SELECT r.filename, q.number, q.question, q.answer FROM questions q"
+                " JOIN results r ON r.id = q.result_id WHERE q.question LIKE ? OR q.answer LIKE ? LIMIT ?",
+                (pattern, pattern, limit)).fetchall()
+
+    def export_text(self, output_txt_path):
+        """Writes every stored result in the legacy text format, ordered by attachment ID."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, answer, error FROM results ORDER BY attachment_id, filename").fetchall()
+        with open(output_txt_path, "w", encoding="utf-8") as output_file:
+            for filename, answer, error in rows:
+                write_result(output_file, filename, answer, error)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            results = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            questions = self._conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+        return {'results': results, 'questions': questions}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def format_match(filename, number, question, answer):
+    """Formats one search hit for the console or the GUI."""
+    return f"[{filename} #{number}]\n{question}\n-> {answer or '(no separate answer found)'}\n"
+
+# --- SCRIPT EXECUTION ---
+USAGE = """Usage:
+  python results.py search <words...>   Search the stored questions and answers
+  python results.py export [file]       Write all results in the legacy text format (default: all_questions_and_answers.txt)"""
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('search', 'export'):
+        print(USAGE)
+        sys.exit(1)
+    store = ResultStore()
+    if sys.argv[1] == 'search':
+        start = time.perf_counter()
+        matches = store.search(" ".join(sys.argv[2:]))
+        elapsed = (time.perf_counter() - start) * 1000
+        for match in matches:
+            print(format_match(*match))
+        print(f"{len(matches)} matches in {elapsed:.1f} ms.")
+    else:
+        path = sys.argv[2] if len(sys.argv) > 2 else OUTPUT_TXT_PATH
+        print(f"Exported {store.export_text(path)} results to '{path}'.")
+    store.close()
@@ -0,0 +1,199 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from processor import VALID_EXTENSIONS
+
+# --- CONFIGURATION ---
+DEBOUNCE = 2.0            # seconds a file must keep the same size and mtime before it is handed out
+POLL_INTERVAL = 2.0       # seconds between directory scans when inotify is not available
+RESCAN_INTERVAL = 300.0   # full scan even with inotify, in case events were dropped
+MAX_BATCH = 32            # ready images handed out per batch
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")   # wd, mask, cookie, name length
+
+class Inotify:
+    """
+    Minimal inotify binding through ctypes for one directory (Linux only).
+    Raises OSError when the platform does not provide it.
+    """
+
+    def __init__(self, directory):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify is not available: {e}")
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read(self, timeout):
+        """
+        Waits up to `timeout` seconds for events. Returns (names, overflow): the file names
+        that changed, and True when the kernel dropped events and a full scan is needed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not ready:
+            return set(), False
+        data = os.read(self.fd, 64 * 1024)
+        names, overflow, offset = set(), False, 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name:
+                names.add(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+class FolderWatcher:
+    """
+    Watches one folder for new or changed images. Changes arrive through inotify where the
+    platform has it, and through periodic scans otherwise. An index of the size and mtime each
+    image had when it was handed out separates new and modified files from ones already seen.
+    An image is only handed out once its size and mtime have stayed the same for `debounce`
+    seconds, so files that are still being written are not read half-finished.
+    Memory stays proportional to the number of files in the folder.
+    """
+
+    def __init__(self, directory, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, use_inotify=True, log=None):
+        self.directory = directory
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.log = log
+        self._index = {}      # name -> (size, mtime_ns) when handed out
+        self._pending = {}    # name -> ((size, mtime_ns), stable since), still settling
+        self._ready = {}      # name -> (size, mtime_ns), settled and waiting to be handed out
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = Inotify(directory)
+            except OSError as e:
+                if log:
+                    log(f"Watching '{directory}' by polling every {poll_interval:g} s ({e}).")
+        if self._inotify is not None and log:
+            log(f"Watching '{directory}' through inotify.")
+        self._next_scan = 0.0
+
+    @property
+    def queue_depth(self):
+        """Images seen but not handed out yet: still being written or waiting for a batch."""
+        return len(self._pending) + len(self._ready)
+
+    def _stat(self, name):
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _check(self, name, now):
+        """Re-reads one file's size and mtime and moves it to the stage it belongs in."""
+        if not name.lower().endswith(VALID_EXTENSIONS):
+            return
+        stat = self._stat(name)
+        if stat is None:
+            self._index.pop(name, None)
+            self._pending.pop(name, None)
+            self._ready.pop(name, None)
+            return
+        if self._index.get(name) == stat or self._ready.get(name) == stat:
+            return
+        self._ready.pop(name, None)
+        previous = self._pending.get(name)
+        if previous is None or previous[0] != stat:
+            # The quiet period runs from the last modification, so files that were already
+            # complete when the watch started are ready at once.
+            self._pending[name] = (stat, min(now, stat[1] / 1e9))
+
+    def _scan(self, now):
+        names = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    names.add(entry.name)
+                    self._check(entry.name, now)
+        for stale in [name for name in self._index if name not in names]:
+            del self._index[stale]
+        for stale in [name for name in self._pending if name not in names]:
+            del self._pending[stale]
+        for stale in [name for name in self._ready if name not in names]:
+            del self._ready[stale]
+        self._next_scan = now + (RESCAN_INTERVAL if self._inotify is not None else self.poll_interval)
+
+    def _settle(self, now):
+        """Moves files whose size and mtime held still for `debounce` seconds to the ready queue."""
+        for name, (stat, since) in list(self._pending.items()):
+            if now - since < self.debounce:
+                continue
+            current = self._stat(name)
+            del self._pending[name]
+            if current == stat:
+                self._ready[name] = stat
+            elif current is not None:
+                self._pending[name] = (current, min(now, current[1] / 1e9))
+
+    def _wait_time(self, now, timeout):
+        deadline = min(self._next_scan, now + timeout)
+        if self._pending:
+            deadline = min(deadline, min(since for _, since in self._pending.values()) + self.debounce)
+        return max(0.0, deadline - now)
+
+    def next_batch(self, timeout=POLL_INTERVAL, max_batch=MAX_BATCH):
+        """
+        Waits up to `timeout` seconds for settled images and returns up to `max_batch` of their
+        paths in name order (an empty list when nothing is ready). They count as seen from now on.
+        """
+        end = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            if now >= self._next_scan:
+                self._scan(now)
+            self._settle(now)
+            if self._ready:
+                break
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return []
+            wait = self._wait_time(now, remaining)
+            if self._inotify is None:
+                time.sleep(wait)
+                continue
+            names, overflow = self._inotify.read(wait)
+            if overflow:
+                self._next_scan = 0.0
+            now = time.time()
+            for name in names:
+                self._check(name, now)
+        batch = sorted(self._ready)[:max_batch]
+        for name in batch:
+            self._index[name] = self._ready.pop(name)
+        return [os.path.join(self.directory, name) for name in batch]
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None